@@ -3,13 +3,21 @@
   - HuskyLens connected to Arduino Mega via I2C
     SDA = 20, SCL = 21, VCC = 5V, GND = GND
   - HuskyLens should be set to Face Recognition mode + I2C protocol
-  - Arduino prints FACE:<ID> when a recognized face is detected
-  - Also prints debug info (ID, X, Y, W, H)
+  - Arduino reports changes only: ENTER when a recognized face appears,
+    LEAVE when it has not been seen for HOLD_MS
+  - Every event has a sequence number; the Pi answers ACK:<seq> and
+    unacknowledged events are sent again
 
   Serial output examples:
     HuskyLens ready!
-    ID=2  X=114  Y=34  W=48  H=65
-    FACE:2
+    HELLO:2000
+    ENTER:1:2
+    LEAVE:2:2
+
+    FROM:3          (before a resend: oldest event still queued)
+
+  Serial input (from the Pi):
+    ACK:2
 */
 
 #include "HUSKYLENS.h"
@@ -17,12 +25,135 @@
 
 HUSKYLENS huskylens;
 
-// Optional: Set to true if you want only FACE:<ID> lines (less noise)
-bool ONLY_FACE_LINES = false;
+// Optional: false = old protocol, FACE:<ID> for every frame a face is seen
+bool EVENT_MODE = true;
+
+// Optional: Set to false to also print ID/X/Y/W/H debug lines for every frame
+bool ONLY_FACE_LINES = true;
 
 // Optional: If HuskyLens outputs ID=0 when unknown, ignore it
 bool IGNORE_ID_0 = true;
 
+// A face not seen for this long has left (covers missed frames / blinks)
+const unsigned long HOLD_MS = 2000;
+
+// Resend unacknowledged events after this long, doubling up to RETRY_MAX_MS
+const unsigned long ACK_TIMEOUT_MS = 300;
+const unsigned long RETRY_MAX_MS = 5000;
+
+const uint8_t MAX_TRACKED = 64;  // faces in view at once (6 bytes each)
+const uint8_t OUTBOX_SIZE = 16;  // events waiting for an ACK (oldest dropped when full)
+
+struct Tracked {
+  int16_t id;
+  unsigned long lastSeen;
+};
+
+struct Event {
+  uint16_t seq;
+  char kind;  // 'E' = ENTER, 'L' = LEAVE
+  int16_t id;
+};
+
+Tracked tracked[MAX_TRACKED];
+uint8_t trackedCount = 0;
+
+Event outbox[OUTBOX_SIZE];
+uint8_t outHead = 0, outCount = 0;
+uint16_t nextSeq = 1;
+unsigned long lastSend = 0;
+unsigned long retryMs = ACK_TIMEOUT_MS;
+
+char rxBuf[16];
+uint8_t rxLen = 0;
+
+void sendEvent(const Event &e) {
+  Serial.print(e.kind == 'E' ? "ENTER:" : "LEAVE:");
+  Serial.print(e.seq);
+  Serial.print(':');
+  Serial.println(e.id);
+}
+
+void queueEvent(char kind, int16_t id, unsigned long now) {
+  if (outCount == OUTBOX_SIZE) {  // Pi not answering: forget the oldest
+    outHead = (outHead + 1) % OUTBOX_SIZE;
+    outCount--;
+  }
+  Event &e = outbox[(outHead + outCount) % OUTBOX_SIZE];
+  e.seq = nextSeq++;
+  e.kind = kind;
+  e.id = id;
+  if (outCount++ == 0) {
+    lastSend = now;
+    retryMs = ACK_TIMEOUT_MS;
+  }
+  sendEvent(e);
+}
+
+// A face in this frame: ENTER if it was not in view yet
+void faceSeen(int16_t id, unsigned long now) {
+  for (uint8_t i = 0; i < trackedCount; i++) {
+    if (tracked[i].id == id) {
+      tracked[i].lastSeen = now;
+      return;
+    }
+  }
+  if (trackedCount == MAX_TRACKED) return;
+  tracked[trackedCount].id = id;
+  tracked[trackedCount].lastSeen = now;
+  trackedCount++;
+  queueEvent('E', id, now);
+}
+
+// LEAVE for faces not seen for HOLD_MS
+void expireFaces(unsigned long now) {
+  uint8_t i = 0;
+  while (i < trackedCount) {
+    if (now - tracked[i].lastSeen >= HOLD_MS) {
+      queueEvent('L', tracked[i].id, now);
+      tracked[i] = tracked[--trackedCount];
+    } else {
+      i++;
+    }
+  }
+}
+
+// ACK:<seq> acknowledges that event and everything before it. Any ACK means
+// the Pi is listening, so retries stay fast; they only back off while it is silent.
+void handleAck(uint16_t ack) {
+  while (outCount && (uint16_t)(ack - outbox[outHead].seq) < 0x8000) {
+    outHead = (outHead + 1) % OUTBOX_SIZE;
+    outCount--;
+  }
+  retryMs = ACK_TIMEOUT_MS;
+}
+
+void readAcks() {
+  while (Serial.available()) {
+    char c = Serial.read();
+    if (c == '\n' || c == '\r') {
+      rxBuf[rxLen] = '\0';
+      if (rxLen > 4 && strncmp(rxBuf, "ACK:", 4) == 0) handleAck((uint16_t)atol(rxBuf + 4));
+      rxLen = 0;
+    } else if (rxLen < sizeof(rxBuf) - 1) {
+      rxBuf[rxLen++] = c;
+    }
+  }
+}
+
+// Go-back-N: resend everything not yet acknowledged. FROM:<seq> first tells
+// the Pi the oldest event still queued, in case older ones were dropped.
+void resendPending(unsigned long now) {
+  if (!outCount || now - lastSend < retryMs) return;
+  Serial.print("FROM:");
+  Serial.println(outbox[outHead].seq);
+  for (uint8_t i = 0; i < outCount; i++) {
+    sendEvent(outbox[(outHead + i) % OUTBOX_SIZE]);
+  }
+  lastSend = now;
+  retryMs = min(retryMs * 2, RETRY_MAX_MS);
+}
+
 // Small helper to print one result
 void printResult(const HUSKYLENSResult &r) {
   if (!ONLY_FACE_LINES) {
@@ -38,9 +169,11 @@ void printResult(const HUSKYLENSResult &r) {
     Serial.println(r.height);
   }
 
-  // Print the attendance trigger line that Raspberry Pi reads
-  Serial.print("FACE:");
-  Serial.println(r.ID);
+  if (!EVENT_MODE) {
+    // Print the attendance trigger line that Raspberry Pi reads
+    Serial.print("FACE:");
+    Serial.println(r.ID);
+  }
 }
 
 void setup() {
@@ -54,12 +187,25 @@ void setup() {
   }
 
   Serial.println("HuskyLens ready!");
+  if (EVENT_MODE) {
+    // Tells the Pi that sequence numbers start again
+    Serial.print("HELLO:");
+    Serial.println(HOLD_MS);
+  }
 }
 
 void loop() {
+  unsigned long now = millis();
+  readAcks();
+
   // Request latest recognition results
   if (!huskylens.request()) {
     if (!ONLY_FACE_LINES) Serial.println("Request failed");
+    // Nobody is in view as far as we know: faces still time out and unacked events still go out
+    if (EVENT_MODE) {
+      expireFaces(now);
+      resendPending(now);
+    }
     delay(100);
     return;
   }
@@ -83,8 +229,13 @@ void loop() {
       continue;
     }
 
-    // Trigger for Pi logging
     printResult(result);
+    if (EVENT_MODE) faceSeen(result.ID, now);
+  }
+
+  if (EVENT_MODE) {
+    expireFaces(now);
+    resendPending(now);
   }
 
   delay(100);
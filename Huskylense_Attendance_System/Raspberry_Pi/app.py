@@ -1,24 +1,122 @@
 # File: raspberry_pi/app.py
 
 import os
+import re
 import csv
 import io
+import html
+import json
 import time
+import heapq
+import random
+import itertools
+import socket
+import sys
 import threading
 import sqlite3
-from datetime import datetime, date
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+from urllib.parse import quote, urlencode
 
-from flask import Flask, request, redirect, render_template_string, send_file, abort
+from flask import Blueprint, Flask, Response, current_app, request, redirect, render_template_string, send_file, abort, jsonify
+from werkzeug.wsgi import ClosingIterator
 
 # =========================
 # CONFIG
 # =========================
 DB_PATH = os.getenv("ATTENDANCE_DB", "attendance.db")
-SERIAL_PORT = os.getenv("SERIAL_PORT", "/dev/ttyACM0")
+# Constrained-memory profile for 512 MB boards (Pi Zero class): smaller pages, chunks,
+# caches and worker counts. Any of the settings below can still be set explicitly.
+LOW_MEMORY = os.getenv("LOW_MEMORY", "0") == "1"
+SERIAL_PORT = os.getenv("SERIAL_PORT", "/dev/ttyACM0")  # device path or pyserial URL (e.g. loop://)
 BAUDRATE = int(os.getenv("BAUDRATE", "115200"))
 COOLDOWN_SECONDS = int(os.getenv("COOLDOWN", "60"))  # once per minute per student
+BUCKET_SECONDS = int(os.getenv("BUCKET", str(COOLDOWN_SECONDS)))  # at most one record per ID per bucket per source
 SERVER_HOST = os.getenv("HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("PORT", "5000"))
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50" if LOW_MEMORY else "100"))  # rows per page in /attendance, /users and the search API
+DB_CACHE_KB = int(os.getenv("DB_CACHE_KB", "512" if LOW_MEMORY else "2000"))  # SQLite page cache (2000 = SQLite default)
+LAST_SEEN_MAX = int(os.getenv("LAST_SEEN_MAX", "1024" if LOW_MEMORY else "8192"))  # face IDs tracked for the cooldown
+HISTORY_CACHE_MAX = int(os.getenv("HISTORY_CACHE_MAX", "2048" if LOW_MEMORY else "32768"))  # cached name/class snapshots
+RECENT_EVENTS = int(os.getenv("RECENT_EVENTS", "64" if LOW_MEMORY else "256"))  # serial events kept for /diagnostics
+TRACEMALLOC = int(os.getenv("TRACEMALLOC", "0"))  # >0: trace allocations from start-up, this many frames deep
+
+# Multi-site hosting: several schools/campuses in one process, each with its own DB
+# file and serial ports: "name=db_path,port,port;name=db_path". "" = one site from
+# ATTENDANCE_DB/SERIAL_PORT. A site is served under /<name>/ or on a host named <name>.*
+TENANTS = os.getenv("TENANTS", "")
+
+# Live figures on the dashboard and /metrics, streamed from the site's cameras (no DB reads)
+LIVE_WINDOW = int(os.getenv("LIVE_WINDOW", "60"))  # minutes of arrivals and door queue kept, one slot per minute
+OCCUPANCY_MINUTES = int(os.getenv("OCCUPANCY_MINUTES", "50"))  # a student counts as in the room this long after arriving
+
+# Profiling (/profile): needs ADMIN_TOKEN, or a browser on the Pi itself when no token is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+PROFILE_HZ = int(os.getenv("PROFILE_HZ", "100"))  # stack samples per second while a window runs
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))  # longest profiling window
+SLOW_SQL_MS = float(os.getenv("SLOW_SQL_MS", "250"))  # log statements slower than this with their plan, 0 = off
+SLOW_SQL_KEEP = int(os.getenv("SLOW_SQL_KEEP", "50"))  # slow statements kept for /profile
+
+# DB scheduling: check-ins always go first; exports/analytics run in chunks and
+# at most N at a time per endpoint class ("endpoint=N,..."), else 503 after DB_ADMIT_WAIT s.
+DB_ADMIT = os.getenv("DB_ADMIT", "export=1,analytics=2,api=4")
+DB_ADMIT_WAIT = float(os.getenv("DB_ADMIT_WAIT", "2"))
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "500" if LOW_MEMORY else "2000"))  # rows per DB slot when streaming exports
+PARQUET_ROWS = int(os.getenv("PARQUET_ROWS", "8192" if LOW_MEMORY else "65536"))  # rows per Parquet row group / Arrow batch
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+# Page query results are shared by all viewers until the next write
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", "32" if LOW_MEMORY else "256"))
+QUERY_CACHE_MB = float(os.getenv("QUERY_CACHE_MB", "1" if LOW_MEMORY else "8"))
+
+# Read replica: dashboard pages read an in-memory copy of the DB instead of the SD card.
+# Costs RAM: the copy holds users, classes and the last REPLICA_DAYS of check-ins.
+REPLICA = os.getenv("REPLICA", "0") == "1"
+REPLICA_DAYS = int(os.getenv("REPLICA_DAYS", "120"))  # older check-ins are kept as daily presence rows in the copy
+
+# Online backups (snapshots of the live DB, taken without stopping check-ins)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = max(int(os.getenv("BACKUP_KEEP", "7")), 1)  # newest snapshots kept (at least the one just made), older ones deleted
+BACKUP_GZIP = os.getenv("BACKUP_GZIP", "0") == "1"
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))  # DB pages copied per step before yielding
+
+# Background jobs: cron syntax "minute hour day month weekday" in local time, "" = disabled
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1" if LOW_MEMORY else "2"))
+BACKUP_CRON = os.getenv("BACKUP_CRON", "30 2 * * *")
+ROLLUP_CRON = os.getenv("ROLLUP_CRON", "10 0 * * *")  # daily per-class totals
+ROLLUP_LOOKBACK = int(os.getenv("ROLLUP_LOOKBACK", "7"))  # days re-counted each run (late sync batches)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))  # raw check-ins older than this become daily presence rows, 0 = keep all
+COMPACT_CRON = os.getenv("COMPACT_CRON", "40 0 * * *")
+COMPACT_WINDOW = int(os.getenv("COMPACT_WINDOW", "3600"))  # seconds of check-ins compacted per DB slot
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", "256"))  # freed pages handed back to the file system per step
+
+# Term reports: one process per class, all cores by default
+REPORT_DIR = os.getenv("REPORT_DIR", "reports")
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "1" if LOW_MEMORY else str(os.cpu_count() or 1)))
+
+# Notifications: comma-separated "sink:address", optionally "#Class" for one class only.
+# Sinks: webhook:<url>, email:<address> (via SMTP_HOST), file:<path> (JSON lines). Empty = off.
+NOTIFY_TO = os.getenv("NOTIFY_TO", "")
+NOTIFY_COALESCE = int(os.getenv("NOTIFY_COALESCE", "10"))  # seconds of events gathered into one message
+NOTIFY_BATCH = int(os.getenv("NOTIFY_BATCH", "200"))  # events per message at most
+NOTIFY_RETRY_BASE = int(os.getenv("NOTIFY_RETRY_BASE", "30"))  # first retry after a failed send, doubling
+NOTIFY_RETRY_MAX = int(os.getenv("NOTIFY_RETRY_MAX", "3600"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "12"))  # then kept as failed until retried by hand
+NOTIFY_BUFFER = int(os.getenv("NOTIFY_BUFFER", "200" if LOW_MEMORY else "1000"))  # events waiting to be queued
+NOTIFY_FROM = os.getenv("NOTIFY_FROM", f"attendance@{socket.gethostname()}")
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+ABSENCE_CRON = os.getenv("ABSENCE_CRON", "")  # end of session, e.g. "0 10 * * 1-5"; "" = Run now on /jobs only
+
+# Store-and-forward sync (node -> aggregator). Leave SYNC_URL empty to disable.
+NODE_ID = os.getenv("NODE_ID", socket.gethostname())
+SYNC_URL = os.getenv("SYNC_URL", "")  # aggregator base URL, e.g. http://192.168.1.10:5000
+SYNC_TOKEN = os.getenv("SYNC_TOKEN", "")  # shared secret; /sync/ingest refuses every batch without it
+SYNC_BATCH = int(os.getenv("SYNC_BATCH", "500"))  # records per batch
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "10"))  # seconds between polls when idle
+SYNC_MAX_BACKOFF = float(os.getenv("SYNC_MAX_BACKOFF", "300"))  # cap for retry backoff while offline
+SYNC_MAX_BYTES = int(os.getenv("SYNC_MAX_BYTES", str(16 * 1024 * 1024)))  # largest batch /sync/ingest takes, sent and unpacked
 
 LOGO_URL = os.getenv(
     "LOGO_URL",
@@ -28,60 +126,916 @@ LOGO_URL = os.getenv(
 # =========================
 # OPTIONAL SERIAL (Arduino)
 # =========================
-ser = None
-SERIAL_OK = False
-SERIAL_ERROR = ""
-
-try:
-    import serial  # pyserial
-    ser = serial.Serial(SERIAL_PORT, BAUDRATE, timeout=1)
-    SERIAL_OK = True
-except Exception as e:
-    SERIAL_OK = False
-    SERIAL_ERROR = str(e)
+class SerialSource:
+    """One serial port of a tenant, opened by its reader thread (not at import time)."""
+
+    def __init__(self, port: str):
+        self.port = port
+        self.ser = None
+        self.ok = False
+        self.error = "Not started"
+        self.link = SerialLink()  # ENTER/LEAVE sequence state of the sketch on this port
+
+    def open(self) -> bool:
+        try:
+            import serial  # pyserial, only needed once the reader starts
+            self.ser = serial.serial_for_url(self.port, BAUDRATE, timeout=1)
+            self.ok = True
+            self.error = ""
+        except Exception as e:
+            self.ok = False
+            self.error = str(e)
+        return self.ok
 
 # =========================
 # DATABASE
 # =========================
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-conn.row_factory = sqlite3.Row
-cur = conn.cursor()
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS classes (
-    classname TEXT PRIMARY KEY
-);
-""")
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY,
-    name TEXT NOT NULL,
-    class TEXT NOT NULL,
-    UNIQUE(name COLLATE NOCASE)
-);
-""")
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS records (
-    id INTEGER,
-    name TEXT,
-    class TEXT,
-    time TEXT
-);
-""")
-
-conn.commit()
-
-db_lock = threading.Lock()
+# Bump when init_schema() changes; databases already at this version skip
+# every CREATE/migration statement on startup.
+SCHEMA_VERSION = 7
 
-# =========================
-# APP
-# =========================
-app = Flask(__name__)
+def init_schema(cur):
+    cur.execute("PRAGMA user_version")
+    if cur.fetchone()[0] == SCHEMA_VERSION:
+        return
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS classes (
+        classname TEXT PRIMARY KEY
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        class TEXT NOT NULL,
+        UNIQUE(name COLLATE NOCASE)
+    );
+    """)
+
+    # Compact check-in log: integer references only (user, class, source, epoch
+    # time). Name/class as they were at check-in time live in user_history, so
+    # renaming a user in /edit_user never rewrites history.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS class_ids (
+        cid INTEGER PRIMARY KEY,
+        classname TEXT NOT NULL UNIQUE
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS source_ids (
+        sid INTEGER PRIMARY KEY,
+        source TEXT NOT NULL UNIQUE
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS user_history (
+        hid INTEGER PRIMARY KEY,
+        uid INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        cid INTEGER NOT NULL,
+        valid_from INTEGER NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_history_uid ON user_history(uid)")
+
+    # Natural key: one row per face ID, time bucket and source (node that logged it),
+    # so retries, replays and restarts inside the cooldown window are no-ops.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS checkins (
+        seq INTEGER PRIMARY KEY,
+        hid INTEGER NOT NULL,
+        uid INTEGER NOT NULL,
+        cid INTEGER NOT NULL,
+        sid INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        UNIQUE(bucket, uid, sid)
+    );
+    """)
+    # The natural key leads with bucket, so it doubles as the time index.
+    # Per-class and per-name lookups also keep bucket order (newest first pages).
+    cur.execute("DROP INDEX IF EXISTS idx_checkins_cid_ts")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_checkins_cid ON checkins(cid, bucket)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_checkins_hid ON checkins(hid, bucket)")
+
+    cur.execute("SELECT type FROM sqlite_master WHERE name='records'")
+    row = cur.fetchone()
+    if row and row["type"] == "table":
+        # Older databases keep name/class/time as TEXT in a records table.
+        cur.execute("PRAGMA table_info(records)")
+        record_cols = {r["name"] for r in cur.fetchall()}
+        source_col = "source" if "source" in record_cols else "NULL"
+        cur.execute("ALTER TABLE records RENAME TO records_legacy")
+        cur.execute(f"""
+        CREATE TEMP TABLE legacy AS
+        SELECT rowid AS seq, id, COALESCE(name, '') AS name, COALESCE(class, '') AS class,
+               COALESCE({source_col}, ?) AS source, CAST(strftime('%s', time, 'utc') AS INTEGER) AS ts
+        FROM records_legacy WHERE id IS NOT NULL AND time IS NOT NULL
+        """, (NODE_ID,))
+        cur.execute("INSERT OR IGNORE INTO class_ids(classname) SELECT DISTINCT class FROM legacy")
+        cur.execute("INSERT OR IGNORE INTO source_ids(source) SELECT DISTINCT source FROM legacy")
+        cur.execute("""
+        INSERT INTO user_history(uid, name, cid, valid_from)
+        SELECT l.id, l.name, k.cid, MIN(l.ts) FROM legacy l JOIN class_ids k ON k.classname = l.class
+        GROUP BY l.id, l.name, k.cid ORDER BY MIN(l.ts)
+        """)
+        # Keep seq (sync high-water mark) and the first row of each duplicate
+        cur.execute("""
+        INSERT OR IGNORE INTO checkins(seq, hid, uid, cid, sid, ts, bucket)
+        SELECT l.seq, h.hid, l.id, k.cid, s.sid, l.ts, l.ts / ?
+        FROM legacy l
+        JOIN class_ids k ON k.classname = l.class
+        JOIN source_ids s ON s.source = l.source
+        JOIN user_history h ON h.uid = l.id AND h.name = l.name AND h.cid = k.cid
+        ORDER BY l.seq
+        """, (BUCKET_SECONDS,))
+        kept = cur.rowcount
+        cur.execute("DROP TABLE records_legacy")
+        cur.execute("DROP TABLE legacy")
+        cur.connection.commit()
+        # The file is rewritten anyway: switch it to incremental vacuum on the way
+        cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cur.execute("VACUUM")
+        print(f"[INFO] Migrated records to compact checkins ({kept} rows kept)")
+
+    # Same columns the pages and CSV export always read (id, name, class, time)
+    cur.execute("DROP VIEW IF EXISTS records")
+    cur.execute("""
+    CREATE VIEW records AS
+    SELECT c.seq AS seq, c.uid AS id, h.name AS name, k.classname AS class,
+           datetime(c.ts, 'unixepoch', 'localtime') AS time, s.source AS source,
+           c.ts AS ts, c.bucket AS bucket, c.cid AS cid, c.hid AS hid
+    FROM checkins c
+    JOIN user_history h ON h.hid = c.hid
+    JOIN class_ids k ON k.cid = c.cid
+    JOIN source_ids s ON s.sid = c.sid;
+    """)
+
+    # Name search: FTS5 prefix indexes over current names (users) and the names
+    # records were logged under (user_history). Kept in sync by triggers.
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            name, content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        );
+        """)
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            name, content='user_history', content_rowid='hid', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        );
+        """)
+    except sqlite3.OperationalError:
+        # SQLite built without FTS5: search falls back to name prefix LIKE
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_history_name ON user_history(name COLLATE NOCASE)")
+    else:
+        cur.executescript("""
+        CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts(rowid, name) VALUES (new.id, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts(users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE ON users BEGIN
+            INSERT INTO users_fts(users_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO users_fts(rowid, name) VALUES (new.id, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON user_history BEGIN
+            INSERT INTO history_fts(rowid, name) VALUES (new.hid, new.name);
+        END;
+        """)
+        cur.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+        cur.execute("INSERT INTO history_fts(history_fts) VALUES ('rebuild')")
+
+    # Sync bookkeeping: key/value state on the node, one row per node on the aggregator
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sync_peers (
+        node TEXT PRIMARY KEY,
+        epoch TEXT NOT NULL,
+        last_seq INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        last_sync TEXT
+    );
+    """)
+
+    # Background jobs: last run of each job, and the daily rollup it maintains
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS job_state (
+        name TEXT PRIMARY KEY,
+        last_run INTEGER NOT NULL,
+        duration REAL NOT NULL DEFAULT 0,
+        result TEXT,
+        error TEXT,
+        runs INTEGER NOT NULL DEFAULT 0,
+        failures INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS daily_summary (
+        day TEXT NOT NULL,
+        cid INTEGER NOT NULL,
+        checkins INTEGER NOT NULL,
+        students INTEGER NOT NULL,
+        PRIMARY KEY(day, cid)
+    ) WITHOUT ROWID;
+    """)
+
+    # Compacted history: check-ins older than RETENTION_DAYS, one row per student,
+    # day and source with first/last seen and the number of check-ins it replaced
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS presence (
+        cid INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        uid INTEGER NOT NULL,
+        hid INTEGER NOT NULL,
+        sid INTEGER NOT NULL,
+        first_ts INTEGER NOT NULL,
+        last_ts INTEGER NOT NULL,
+        hits INTEGER NOT NULL,
+        PRIMARY KEY(cid, day, uid, hid, sid)
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_presence_day ON presence(day)")
+
+    # Outgoing notifications: one row per event per recipient until delivered
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS notify_queue (
+        id INTEGER PRIMARY KEY,
+        recipient TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created INTEGER NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_try INTEGER NOT NULL,
+        error TEXT
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_notify_queue_recipient ON notify_queue(recipient, next_try)")
+
+    # Only insert if empty
+    cur.execute("SELECT COUNT(*) AS c FROM classes")
+    if cur.fetchone()["c"] == 0:
+        cur.executemany("INSERT OR IGNORE INTO classes(classname) VALUES (?)", [
+            ("Class A",),
+            ("Class B",),
+        ])
+
+    cur.execute("SELECT 1 FROM sync_state WHERE key='epoch'")
+    if cur.fetchone() is None:
+        new_sync_epoch(cur)
+
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    cur.connection.commit()
+
+
+class DbBusy(Exception):
+    """An endpoint class is at its DB_ADMIT cap; the request gets a 503."""
+
+
+class DbScheduler:
+    """Hands the shared connection to one job at a time, highest priority first.
+
+    Priorities: ingest (check-ins) > web (pages, admin edits) > heavy (export and
+    analytics chunks) > background. A waiting check-in jumps every queued job,
+    and heavy jobs give the connection back between chunks, so a check-in waits
+    at most one chunk. Heavy endpoints are also admission controlled (DB_ADMIT).
+    """
+
+    PRIORITIES = {"ingest": 0, "web": 1, "heavy": 2, "background": 3}
+    WAIT_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5)
+
+    def __init__(self, caps: dict):
+        self.caps = caps
+        self._cond = threading.Condition()
+        self._busy = False
+        self._queue = []  # heap of (priority, ticket)
+        self._tickets = itertools.count()
+        self.admitted = {e: 0 for e in caps}
+        self.rejected = {e: 0 for e in caps}
+        # Per priority class: jobs, total/max queueing delay, total hold time, wait histogram
+        self.stats = {
+            job: {"count": 0, "wait": 0.0, "wait_max": 0.0, "hold": 0.0, "buckets": [0] * len(self.WAIT_BUCKETS)}
+            for job in self.PRIORITIES
+        }
+
+    @contextmanager
+    def slot(self, job: str = "web"):
+        entry = (self.PRIORITIES[job], next(self._tickets))
+        t0 = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            while self._busy or self._queue[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._queue)
+            self._busy = True
+        t1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            t2 = time.perf_counter()
+            with self._cond:
+                self._busy = False
+                st = self.stats[job]
+                st["count"] += 1
+                st["wait"] += t1 - t0
+                st["wait_max"] = max(st["wait_max"], t1 - t0)
+                st["hold"] += t2 - t1
+                for i, le in enumerate(self.WAIT_BUCKETS):
+                    if t1 - t0 <= le:
+                        st["buckets"][i] += 1
+                self._cond.notify_all()
+
+    def admit(self, endpoint: str):
+        # Returns a release() callable; raises DbBusy if the cap stays full for DB_ADMIT_WAIT
+        cap = self.caps.get(endpoint)
+        if cap is None:
+            return lambda: None
+        deadline = time.monotonic() + DB_ADMIT_WAIT
+        with self._cond:
+            while self.admitted[endpoint] >= cap:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    self.rejected[endpoint] += 1
+                    raise DbBusy(endpoint)
+                self._cond.wait(left)
+            self.admitted[endpoint] += 1
+
+        def release():
+            with self._cond:
+                self.admitted[endpoint] -= 1
+                self._cond.notify_all()
+        return release
+
+    def pause(self, job: str):
+        # Inside slot(job): let every queued job run, then take the connection back
+        entry = (self.PRIORITIES[job], next(self._tickets))
+        with self._cond:
+            if not self._queue:
+                return
+            self._busy = False
+            heapq.heappush(self._queue, entry)
+            self._cond.notify_all()
+            while self._busy or self._queue[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._queue)
+            self._busy = True
+
+    @contextmanager
+    def admitted_as(self, endpoint: str):
+        release = self.admit(endpoint)
+        try:
+            yield
+        finally:
+            release()
+
+
+def parse_caps(spec: str) -> dict:
+    caps = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, n = part.split("=", 1)
+            caps[name.strip()] = max(int(n), 1)
+    return caps
+
+
+def approx_size(value) -> int:
+    # Rough in-memory size of a cached result (rows, tuples, dicts, scalars)
+    if isinstance(value, (list, tuple, set, sqlite3.Row)):
+        return sys.getsizeof(value) + sum(approx_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """Query results keyed by (query name, parameters), tagged with the data version.
+
+    Every write path bumps AttendanceDB.version, so an entry computed before the
+    write is never served again. Least recently used entries are dropped past
+    max_entries/max_bytes, and concurrent misses on one key wait for a single
+    computation instead of all hitting the DB.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, size, value)
+        self._inflight = {}  # key -> Event set when the computing request is done
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: tuple, version: int, compute):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                done = self._inflight.get(key)
+                if done is None:
+                    done = self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            done.wait()
+
+        try:
+            value = compute()
+            size = approx_size(key) + approx_size(value)
+            with self._lock:
+                self._drop(key)
+                if size <= self.max_bytes:
+                    self._entries[key] = (version, size, value)
+                    self.bytes += size
+                    while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                        self._drop(next(iter(self._entries)))
+                        self.evictions += 1
+            return value
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            done.set()
+
+    def _drop(self, key):
+        # Caller holds self._lock
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.bytes -= entry[1]
+
+
+class SlowSqlLog:
+    """Statements slower than SLOW_SQL_MS, newest last, with their query plan.
+
+    Only written by TimedCursor, i.e. by whoever holds the DB slot, so no lock.
+    """
+
+    def __init__(self, keep: int):
+        self.entries = deque(maxlen=keep)
+        self.total = 0
+        self._plans = {}  # sql -> plan lines, so a hot slow query is explained once
+
+    def add(self, conn, sql: str, params, seconds: float) -> dict:
+        plan = self._plans.get(sql)
+        if plan is None:
+            try:
+                rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            except sqlite3.Error:
+                rows = []
+            depth = {0: -1}
+            plan = []
+            for node, parent, _, detail in rows:
+                depth[node] = depth.get(parent, -1) + 1
+                plan.append("  " * depth[node] + detail)
+            if len(self._plans) >= 256:
+                self._plans.clear()
+            self._plans[sql] = plan
+        entry = {
+            "ts": time.time(), "ms": seconds * 1000, "where": current_route(),
+            "sql": " ".join(sql.split()), "params": repr(params)[:200], "plan": plan,
+        }
+        self.entries.append(entry)
+        self.total += 1
+        print(f"[WARN] Slow SQL ({entry['ms']:.0f} ms, {entry['where']}): {entry['sql'][:200]}")
+        return entry
+
+
+slow_sql = SlowSqlLog(SLOW_SQL_KEEP)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports statements slower than SLOW_SQL_MS to slow_sql.
+
+    execute(), executemany() and executescript() are all timed. SQLite does
+    most of a SELECT's work while rows are fetched, so the time of the fetch
+    calls after execute() is added to the statement's total.
+    """
+
+    _sql = None
+    _spent = 0.0
+    _entry = None
+
+    def execute(self, sql, params=()):
+        self._sql, self._params, self._spent, self._entry = sql, params, 0.0, None
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._add(time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_params):
+        # The first row stands in for all of them in the log and the query plan
+        first = seq_of_params[0] if isinstance(seq_of_params, (list, tuple)) and seq_of_params else ()
+        self._sql, self._params, self._spent, self._entry = sql, first, 0.0, None
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_params)
+        finally:
+            self._add(time.perf_counter() - t0)
+
+    def executescript(self, sql_script):
+        self._sql, self._params, self._spent, self._entry = sql_script, (), 0.0, None
+        t0 = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._add(time.perf_counter() - t0)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._add(time.perf_counter() - t0)
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._add(time.perf_counter() - t0)
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._add(time.perf_counter() - t0)
+
+    def _add(self, seconds: float):
+        self._spent += seconds
+        if self._entry is not None:
+            self._entry["ms"] = self._spent * 1000
+        elif self._sql is not None and self._spent * 1000 >= SLOW_SQL_MS:
+            self._entry = slow_sql.add(self.connection, self._sql, self._params, self._spent)
+
+
+class AttendanceDB:
+    """One SQLite connection shared by request handlers and background threads.
+
+    Nothing touches the file until the first cursor() call, which also runs
+    the one-time schema check. Access is ordered by a DbScheduler.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sched = DbScheduler(parse_caps(DB_ADMIT))
+        self.cache = QueryCache(QUERY_CACHE_ENTRIES, int(QUERY_CACHE_MB * 1024 * 1024))
+        self.version = 0  # bumped by every write that can change a page
+        self.replica = ReadReplica(self) if REPLICA else None
+        self._conn = None
+        self.fts = False
+        # Lookups for the compact checkins table, filled on demand
+        self.class_ids = {}    # {classname: cid}
+        self.source_ids = {}   # {source: sid}
+        self.history_ids = {}  # {(uid, name, cid): hid}
+
+    def connect(self) -> sqlite3.Connection:
+        # Caller holds a scheduler slot
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # REPLACE must fire the FTS delete triggers too
+            conn.execute("PRAGMA recursive_triggers = ON")
+            conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KB}")
+            if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+                # New file: pages freed by the retention job can be handed back later
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            init_schema(conn.cursor())
+            self.fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name='users_fts'").fetchone() is not None
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def cursor(self, job: str = "web"):
+        with self.sched.slot(job):
+            yield self.connect().cursor(TimedCursor if SLOW_SQL_MS > 0 else sqlite3.Cursor)
+        if self.replica is not None:
+            # Copies taken by changed() go in once the file's slot is free again
+            self.replica.apply_pending()
+
+    @contextmanager
+    def reader(self, job: str = "web"):
+        # cursor() for pages that only read: the in-memory replica once it is live
+        replica = self.replica
+        if replica is not None:
+            with replica.sched.slot(job):
+                if replica.live:
+                    yield replica.conn.cursor(TimedCursor if SLOW_SQL_MS > 0 else sqlite3.Cursor)
+                    return
+        with self.cursor(job) as cur:
+            yield cur
+
+    def changed(self, cur=None, tables: tuple = ()):
+        # Call after committing a write, still inside the cursor() block. With cur,
+        # the replica picks up new check-ins and re-copies `tables` (see ReadReplica)
+        if self.replica is not None and cur is not None:
+            self.replica.refresh(cur, tables)
+        self.version += 1
+
+    # The lookups below run inside cursor() blocks
+    def class_id(self, cur, classname: str) -> int:
+        cid = self.class_ids.get(classname)
+        if cid is None:
+            cur.execute("INSERT OR IGNORE INTO class_ids(classname) VALUES (?)", (classname,))
+            cur.execute("SELECT cid FROM class_ids WHERE classname=?", (classname,))
+            cid = self.class_ids[classname] = cur.fetchone()["cid"]
+        return cid
+
+    def source_id(self, cur, source: str) -> int:
+        sid = self.source_ids.get(source)
+        if sid is None:
+            cur.execute("INSERT OR IGNORE INTO source_ids(source) VALUES (?)", (source,))
+            cur.execute("SELECT sid FROM source_ids WHERE source=?", (source,))
+            sid = self.source_ids[source] = cur.fetchone()["sid"]
+        return sid
+
+    def history_id(self, cur, uid: int, name: str, classname: str, ts: int) -> int:
+        # Latest snapshot with exactly this name/class, created on first sight
+        key = (uid, name, self.class_id(cur, classname))
+        hid = self.history_ids.get(key)
+        if hid is None:
+            cur.execute("SELECT MAX(hid) AS hid FROM user_history WHERE uid=? AND name=? AND cid=?", key)
+            hid = cur.fetchone()["hid"]
+            if hid is None:
+                cur.execute("INSERT INTO user_history(uid, name, cid, valid_from) VALUES (?,?,?,?)", key + (ts,))
+                hid = cur.lastrowid
+            self._remember_history(key, hid)
+        return hid
+
+    def snapshot_user(self, cur, uid: int, name: str, classname: str) -> None:
+        # Registration/edit starts a new history entry; older check-ins keep theirs
+        key = (uid, name, self.class_id(cur, classname))
+        cur.execute("INSERT INTO user_history(uid, name, cid, valid_from) VALUES (?,?,?,?)", key + (int(time.time()),))
+        self._remember_history(key, cur.lastrowid)
+
+    def _remember_history(self, key: tuple, hid: int) -> None:
+        # Bounded: a full cache is simply dropped and refilled from user_history
+        if len(self.history_ids) >= HISTORY_CACHE_MAX:
+            self.history_ids.clear()
+        self.history_ids[key] = hid
+
+
+class ReadReplica:
+    """In-memory copy of the DB that dashboard pages read instead of the file (REPLICA=1).
+
+    Built with the backup API in the background, on the file's own connection
+    and BACKUP_PAGES pages per DB slot. Check-ins older than REPLICA_DAYS are then
+    folded into presence rows the way compact_checkins() does, so the copy stays
+    small while totals still match the file. Every write reads what changed inside
+    its DB slot: rows added to the append-only tables by rowid, small tables a
+    write names whole, while bulk changes to check-ins (compaction, reset) mark
+    the copy for a new build. Those copies are applied after the file's slot is
+    released, so a write never waits on pages reading the replica. Until it is
+    live, reads go to the file.
+    """
+
+    APPENDED = (("checkins", "seq"), ("user_history", "hid"), ("class_ids", "cid"), ("source_ids", "sid"))
+    TABLES = ("users", "classes", "daily_summary")  # copied whole when named by a write
+
+    def __init__(self, db: AttendanceDB):
+        self.db = db
+        self.tenant = None  # owner, from the first rebuild(tenant): the build thread works for it
+        self.sched = DbScheduler({})
+        self.conn = None
+        self.live = False
+        self.ids = {}  # table -> highest rowid copied
+        self.folded = 0  # check-ins folded into presence at the last build
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.error = ""
+        self._lock = threading.Lock()
+        self._pending = []  # (table, rows, whole) read by refresh(), None = build again
+        self._building = False
+        self._again = False
+
+    def rebuild(self, tenant=None):
+        # Reads go back to the file until a fresh copy is live. Not inside a file DB slot.
+        with self.sched.slot("ingest"):
+            self.live = False
+        with self._lock:
+            self._again = True
+            if self._building:
+                return
+            self._building = True
+        self.tenant = tenant or self.tenant or current_tenant()
+        spawn(self.tenant, self._build_loop, "replica")
+
+    def _build_loop(self):
+        while True:
+            with self._lock:
+                if not self._again:
+                    self._building = False
+                    return
+                self._again = False
+            try:
+                self._build()
+            except Exception as e:
+                self.error = str(e) or type(e).__name__
+                print(f"[WARN] Read replica of {self.db.path} not built: {self.error}")
+
+    def _build(self):
+        db = self.db
+        t0 = time.perf_counter()
+        with self.sched.slot("ingest"):
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            with self._lock:
+                self._pending = []
+
+        mem = sqlite3.connect(":memory:", check_same_thread=False)
+        mem.row_factory = sqlite3.Row
+        with db.cursor("background") as cur:
+            cur.connection.backup(mem, pages=BACKUP_PAGES, progress=lambda *_: db.sched.pause("background"))
+            ids = {}
+            for table, key in self.APPENDED:
+                cur.execute(f"SELECT COALESCE(MAX({key}), 0) FROM {table}")
+                ids[table] = cur.fetchone()[0]
+
+        folded = 0
+        if REPLICA_DAYS > 0:
+            # Nobody reads the copy yet, so this runs in one go
+            cutoff = day_start((date.today() - timedelta(days=REPLICA_DAYS)).isoformat())
+            args = (cutoff // BUCKET_SECONDS, cutoff)
+            mem.execute(
+                "INSERT INTO presence(cid, day, uid, hid, sid, first_ts, last_ts, hits) "
+                "SELECT cid, date(ts, 'unixepoch', 'localtime'), uid, hid, sid, MIN(ts), MAX(ts), COUNT(*) FROM checkins "
+                "WHERE bucket <= ? AND ts < ? GROUP BY 1, 2, 3, 4, 5 "
+                "ON CONFLICT(cid, day, uid, hid, sid) DO UPDATE SET first_ts=MIN(first_ts, excluded.first_ts), "
+                "last_ts=MAX(last_ts, excluded.last_ts), hits=hits+excluded.hits",
+                args,
+            )
+            folded = mem.execute("DELETE FROM checkins WHERE bucket <= ? AND ts < ?", args).rowcount
+            mem.commit()
+            if folded:
+                # Hand the freed pages back (the copy keeps the file's auto_vacuum mode)
+                if mem.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                    mem.execute("PRAGMA incremental_vacuum").fetchall()
+                else:
+                    mem.execute("VACUUM")
+
+        with db.cursor("background") as cur:
+            if self._again:
+                mem.close()
+                return
+            # Catch up with everything written while the old days were folded;
+            # apply_pending() on leaving this block puts the copy live
+            self.ids, self.folded = ids, folded
+            copies = self._changes(cur, self.TABLES)
+            with self._lock:
+                self.conn, self._pending = mem, copies
+        self.builds += 1
+        self.build_seconds = time.perf_counter() - t0
+        self.error = ""
+        print(f"[OK] Read replica of {db.path}: {self.size() // 1024} KB in {self.build_seconds:.1f}s")
+
+    def refresh(self, cur, tables: tuple = ()):
+        # Inside the file's cursor() block, after a commit: reads what changed for apply_pending()
+        if self.conn is None:
+            return
+        if "checkins" in tables:
+            # Rewritten in bulk (compaction, reset): copy everything again
+            with self._lock:
+                self._pending.append(None)
+            return
+        copies = self._changes(cur, tables)
+        with self._lock:
+            self._pending.extend(copies)
+
+    def _changes(self, cur, tables: tuple) -> list:
+        copies = []
+        for table in tables:
+            cur.execute(f"SELECT * FROM {table}")
+            copies.append((table, cur.fetchall(), True))
+        for table, key in self.APPENDED:
+            cur.execute(f"SELECT * FROM {table} WHERE {key} > ? ORDER BY {key}", (self.ids[table],))
+            rows = cur.fetchall()
+            if rows:
+                self.ids[table] = rows[-1][key]
+                copies.append((table, rows, False))
+        return copies
+
+    def apply_pending(self):
+        # After the file's DB slot is released. Copies go in the order refresh() read
+        # them; whoever gets the replica's slot first applies everyone's.
+        if not self._pending and (self.live or self.conn is None):
+            return
+        with self.sched.slot("ingest"):
+            with self._lock:
+                pending, conn = self._pending, self.conn
+                self._pending = []
+            if conn is None:
+                return
+            again = None in pending
+            if again:
+                # Reads go back to the file until the new copy is live
+                self.live = False
+                with self._lock:
+                    self.conn = None
+                conn.close()
+            else:
+                for table, rows, whole in pending:
+                    if whole:
+                        conn.execute(f"DELETE FROM {table}")
+                    if rows:
+                        marks = ",".join("?" * len(rows[0]))
+                        conn.executemany(f"INSERT OR IGNORE INTO {table}({','.join(rows[0].keys())}) VALUES ({marks})", rows)
+                conn.commit()
+                self.live = True
+        if again:
+            self.rebuild()
+        # Pages cached from the copy before these rows went in are stale now
+        self.db.version += 1
+
+    def size(self) -> int:
+        # Bytes held by the copy, 0 while it is not live
+        with self.sched.slot("web"):
+            if not self.live:
+                return 0
+            return self.conn.execute("PRAGMA page_count").fetchone()[0] * self.conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+# The tenant (site) being served: set per request by TenantRouter and per
+# thread by spawn(). Inside a request without one, the app's first tenant.
+_local = threading.local()
+
+def current_tenant() -> "Tenant":
+    return getattr(_local, "tenant", None) or next(iter(current_app.extensions["tenants"].values()))
+
+def get_db() -> AttendanceDB:
+    return current_tenant().db
+
+def spawn(tenant: "Tenant", target, name: str, *args) -> None:
+    # Daemon thread working for `tenant`; "<name>:<tenant>" when several sites share the process
+    def run():
+        _local.tenant = tenant
+        target(*args)
+    threading.Thread(target=run, daemon=True, name=f"{name}:{tenant.name}" if tenant.prefix else name).start()
+
+class Cooldowns:
+    """Last logged time per face ID, oldest first, holding at most `limit` IDs.
+
+    Entries past the cooldown are dropped as new faces arrive. If more than
+    `limit` IDs are inside the window at once, the oldest is forgotten early;
+    the checkins natural key still stops a second row in the same bucket.
+    """
+
+    __slots__ = ("seconds", "limit", "_seen")
+
+    def __init__(self, seconds: int, limit: int):
+        self.seconds = seconds
+        self.limit = limit
+        self._seen = OrderedDict()  # {id: epoch_seconds}
+
+    def allow(self, face_id: int, now: float) -> bool:
+        # True (and the cooldown restarts) if face_id is not inside its cooldown
+        seen = self._seen
+        while seen:
+            oldest = next(iter(seen.values()))
+            if now - oldest < self.seconds and len(seen) < self.limit:
+                break
+            seen.popitem(last=False)
+        if face_id in seen:
+            return False
+        seen[face_id] = now
+        return True
+
+    def clear(self):
+        self._seen.clear()
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class FaceEvent:
+    """One FACE line from the serial port and what became of it (for /diagnostics)."""
 
-# Anti-spam cooldown (per Face ID)
-last_seen = {}  # {id: epoch_seconds}
+    __slots__ = ("face_id", "ts", "outcome")
+
+    def __init__(self, face_id: int, ts: float, outcome: str):
+        self.face_id = face_id
+        self.ts = ts
+        self.outcome = outcome
+
+
+bp = Blueprint("attendance", __name__)
 
 
 # =========================
@@ -360,7 +1314,7 @@ label {{
   color: var(--muted);
 }}
 
-input[type=text], select {{
+input[type=text], input[type=date], select {{
   width: 100%;
   padding: 12px 12px;
   border-radius: 14px;
@@ -370,7 +1324,7 @@ input[type=text], select {{
   outline: none;
 }}
 
-input[type=text]:focus, select:focus {{
+input[type=text]:focus, input[type=date]:focus, select:focus {{
   border-color: rgba(37,99,235,.55);
 }}
 
@@ -422,40 +1376,73 @@ BASE_TOP = """
 """
 
 def serial_badge_html():
-    if SERIAL_OK:
+    if any(s.ok for s in current_tenant().sources):
         return '<span class="badge">✅ Connected</span>'
     return f'<span class="badge">⚠ Not connected</span>'
 
+FOOTER = '<div class="footer">AI Attendance • Local Network Dashboard</div>'
+
+def page_top() -> str:
+    badge = serial_badge_html()
+    site = getattr(_local, "tenant", None)
+    if site is not None and site.prefix:
+        badge = f'<span class="badge">🏫 {site.name}</span> ' + badge
+    return BASE_TOP.format(logo=LOGO_URL, serial_badge=badge)
+
 def page_wrap(inner_html: str) -> str:
-    top = BASE_TOP.format(logo=LOGO_URL, serial_badge=serial_badge_html())
-    return CSS + f'<div class="container">{top}{inner_html}<div class="footer">AI Attendance • Local Network Dashboard</div></div>'
+    return CSS + f'<div class="container">{page_top()}{inner_html}{FOOTER}</div>'
+
+# The same page as a template compiled once per app (create_app). render_page()
+# passes the parts in as values, so Jinja never compiles the page HTML itself.
+LAYOUT = '{{ css|safe }}<div class="container">{{ top|safe }}{{ inner|safe }}' + FOOTER + '</div>'
+
+# Where stream_page() writes the table rows inside a page
+ROWS = "<!--rows-->"
+
+def stream_page(inner_html: str, rows, empty: str):
+    # The page is sent in pieces: table rows are formatted and written a few at a
+    # time instead of being joined into one big string (and compiled by Jinja)
+    head, tail = page_wrap(inner_html).split(ROWS, 1)
+
+    def generate():
+        yield head
+        chunk, sent = [], False
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == 50:
+                yield "".join(chunk)
+                chunk.clear()
+                sent = True
+        if chunk or not sent:
+            yield "".join(chunk) or empty
+        yield tail
+    return Response(generate(), mimetype="text/html")
 
 
 # =========================
 # HELPERS
 # =========================
-def get_classes():
-    with db_lock:
-        cur.execute("SELECT classname FROM classes ORDER BY classname")
-        return [r["classname"] for r in cur.fetchall()]
+def cached(key: tuple, compute):
+    # Shared result of compute() until the next write (see QueryCache)
+    db = get_db()
+    return db.cache.get(key, db.version, compute)
 
-def ensure_default_classes():
-    # Only insert if empty
-    with db_lock:
-        cur.execute("SELECT COUNT(*) AS c FROM classes")
-        c = cur.fetchone()["c"]
-        if c == 0:
-            cur.executemany("INSERT OR IGNORE INTO classes(classname) VALUES (?)", [
-                ("Class A",),
-                ("Class B",),
-            ])
-            conn.commit()
+def render_page(inner_html: str) -> str:
+    # page_wrap() through the precompiled LAYOUT (no per-request template compile)
+    return current_app.extensions["layout"].render(css=CSS, top=page_top(), inner=inner_html)
+
+def get_classes():
+    def load():
+        with get_db().reader() as cur:
+            cur.execute("SELECT classname FROM classes ORDER BY classname")
+            return [r["classname"] for r in cur.fetchall()]
+    return cached(("classes",), load)
 
 def normalize_name(name: str) -> str:
     return " ".join((name or "").strip().split())
 
 def is_duplicate_name(name: str, exclude_id: int | None = None) -> bool:
-    with db_lock:
+    with get_db().cursor() as cur:
         if exclude_id is None:
             cur.execute("SELECT 1 FROM users WHERE name = ? COLLATE NOCASE LIMIT 1", (name,))
         else:
@@ -463,43 +1450,179 @@ def is_duplicate_name(name: str, exclude_id: int | None = None) -> bool:
         return cur.fetchone() is not None
 
 def get_user_by_id(uid: int):
-    with db_lock:
+    with get_db().cursor() as cur:
         cur.execute("SELECT * FROM users WHERE id=?", (uid,))
         return cur.fetchone()
 
 def today_prefix():
     return date.today().strftime("%Y-%m-%d")
 
+def today_start() -> int:
+    return int(time.mktime(date.today().timetuple()))
+
+def since_sql(ts: int) -> tuple:
+    # Range on the (bucket, ...) key first, then the exact cut-off
+    return "bucket >= ? AND ts >= ?", (ts // BUCKET_SECONDS, ts)
+
+def fts_query(q: str) -> str:
+    # "ann sm" -> "ann"* "sm"*: every word must match the start of a name word
+    return " ".join(f'"{t}"*' for t in re.findall(r"\w+", q))
+
+def day_start(day: str) -> int | None:
+    try:
+        return int(time.mktime(time.strptime(day, "%Y-%m-%d")))
+    except ValueError:
+        return None
+
+def search_users(q: str = "", cls: str = "", page: int = 1, per_page: int = PAGE_SIZE) -> tuple:
+    # Returns (rows, total matching)
+    db = get_db()
+    with db.reader() as cur:
+        where, args = [], []
+        if fts_query(q):
+            if db.fts:
+                where.append("id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)")
+                args.append(fts_query(q))
+            else:
+                where.append("name LIKE ?")
+                args.append(q.strip() + "%")
+        if cls and cls != "ALL":
+            where.append("class=?")
+            args.append(cls)
+        sql_where = (" WHERE " + " AND ".join(where)) if where else ""
+
+        cur.execute(f"SELECT COUNT(*) AS c FROM users{sql_where}", args)
+        total = cur.fetchone()["c"]
+        cur.execute(f"SELECT * FROM users{sql_where} ORDER BY class, id LIMIT ? OFFSET ?",
+                    args + [per_page, (max(page, 1) - 1) * per_page])
+        return cur.fetchall(), total
+
+def search_records(q: str = "", cls: str = "", day_from: str = "", day_to: str = "",
+                   before: str = "", limit: int = PAGE_SIZE, job: str = "web") -> tuple:
+    # Newest first, keyset paginated: returns (rows, cursor for the next page or "").
+    # Every filter is an index range (name -> hid, class -> cid, dates -> bucket).
+    db = get_db()
+
+    def fetch(cur):
+        where, args = [], []
+        if fts_query(q):
+            if db.fts:
+                names = "SELECT rowid FROM history_fts WHERE history_fts MATCH ?"
+                name_arg = fts_query(q)
+            else:
+                names = "SELECT hid FROM user_history WHERE name LIKE ?"
+                name_arg = q.strip() + "%"
+            # Few matching names: read their rows through idx_checkins_hid. Many: walk
+            # newest-first and stop after `limit` hits ("+hid" keeps SQLite off that index).
+            cur.execute(f"SELECT COUNT(*) AS c FROM ({names})", (name_arg,))
+            matched = cur.fetchone()["c"]
+            cur.execute("SELECT (SELECT MAX(hid) FROM user_history) AS h, (SELECT MAX(seq) FROM checkins) AS n")
+            stats = cur.fetchone()
+            walk = matched * matched * (stats["n"] or 0) > limit * (stats["h"] or 0) ** 2
+            where.append(f"{'+hid' if walk else 'hid'} IN ({names})")
+            args.append(name_arg)
+        if cls and cls != "ALL":
+            where.append("cid=(SELECT cid FROM class_ids WHERE classname=?)")
+            args.append(cls)
+        start = day_start(day_from) if day_from else None
+        if start is not None:
+            clause, clause_args = since_sql(start)
+            where.append(clause)
+            args.extend(clause_args)
+        end = day_start(day_to) if day_to else None
+        if end is not None:
+            end += 86400
+            where.append("bucket <= ? AND ts < ?")
+            args.extend([end // BUCKET_SECONDS, end])
+        if before:
+            try:
+                b_ts, b_seq = (int(x) for x in before.split("-", 1))
+            except ValueError:
+                pass
+            else:
+                where.append("(bucket, ts, seq) < (?, ?, ?)")
+                args.extend([b_ts // BUCKET_SECONDS, b_ts, b_seq])
+        sql_where = (" WHERE " + " AND ".join(where)) if where else ""
+
+        cur.execute(f"SELECT * FROM records{sql_where} ORDER BY bucket DESC, ts DESC, seq DESC LIMIT ?", args + [limit + 1])
+        return cur.fetchall()
+
+    # Exports ("heavy") walk all of history, so they stay on the file
+    with (db.cursor(job) if job == "heavy" else db.reader(job)) as cur:
+        rows = fetch(cur)
+        # The replica only has the last REPLICA_DAYS as rows: a short page may go on in the file
+        partial = len(rows) <= limit and db.replica is not None and cur.connection is db.replica.conn and db.replica.folded
+    if partial:
+        with db.cursor(job) as cur:
+            rows = fetch(cur)
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (f"{rows[-1]['ts']}-{rows[-1]['seq']}" if more else "")
+
+def get_state(key: str, default: str = "") -> str:
+    with get_db().cursor() as cur:
+        cur.execute("SELECT value FROM sync_state WHERE key=?", (key,))
+        row = cur.fetchone()
+        return row["value"] if row else default
 
-ensure_default_classes()
+def set_state(key: str, value) -> None:
+    with get_db().cursor() as cur:
+        cur.execute("INSERT OR REPLACE INTO sync_state(key, value) VALUES (?,?)", (key, str(value)))
+        cur.connection.commit()
+
+def new_sync_epoch(cur) -> None:
+    # Record rowids restart after the table is emptied, so the high-water mark
+    # starts over under a fresh epoch that the aggregator can tell apart.
+    cur.execute("INSERT OR REPLACE INTO sync_state(key, value) VALUES ('epoch', ?)", (os.urandom(8).hex(),))
+    cur.execute("INSERT OR REPLACE INTO sync_state(key, value) VALUES ('hwm', '0')")
 
 
 # =========================
 # PAGES
 # =========================
-@app.route("/")
+@bp.route("/")
 def home():
     today = today_prefix()
 
-    with db_lock:
-        cur.execute("SELECT COUNT(*) AS c FROM users")
-        total_users = cur.fetchone()["c"]
+    def load(since):
+        with get_db().reader() as cur:
+            cur.execute("SELECT COUNT(*) AS c FROM users")
+            total_users = cur.fetchone()["c"]
+
+            where, args = since_sql(since)
+            cur.execute(f"SELECT COUNT(*) AS c FROM checkins WHERE {where}", args)
+            total_today = cur.fetchone()["c"]
 
-        cur.execute("SELECT COUNT(*) AS c FROM records WHERE time LIKE ?", (today + "%",))
-        total_today = cur.fetchone()["c"]
+            # Compacted days still count every check-in they replaced
+            cur.execute("SELECT (SELECT COUNT(*) FROM checkins) + (SELECT COALESCE(SUM(hits), 0) FROM presence) AS c")
+            total_all = cur.fetchone()["c"]
 
-        cur.execute("SELECT COUNT(*) AS c FROM records")
-        total_all = cur.fetchone()["c"]
+            cur.execute("SELECT * FROM records ORDER BY bucket DESC, ts DESC LIMIT 8")
+            recent = cur.fetchall()
+        return total_users, total_today, total_all, recent
 
-        cur.execute("SELECT * FROM records ORDER BY time DESC LIMIT 8")
-        recent = cur.fetchall()
+    since = today_start()
+    total_users, total_today, total_all, recent = cached(("home", since), lambda: load(since))
+
+    site, per_class = current_tenant().live.figures()
+    live_rows = "".join(
+        f"<tr><td>{html.escape(c)}</td><td>{f['in_room']}</td><td>{f['arrivals_per_min']:.1f}</td>"
+        f"<td>{f['busiest_minute']}</td><td>{f['queue']}</td><td>{f['queue_peak']}</td></tr>"
+        for c, f in per_class.items()
+    )
+    if live_rows:
+        live_rows += (f"<tr><td><b>All</b></td><td>{site['in_room']}</td><td>{site['arrivals_per_min']:.1f}</td>"
+                      f"<td>{site['busiest_minute']}</td><td>{site['queue']}</td><td>{site['queue_peak']}</td></tr>")
 
     status_note = ""
-    if not SERIAL_OK:
+    sources = current_tenant().sources
+    if not any(s.ok for s in sources):
+        errors = "; ".join(f"{s.port}: {s.error}" for s in sources) or "no serial port configured"
         status_note = f"""
         <div class="notice warn">
           <b>Serial not connected.</b> The web dashboard still works, but attendance will not auto-log until Arduino is connected.<br>
-          <span class="muted">Error: {SERIAL_ERROR}</span>
+          <span class="muted">Error: {html.escape(errors)}</span>
         </div>
         """
 
@@ -540,6 +1663,10 @@ def home():
             <a class="btn" href="/classes">🏫 Manage Classes</a>
             <a class="btn" href="/analytics">📊 Analytics</a>
             <a class="btn success" href="/export_csv">⬇ Export CSV</a>
+            <a class="btn" href="/backups">💾 Backups</a>
+            <a class="btn" href="/jobs">⏱ Jobs</a>
+            <a class="btn" href="/notifications">🔔 Notifications</a>
+            <a class="btn" href="/diagnostics">🩺 Diagnostics</a>
           </div>
 
           <hr class="sep">
@@ -582,59 +1709,93 @@ def home():
         </div>
       </div>
     </div>
+
+    <div class="card" style="margin-top:14px;">
+      <div class="header">
+        <h2>Live</h2>
+        <span class="badge">Last {LIVE_WINDOW} min</span>
+      </div>
+      <div class="body">
+        <div class="table-wrap">
+          <table>
+            <thead>
+              <tr><th>Class</th><th>In Room</th><th>Arrivals / min</th><th>Busiest Minute</th><th>At Door</th><th>Peak at Door</th></tr>
+            </thead>
+            <tbody>
+              {live_rows or "<tr><td colspan='6' class='muted'>No arrivals since start-up.</td></tr>"}
+            </tbody>
+          </table>
+        </div>
+        <p class="muted" style="margin-top:10px;">From the cameras since start-up. In Room: arrived in the last {OCCUPANCY_MINUTES} min. At Door: faces in front of the camera (event sketch only).</p>
+      </div>
+    </div>
     """
-    return render_template_string(page_wrap(inner))
+    return render_page(inner)
 
 
-@app.route("/attendance")
+@bp.route("/attendance")
 def attendance():
     cls = (request.args.get("class") or "").strip()
+    q = (request.args.get("q") or "").strip()
+    day_from = (request.args.get("from") or "").strip()
+    day_to = (request.args.get("to") or "").strip()
+    before = (request.args.get("before") or "").strip()
     classes = get_classes()
 
-    with db_lock:
-        if cls and cls != "ALL":
-            cur.execute("SELECT * FROM records WHERE class=? ORDER BY time DESC", (cls,))
-        else:
-            cur.execute("SELECT * FROM records ORDER BY time DESC")
-        rows = cur.fetchall()
+    rows, next_cursor = search_records(q, cls, day_from, day_to, before)
 
     options = ['<option value="ALL">ALL</option>'] + [
         f'<option value="{c}" {"selected" if c==cls else ""}>{c}</option>' for c in classes
     ]
+    filters = {k: v for k, v in (("q", q), ("class", cls), ("from", day_from), ("to", day_to)) if v and v != "ALL"}
+    pager = ""
+    if before:
+        pager += f'<a class="btn small" href="/attendance?{urlencode(filters)}">⏮ Newest</a> '
+    if next_cursor:
+        pager += f'<a class="btn small" href="/attendance?{urlencode(dict(filters, before=next_cursor))}">Older ➡</a>'
 
     inner = f"""
     <div class="card">
       <div class="header">
         <h2>Attendance Records</h2>
         <div style="display:flex; gap:10px; align-items:center; flex-wrap:wrap;">
-          <form method="get" action="/attendance" style="margin:0; display:flex; gap:10px; align-items:center;">
-            <label style="margin:0;">Filter by class</label>
-            <select name="class" onchange="this.form.submit()">
-              {''.join(options)}
-            </select>
-          </form>
           <a class="btn small success" href="/export_csv{('?class=' + cls) if (cls and cls!='ALL') else ''}">⬇ Export CSV</a>
           <a class="btn small" href="/">⬅ Back</a>
         </div>
       </div>
       <div class="body">
+        <form method="get" action="/attendance" style="margin:0 0 14px 0; display:flex; gap:10px; align-items:center; flex-wrap:wrap;">
+          <input type="text" name="q" value="{html.escape(q)}" placeholder="Search name…" style="flex:2; min-width:160px;">
+          <select name="class" style="flex:1; min-width:120px;">
+            {''.join(options)}
+          </select>
+          <input type="date" name="from" value="{html.escape(day_from)}" style="flex:1;">
+          <input type="date" name="to" value="{html.escape(day_to)}" style="flex:1;">
+          <button class="btn small primary" type="submit">🔍 Search</button>
+        </form>
         <div class="table-wrap">
           <table>
             <thead>
               <tr><th>ID</th><th>Name</th><th>Class</th><th>Timestamp</th></tr>
             </thead>
             <tbody>
-              {''.join([f"<tr><td>{r['id']}</td><td>{r['name']}</td><td>{r['class']}</td><td>{r['time']}</td></tr>" for r in rows]) or "<tr><td colspan='4' class='muted'>No records found.</td></tr>"}
+              {ROWS}
             </tbody>
           </table>
         </div>
+        <div class="actions" style="margin-top:14px;">{pager}</div>
+        {f'<p class="muted">Check-ins older than {RETENTION_DAYS} day(s) are kept as one row per student per day: see Analytics, Reports and the presence export.</p>' if RETENTION_DAYS > 0 else ""}
       </div>
     </div>
     """
-    return render_template_string(page_wrap(inner))
+    return stream_page(
+        inner,
+        (f"<tr><td>{r['id']}</td><td>{r['name']}</td><td>{r['class']}</td><td>{r['time']}</td></tr>" for r in rows),
+        "<tr><td colspan='4' class='muted'>No records found.</td></tr>",
+    )
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     classes = get_classes()
     if not classes:
@@ -664,11 +1825,13 @@ def register():
             msg = f'Duplicate name blocked: "{name}". Use a different name.'
             msg_cls = "notice bad"
         else:
-            with db_lock:
+            with get_db().cursor() as cur:
                 # Insert or replace by Face ID, but must also respect UNIQUE name
                 try:
                     cur.execute("INSERT OR REPLACE INTO users(id, name, class) VALUES (?,?,?)", (uid, name, cls))
-                    conn.commit()
+                    get_db().snapshot_user(cur, uid, name, cls)
+                    cur.connection.commit()
+                    get_db().changed(cur, ("users",))
                     return redirect("/users")
                 except sqlite3.IntegrityError:
                     msg = f'Duplicate name blocked: "{name}".'
@@ -709,11 +1872,27 @@ def register():
     return render_template_string(page_wrap(inner))
 
 
-@app.route("/users")
+@bp.route("/users")
 def users():
-    with db_lock:
-        cur.execute("SELECT * FROM users ORDER BY class, id")
-        rows = cur.fetchall()
+    q = (request.args.get("q") or "").strip()
+    cls = (request.args.get("class") or "").strip()
+    try:
+        page = max(int(request.args.get("page", "1")), 1)
+    except ValueError:
+        page = 1
+
+    rows, total = cached(("users", q, cls, page), lambda: search_users(q, cls, page))
+    pages = max((total + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+
+    options = ['<option value="ALL">ALL</option>'] + [
+        f'<option value="{c}" {"selected" if c==cls else ""}>{c}</option>' for c in get_classes()
+    ]
+    filters = {k: v for k, v in (("q", q), ("class", cls)) if v and v != "ALL"}
+    pager = f'<span class="badge">Page {page} of {pages} • {total} user(s)</span>'
+    if page > 1:
+        pager = f'<a class="btn small" href="/users?{urlencode(dict(filters, page=page - 1))}">⬅ Prev</a> ' + pager
+    if page < pages:
+        pager += f' <a class="btn small" href="/users?{urlencode(dict(filters, page=page + 1))}">Next ➡</a>'
 
     inner = f"""
     <div class="card">
@@ -725,36 +1904,48 @@ def users():
         </div>
       </div>
       <div class="body">
+        <form method="get" action="/users" style="margin:0 0 14px 0; display:flex; gap:10px; align-items:center; flex-wrap:wrap;">
+          <input type="text" name="q" value="{html.escape(q)}" placeholder="Search name…" style="flex:2; min-width:160px;">
+          <select name="class" style="flex:1; min-width:120px;">
+            {''.join(options)}
+          </select>
+          <button class="btn small primary" type="submit">🔍 Search</button>
+        </form>
         <div class="table-wrap">
           <table>
             <thead>
               <tr><th>ID</th><th>Name</th><th>Class</th><th>Actions</th></tr>
             </thead>
             <tbody>
-              {''.join([
-                f"<tr>"
-                f"<td>{u['id']}</td>"
-                f"<td>{u['name']}</td>"
-                f"<td>{u['class']}</td>"
-                f"<td style='white-space:nowrap;'>"
-                f"<a class='btn small' href='/edit_user/{u['id']}'>Edit</a> "
-                f"<form action='/delete_user/{u['id']}' method='post' style='display:inline;margin:0;'>"
-                f"<button class='btn small danger' type='submit' onclick=\"return confirm('Delete user {u['name']} (ID {u['id']})?');\">Delete</button>"
-                f"</form>"
-                f"</td>"
-                f"</tr>"
-                for u in rows
-              ]) or "<tr><td colspan='4' class='muted'>No users registered yet.</td></tr>"}
+              {ROWS}
             </tbody>
           </table>
         </div>
+        <div class="actions" style="margin-top:14px; align-items:center;">{pager}</div>
       </div>
     </div>
     """
-    return render_template_string(page_wrap(inner))
+    return stream_page(
+        inner,
+        (
+            f"<tr>"
+            f"<td>{u['id']}</td>"
+            f"<td>{u['name']}</td>"
+            f"<td>{u['class']}</td>"
+            f"<td style='white-space:nowrap;'>"
+            f"<a class='btn small' href='/edit_user/{u['id']}'>Edit</a> "
+            f"<form action='/delete_user/{u['id']}' method='post' style='display:inline;margin:0;'>"
+            f"<button class='btn small danger' type='submit' onclick=\"return confirm('Delete user {u['name']} (ID {u['id']})?');\">Delete</button>"
+            f"</form>"
+            f"</td>"
+            f"</tr>"
+            for u in rows
+        ),
+        "<tr><td colspan='4' class='muted'>No users found.</td></tr>",
+    )
 
 
-@app.route("/edit_user/<int:uid>", methods=["GET", "POST"])
+@bp.route("/edit_user/<int:uid>", methods=["GET", "POST"])
 def edit_user(uid):
     user = get_user_by_id(uid)
     if not user:
@@ -778,10 +1969,12 @@ def edit_user(uid):
             msg = f'Duplicate name blocked: "{name}".'
             msg_cls = "notice bad"
         else:
-            with db_lock:
+            with get_db().cursor() as cur:
                 try:
                     cur.execute("UPDATE users SET name=?, class=? WHERE id=?", (name, cls, uid))
-                    conn.commit()
+                    get_db().snapshot_user(cur, uid, name, cls)
+                    cur.connection.commit()
+                    get_db().changed(cur, ("users",))
                     return redirect("/users")
                 except sqlite3.IntegrityError:
                     msg = f'Duplicate name blocked: "{name}".'
@@ -818,15 +2011,16 @@ def edit_user(uid):
     return render_template_string(page_wrap(inner))
 
 
-@app.route("/delete_user/<int:uid>", methods=["POST"])
+@bp.route("/delete_user/<int:uid>", methods=["POST"])
 def delete_user(uid):
-    with db_lock:
+    with get_db().cursor() as cur:
         cur.execute("DELETE FROM users WHERE id=?", (uid,))
-        conn.commit()
+        cur.connection.commit()
+        get_db().changed(cur, ("users",))
     return redirect("/users")
 
 
-@app.route("/classes", methods=["GET", "POST"])
+@bp.route("/classes", methods=["GET", "POST"])
 def classes():
     msg = ""
     msg_cls = "notice"
@@ -839,9 +2033,10 @@ def classes():
                 msg = "Class name cannot be empty."
                 msg_cls = "notice bad"
             else:
-                with db_lock:
+                with get_db().cursor() as cur:
                     cur.execute("INSERT OR IGNORE INTO classes(classname) VALUES (?)", (classname,))
-                    conn.commit()
+                    cur.connection.commit()
+                    get_db().changed(cur, ("classes",))
                 msg = f'Class added: {classname}'
                 msg_cls = "notice good"
         elif action == "delete":
@@ -849,7 +2044,7 @@ def classes():
                 msg = "Missing class name."
                 msg_cls = "notice bad"
             else:
-                with db_lock:
+                with get_db().cursor() as cur:
                     # Optional safety: do not delete if any users exist in that class
                     cur.execute("SELECT COUNT(*) AS c FROM users WHERE class=?", (classname,))
                     c = cur.fetchone()["c"]
@@ -858,7 +2053,8 @@ def classes():
                         msg_cls = "notice bad"
                     else:
                         cur.execute("DELETE FROM classes WHERE classname=?", (classname,))
-                        conn.commit()
+                        cur.connection.commit()
+                        get_db().changed(cur, ("classes",))
                         msg = f"Class deleted: {classname}"
                         msg_cls = "notice good"
         else:
@@ -919,32 +2115,54 @@ def classes():
       </div>
     </div>
     """
-    return render_template_string(page_wrap(inner))
+    return render_page(inner)
 
 
-@app.route("/analytics")
+@bp.route("/analytics")
 def analytics():
     today = today_prefix()
 
     classes = get_classes()
 
-    # Per-class: registered count, today's check-ins, total check-ins
-    with db_lock:
-        cur.execute("SELECT class, COUNT(*) AS cnt FROM users GROUP BY class ORDER BY class")
-        reg_map = {r["class"]: r["cnt"] for r in cur.fetchall()}
-
-        cur.execute("SELECT class, COUNT(*) AS cnt FROM records WHERE time LIKE ? GROUP BY class ORDER BY class", (today + "%",))
-        today_map = {r["class"]: r["cnt"] for r in cur.fetchall()}
-
-        cur.execute("SELECT class, COUNT(*) AS cnt FROM records GROUP BY class ORDER BY class")
-        total_map = {r["class"]: r["cnt"] for r in cur.fetchall()}
-
-        # Student status today (checked in or not)
-        cur.execute("SELECT id, name, class FROM users ORDER BY class, name")
-        users = cur.fetchall()
-
-        cur.execute("SELECT DISTINCT id FROM records WHERE time LIKE ?", (today + "%",))
-        checked_ids = {r["id"] for r in cur.fetchall()}
+    # Per-class: registered count, today's check-ins, total check-ins.
+    # One short DB slot per class so check-ins are never stuck behind the page.
+    def load(since):
+        db = get_db()
+        where, args = since_sql(since)
+        today_map, total_map = {}, {}
+        with db.sched.admitted_as("analytics"):
+            with db.reader("heavy") as cur:
+                cur.execute("SELECT class, COUNT(*) AS cnt FROM users GROUP BY class ORDER BY class")
+                reg_map = {r["class"]: r["cnt"] for r in cur.fetchall()}
+
+                cur.execute("SELECT classname, cid FROM class_ids")
+                cids = {r["classname"]: r["cid"] for r in cur.fetchall()}
+
+                # Student status today (checked in or not)
+                cur.execute("SELECT id, name, class FROM users ORDER BY class, name")
+                users = cur.fetchall()
+
+                cur.execute(f"SELECT DISTINCT uid FROM checkins WHERE {where}", args)
+                checked_ids = {r["uid"] for r in cur.fetchall()}
+
+                # Finished days, from the nightly rollup job
+                cur.execute("SELECT day, SUM(checkins) AS checkins, SUM(students) AS students "
+                            "FROM daily_summary GROUP BY day ORDER BY day DESC LIMIT 7")
+                daily = cur.fetchall()
+
+            for c in classes:
+                if c not in cids:
+                    continue
+                with db.reader("heavy") as cur:
+                    cur.execute(f"SELECT COUNT(*) AS cnt FROM checkins WHERE cid=? AND {where}", (cids[c],) + args)
+                    today_map[c] = cur.fetchone()["cnt"]
+                    cur.execute("SELECT (SELECT COUNT(*) FROM checkins WHERE cid=?) + "
+                                "(SELECT COALESCE(SUM(hits), 0) FROM presence WHERE cid=?) AS cnt", (cids[c], cids[c]))
+                    total_map[c] = cur.fetchone()["cnt"]
+        return reg_map, today_map, total_map, users, checked_ids, daily
+
+    since = today_start()
+    reg_map, today_map, total_map, users, checked_ids, daily = cached(("analytics", since), lambda: load(since))
 
     rows_html = ""
     for c in classes:
@@ -965,6 +2183,7 @@ def analytics():
         <h2>Analytics</h2>
         <div style="display:flex; gap:10px; align-items:center;">
           <span class="badge">Today: {today}</span>
+          <a class="btn small primary" href="/reports">📑 Term Reports</a>
           <a class="btn small" href="/">⬅ Back</a>
         </div>
       </div>
@@ -985,6 +2204,20 @@ def analytics():
             </div>
           </div>
 
+          <div class="card" style="box-shadow:none; margin-top:14px;">
+            <div class="header"><h2>Last 7 Days</h2></div>
+            <div class="body">
+              <div class="table-wrap">
+                <table>
+                  <thead><tr><th>Day</th><th>Check-ins</th><th>Students</th></tr></thead>
+                  <tbody>
+                    {''.join([f"<tr><td>{d['day']}</td><td>{d['checkins']}</td><td>{d['students']}</td></tr>" for d in daily]) or "<tr><td colspan='3' class='muted'>No daily totals yet (see Jobs → rollup).</td></tr>"}
+                  </tbody>
+                </table>
+              </div>
+            </div>
+          </div>
+
           <div class="card" style="box-shadow:none; margin-top:14px;">
             <div class="header"><h2>Student Status (Today)</h2></div>
             <div class="body">
@@ -1003,84 +2236,598 @@ def analytics():
       </div>
     </div>
     """
-    return render_template_string(page_wrap(inner))
+    return render_page(inner)
+
+
+@bp.route("/api/users")
+def api_users():
+    try:
+        page = max(int(request.args.get("page", "1")), 1)
+        per_page = min(max(int(request.args.get("limit", str(PAGE_SIZE))), 1), 1000)
+    except ValueError:
+        abort(400)
+    with get_db().sched.admitted_as("api"):
+        rows, total = search_users(request.args.get("q", ""), request.args.get("class", ""), page, per_page)
+    return jsonify(
+        total=total,
+        page=page,
+        items=[{"id": r["id"], "name": r["name"], "class": r["class"]} for r in rows],
+    )
+
+
+@bp.route("/api/attendance")
+def api_attendance():
+    try:
+        limit = min(max(int(request.args.get("limit", str(PAGE_SIZE))), 1), 1000)
+    except ValueError:
+        abort(400)
+    with get_db().sched.admitted_as("api"):
+        rows, next_cursor = search_records(
+            request.args.get("q", ""),
+            request.args.get("class", ""),
+            request.args.get("from", ""),
+            request.args.get("to", ""),
+            request.args.get("before", ""),
+            limit,
+        )
+    return jsonify(
+        next=next_cursor,
+        items=[{"id": r["id"], "name": r["name"], "class": r["class"], "time": r["time"]} for r in rows],
+    )
 
 
-@app.route("/reset_ids", methods=["POST"])
+@bp.route("/reset_ids", methods=["POST"])
 def reset_ids():
-    with db_lock:
+    with get_db().cursor() as cur:
         cur.execute("DELETE FROM users")
-        conn.commit()
+        cur.connection.commit()
+        get_db().changed(cur, ("users",))
     return redirect("/")
 
 
-@app.route("/reset_attendance", methods=["POST"])
+@bp.route("/reset_attendance", methods=["POST"])
 def reset_attendance():
-    with db_lock:
-        cur.execute("DELETE FROM records")
-        conn.commit()
+    with get_db().cursor() as cur:
+        cur.execute("DELETE FROM checkins")
+        cur.execute("DELETE FROM presence")
+        cur.execute("DELETE FROM daily_summary")
+        cur.execute("DELETE FROM sync_state WHERE key='rollup_through'")
+        new_sync_epoch(cur)
+        cur.connection.commit()
+        get_db().changed(cur, ("checkins",))
     return redirect("/")
 
 
-@app.route("/export_csv")
-def export_csv():
-    cls = (request.args.get("class") or "").strip()
+def admitted_stream(endpoint: str, chunks, **kwargs) -> Response:
+    # Streams `chunks` under an admission slot (DbBusy -> 503 if none is free). The
+    # slot goes back when the body is done or the response is closed, whichever
+    # comes first: a HEAD request or a client that leaves never starts the body.
+    release = get_db().sched.admit(endpoint)
+    released = []
 
-    with db_lock:
-        if cls and cls != "ALL":
-            cur.execute("SELECT * FROM records WHERE class=? ORDER BY time DESC", (cls,))
-        else:
-            cur.execute("SELECT * FROM records ORDER BY time DESC")
-        rows = cur.fetchall()
+    def release_once():
+        if not released:
+            released.append(True)
+            release()
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["ID", "Name", "Class", "Timestamp"])
-    for r in rows:
-        writer.writerow([r["id"], r["name"], r["class"], r["time"]])
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            release_once()
 
+    response = Response(generate(), **kwargs)
+    response.call_on_close(release_once)
+    return response
+
+
+@bp.route("/export_csv")
+def export_csv():
+    cls = (request.args.get("class") or "").strip()
     filename = "attendance.csv" if not (cls and cls != "ALL") else f"attendance_{cls.replace(' ', '_')}.csv"
 
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
+    def generate():
+        # EXPORT_CHUNK rows per low-priority DB slot, written out as they arrive
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["ID", "Name", "Class", "Timestamp"])
+        before = ""
+        while True:
+            rows, before = search_records(cls=cls, before=before, limit=EXPORT_CHUNK, job="heavy")
+            for r in rows:
+                writer.writerow([r["id"], r["name"], r["class"], r["time"]])
+            yield output.getvalue().encode()
+            output.seek(0)
+            output.truncate()
+            if not before:
+                break
+
+    return admitted_stream(
+        "export",
+        generate(),
         mimetype="text/csv",
-        as_attachment=True,
-        download_name=filename
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
+class StreamSink:
+    """Write-only file object for pyarrow writers; the response drains it after each batch."""
+
+    def __init__(self):
+        self.parts = []
+        self.pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+@bp.route("/export_parquet")
+def export_parquet():
+    # Typed, columnar export: ?table=records|users|daily|presence, &from=&to=&class=, &format=parquet|arrow
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return Response("Columnar export needs pyarrow on this Pi: pip install pyarrow\n", status=501, mimetype="text/plain")
+
+    table = request.args.get("table", "records")
+    fmt = request.args.get("format", "parquet")
+    cls = (request.args.get("class") or "").strip()
+    day_from = (request.args.get("from") or "").strip()
+    day_to = (request.args.get("to") or "").strip()
+    if table not in ("records", "users", "daily", "presence") or fmt not in ("parquet", "arrow"):
+        abort(400)
+    if (day_from and day_start(day_from) is None) or (day_to and day_start(day_to) is None):
+        abort(400)
+
+    labels = pa.dictionary(pa.int32(), pa.string())  # class/source names, stored once per row group
+    schemas = {
+        "records": pa.schema([
+            ("seq", pa.int64()), ("id", pa.int32()), ("name", pa.string()), ("class", labels),
+            ("time", pa.timestamp("s", tz="UTC")), ("source", labels),
+        ]),
+        "users": pa.schema([("id", pa.int32()), ("name", pa.string()), ("class", labels)]),
+        "daily": pa.schema([("day", pa.date32()), ("class", labels), ("checkins", pa.int32()), ("students", pa.int32())]),
+        "presence": pa.schema([
+            ("day", pa.date32()), ("id", pa.int32()), ("name", pa.string()), ("class", labels),
+            ("first", pa.timestamp("s", tz="UTC")), ("last", pa.timestamp("s", tz="UTC")),
+            ("checkins", pa.int32()), ("source", labels),
+        ]),
+    }
+    schema = schemas[table]
+
+    def batches():
+        # Column lists of at most PARQUET_ROWS rows, read in EXPORT_CHUNK-row DB slots
+        if table == "records":
+            cols = {f: [] for f in schema.names}
+            before = ""
+            while True:
+                rows, before = search_records(cls=cls, day_from=day_from, day_to=day_to, before=before,
+                                              limit=EXPORT_CHUNK, job="heavy")
+                for r in rows:
+                    cols["seq"].append(r["seq"])
+                    cols["id"].append(r["id"])
+                    cols["name"].append(r["name"])
+                    cols["class"].append(r["class"])
+                    cols["time"].append(r["ts"])
+                    cols["source"].append(r["source"])
+                if len(cols["seq"]) >= PARQUET_ROWS or not before:
+                    yield cols
+                    cols = {f: [] for f in schema.names}
+                if not before:
+                    return
+        elif table == "users":
+            with get_db().cursor("heavy") as cur:
+                if cls and cls != "ALL":
+                    cur.execute("SELECT id, name, class FROM users WHERE class=? ORDER BY id", (cls,))
+                else:
+                    cur.execute("SELECT id, name, class FROM users ORDER BY id")
+                rows = cur.fetchall()
+            yield {f: [r[f] for r in rows] for f in schema.names}
+        elif table == "presence":
+            # Compacted days (RETENTION_DAYS), one DB slot per day
+            where, args = [], []
+            if day_from:
+                where.append("day >= ?")
+                args.append(day_from)
+            if day_to:
+                where.append("day <= ?")
+                args.append(day_to)
+            sql_where = (" WHERE " + " AND ".join(where)) if where else ""
+            class_sql, class_arg = (" AND k.classname=?", (cls,)) if cls and cls != "ALL" else ("", ())
+            with get_db().cursor("heavy") as cur:
+                cur.execute(f"SELECT DISTINCT day FROM presence{sql_where} ORDER BY day", args)
+                days = [r["day"] for r in cur.fetchall()]
+            cols = {f: [] for f in schema.names}
+            for i, day in enumerate(days):
+                with get_db().cursor("heavy") as cur:
+                    cur.execute(
+                        "SELECT p.day, p.uid, h.name, k.classname, p.first_ts, p.last_ts, p.hits, s.source FROM presence p "
+                        "JOIN user_history h ON h.hid = p.hid JOIN class_ids k ON k.cid = p.cid "
+                        f"JOIN source_ids s ON s.sid = p.sid WHERE p.day=?{class_sql} ORDER BY k.classname, p.uid",
+                        (day,) + class_arg)
+                    rows = cur.fetchall()
+                for r in rows:
+                    cols["day"].append(date.fromisoformat(r["day"]))
+                    cols["id"].append(r["uid"])
+                    cols["name"].append(r["name"])
+                    cols["class"].append(r["classname"])
+                    cols["first"].append(r["first_ts"])
+                    cols["last"].append(r["last_ts"])
+                    cols["checkins"].append(r["hits"])
+                    cols["source"].append(r["source"])
+                if len(cols["day"]) >= PARQUET_ROWS or i == len(days) - 1:
+                    yield cols
+                    cols = {f: [] for f in schema.names}
+            if not days:
+                yield cols
+        else:
+            where, args = [], []
+            if cls and cls != "ALL":
+                where.append("k.classname=?")
+                args.append(cls)
+            if day_from:
+                where.append("d.day >= ?")
+                args.append(day_from)
+            if day_to:
+                where.append("d.day <= ?")
+                args.append(day_to)
+            sql_where = (" WHERE " + " AND ".join(where)) if where else ""
+            with get_db().cursor("heavy") as cur:
+                cur.execute("SELECT d.day, k.classname AS class, d.checkins, d.students FROM daily_summary d "
+                            f"JOIN class_ids k ON k.cid = d.cid{sql_where} ORDER BY d.day, k.classname", args)
+                rows = cur.fetchall()
+            yield {"day": [date.fromisoformat(r["day"]) for r in rows], "class": [r["class"] for r in rows],
+                   "checkins": [r["checkins"] for r in rows], "students": [r["students"] for r in rows]}
+
+    def to_batch(cols):
+        arrays = []
+        for field in schema:
+            values = cols[field.name]
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def generate():
+        sink = StreamSink()
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(sink, schema, compression=PARQUET_COMPRESSION)
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        for cols in batches():
+            # One batch = one Parquet row group
+            writer.write_batch(to_batch(cols))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+    parts = [table] + ([cls.replace(" ", "_")] if cls and cls != "ALL" else []) + [p for p in (day_from, day_to) if p]
+    filename = "_".join(parts) + (".parquet" if fmt == "parquet" else ".arrows")
+    return admitted_stream(
+        "export",
+        generate(),
+        mimetype="application/vnd.apache.parquet" if fmt == "parquet" else "application/vnd.apache.arrow.stream",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@bp.app_errorhandler(DbBusy)
+def db_busy(e):
+    return Response(f"Busy: too many {e} requests running, try again shortly.\n",
+                    status=503, mimetype="text/plain", headers={"Retry-After": "2"})
+
+
+@bp.route("/metrics")
+def metrics():
+    # Prometheus text format
+    sched = get_db().sched
+    lines = [
+        "# HELP attendance_db_wait_seconds Time jobs queued for the shared DB connection, by priority class.",
+        "# TYPE attendance_db_wait_seconds histogram",
+    ]
+    for job, st in sched.stats.items():
+        for le, n in zip(sched.WAIT_BUCKETS, st["buckets"]):
+            lines.append(f'attendance_db_wait_seconds_bucket{{class="{job}",le="{le}"}} {n}')
+        lines.append(f'attendance_db_wait_seconds_bucket{{class="{job}",le="+Inf"}} {st["count"]}')
+        lines.append(f'attendance_db_wait_seconds_sum{{class="{job}"}} {st["wait"]:.6f}')
+        lines.append(f'attendance_db_wait_seconds_count{{class="{job}"}} {st["count"]}')
+    lines.append("# HELP attendance_db_wait_max_seconds Longest queueing delay seen, by priority class.")
+    lines.append("# TYPE attendance_db_wait_max_seconds gauge")
+    for job, st in sched.stats.items():
+        lines.append(f'attendance_db_wait_max_seconds{{class="{job}"}} {st["wait_max"]:.6f}')
+    lines.append("# HELP attendance_db_hold_seconds_total Time the connection was held, by priority class.")
+    lines.append("# TYPE attendance_db_hold_seconds_total counter")
+    for job, st in sched.stats.items():
+        lines.append(f'attendance_db_hold_seconds_total{{class="{job}"}} {st["hold"]:.6f}')
+    lines.append("# HELP attendance_db_inflight Admitted requests running, by endpoint class.")
+    lines.append("# TYPE attendance_db_inflight gauge")
+    for endpoint, n in sched.admitted.items():
+        lines.append(f'attendance_db_inflight{{endpoint="{endpoint}",cap="{sched.caps[endpoint]}"}} {n}')
+    lines.append("# HELP attendance_db_rejected_total Requests refused with 503 at the admission cap.")
+    lines.append("# TYPE attendance_db_rejected_total counter")
+    for endpoint, n in sched.rejected.items():
+        lines.append(f'attendance_db_rejected_total{{endpoint="{endpoint}"}} {n}')
+    cache = get_db().cache
+    lines.append("# HELP attendance_query_cache_total Page query cache lookups and evictions.")
+    lines.append("# TYPE attendance_query_cache_total counter")
+    lines.append(f'attendance_query_cache_total{{result="hit"}} {cache.hits}')
+    lines.append(f'attendance_query_cache_total{{result="miss"}} {cache.misses}')
+    lines.append(f'attendance_query_cache_total{{result="evicted"}} {cache.evictions}')
+    lines.append("# HELP attendance_query_cache_bytes Approximate memory held by cached query results.")
+    lines.append("# TYPE attendance_query_cache_bytes gauge")
+    lines.append(f"attendance_query_cache_bytes {cache.bytes}")
+    replica = get_db().replica
+    if replica is not None:
+        lines.append("# HELP attendance_replica_bytes Memory held by the in-memory read replica (0 while it is built).")
+        lines.append("# TYPE attendance_replica_bytes gauge")
+        lines.append(f"attendance_replica_bytes {replica.size()}")
+        lines.append("# HELP attendance_replica_builds_total Copies of the DB made for the read replica.")
+        lines.append("# TYPE attendance_replica_builds_total counter")
+        lines.append(f"attendance_replica_builds_total {replica.builds}")
+        lines.append("# HELP attendance_replica_build_seconds Duration of the last replica build.")
+        lines.append("# TYPE attendance_replica_build_seconds gauge")
+        lines.append(f"attendance_replica_build_seconds {replica.build_seconds:.3f}")
+    lines.append("# HELP attendance_notifications_total Notification events published and messages sent/failed, events dropped.")
+    lines.append("# TYPE attendance_notifications_total counter")
+    notifier = current_tenant().notifier
+    for result, n in (("published", notifier.published), ("sent", notifier.sent), ("failed", notifier.failed), ("dropped", notifier.dropped)):
+        lines.append(f'attendance_notifications_total{{result="{result}"}} {n}')
+    site, per_class = current_tenant().live.figures()
+    for name, key, kind, about in (
+        ("occupancy", "in_room", "gauge", f"Students who arrived in the last {OCCUPANCY_MINUTES} min, by class."),
+        ("arrivals_per_minute", "arrivals_per_min", "gauge", f"Average check-ins per minute over the last {LIVE_WINDOW} min, by class."),
+        ("arrivals_busiest_minute", "busiest_minute", "gauge", f"Most check-ins in one minute over the last {LIVE_WINDOW} min, by class."),
+        ("door_queue", "queue", "gauge", "Faces in front of the camera now, by class."),
+        ("door_queue_peak", "queue_peak", "gauge", f"Longest door queue over the last {LIVE_WINDOW} min, by class."),
+        ("arrivals_total", "arrivals_total", "counter", "Check-ins recorded from the cameras since start-up, by class."),
+    ):
+        lines.append(f"# HELP attendance_live_{name} {about}")
+        lines.append(f"# TYPE attendance_live_{name} {kind}")
+        for cls, f in list(per_class.items()) + [("ALL", site)]:
+            lines.append(f'attendance_live_{name}{{class="{cls}"}} {f[key]:g}')
+    lines.append(f"# HELP attendance_slow_sql_total Statements slower than SLOW_SQL_MS ({SLOW_SQL_MS:g} ms).")
+    lines.append("# TYPE attendance_slow_sql_total counter")
+    lines.append(f"attendance_slow_sql_total {slow_sql.total}")
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 # =========================
 # SERIAL READER THREAD
 # =========================
-def record_attendance(face_id: int):
+def record_attendance(face_id: int) -> str:
+    # Returns what happened: "recorded", "cooldown", "unknown" or "duplicate"
     # cooldown per ID
     now = time.time()
-    if face_id in last_seen and now - last_seen[face_id] < COOLDOWN_SECONDS:
-        return
+    tenant = current_tenant()
+    if not tenant.last_seen.allow(face_id, now):
+        return "cooldown"
 
-    last_seen[face_id] = now
-
-    with db_lock:
+    db = get_db()
+    with db.cursor("ingest") as cur:
         cur.execute("SELECT name, class FROM users WHERE id=?", (face_id,))
         row = cur.fetchone()
 
         if not row:
             print(f"Unknown ID: {face_id}")
-            return
+            return "unknown"
 
         name = row["name"]
         cls = row["class"]
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        cur.execute("INSERT INTO records(id, name, class, time) VALUES (?,?,?,?)", (face_id, name, cls, timestamp))
-        conn.commit()
+        ts = int(now)
+        timestamp = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+
+        cur.execute(
+            "INSERT OR IGNORE INTO checkins(hid, uid, cid, sid, ts, bucket) VALUES (?,?,?,?,?,?)",
+            (db.history_id(cur, face_id, name, cls, ts), face_id, db.class_id(cur, cls), db.source_id(cur, tenant.node), ts, ts // BUCKET_SECONDS),
+        )
+        inserted = cur.rowcount
+        cur.connection.commit()
+        if inserted:
+            db.changed(cur)
+
+    if not inserted:
+        # Already logged in this bucket (e.g. restart inside the cooldown window)
+        return "duplicate"
 
     print(f"RECORDED: {name} ({face_id}) [{cls}] @ {timestamp}")
+    tenant.live.arrive(face_id, cls, now)
+    tenant.notifier.publish("arrival", {"id": face_id, "name": name, "class": cls, "time": timestamp})
+    return "recorded"
+
+class SerialLink:
+    """Sequence/ack state for the sketch's ENTER/LEAVE events (go-back-N).
+
+    Every event carries a 16-bit sequence number and the sketch resends all
+    events after the last ACK until they are acknowledged. An event is taken
+    only if it is the next number; anything else is a repeat or comes after a
+    lost line, and is answered with the current ACK so the sketch resends
+    from there. Each resend starts with FROM:<seq>, the oldest event the
+    sketch still holds (its queue drops the oldest when full), so a gap it can
+    no longer fill is skipped. HELLO (sketch restart) starts the count again.
+    """
+
+    __slots__ = ("last", "in_view")
+
+    def __init__(self):
+        self.last = None  # last accepted seq, None = take whatever comes next
+        self.in_view = {}  # {id: epoch_seconds of ENTER}
+
+    def reset(self):
+        self.last = None
+        self.in_view.clear()
 
-def reader():
-    if not SERIAL_OK or ser is None:
+    def accept(self, seq: int) -> bool:
+        if self.last is None or seq == (self.last + 1) & 0xFFFF:
+            self.last = seq
+            return True
+        return False
+
+    def resync(self, oldest: int) -> None:
+        # Events before `oldest` were dropped by the sketch: stop waiting for them
+        if self.last is not None and 0 < (oldest - self.last - 1) & 0xFFFF < 0x8000:
+            self.last = (oldest - 1) & 0xFFFF
+
+
+class ClassWindow:
+    """Arrivals and door queue of one class over the last LIVE_WINDOW minutes.
+
+    A ring with one slot per minute holding the arrivals in that minute and
+    the longest queue seen in it, so memory stays the same however many
+    events arrive. Slots of minutes without events are cleared on the next use.
+    """
+
+    __slots__ = ("arrivals", "peaks", "start", "minute", "queue", "present", "total")
+
+    def __init__(self, minutes: int, minute: int):
+        self.arrivals = [0] * minutes
+        self.peaks = [0] * minutes
+        self.start = minute  # first minute seen, for the average while the window fills
+        self.minute = minute  # newest slot
+        self.queue = 0  # faces in front of the camera now
+        self.present = 0  # students who arrived in the last OCCUPANCY_MINUTES
+        self.total = 0  # arrivals since start-up
+
+    def advance(self, minute: int):
+        n = len(self.arrivals)
+        for m in range(self.minute + 1, min(minute, self.minute + n) + 1):
+            self.arrivals[m % n] = 0
+            self.peaks[m % n] = self.queue
+        self.minute = max(self.minute, minute)
+
+    def arrive(self, minute: int):
+        self.advance(minute)
+        self.arrivals[self.minute % len(self.arrivals)] += 1
+        self.total += 1
+
+    def move(self, minute: int, delta: int):
+        # delta +1 on ENTER, -1 on LEAVE
+        self.advance(minute)
+        self.queue = max(self.queue + delta, 0)
+        slot = self.minute % len(self.peaks)
+        self.peaks[slot] = max(self.peaks[slot], self.queue)
+
+    def figures(self, minute: int) -> dict:
+        self.advance(minute)
+        span = min(len(self.arrivals), self.minute - self.start + 1)
+        return {
+            "in_room": self.present,
+            "arrivals_per_min": sum(self.arrivals) / span,
+            "busiest_minute": max(self.arrivals),
+            "queue": self.queue,
+            "queue_peak": max(self.peaks),
+            "arrivals_total": self.total,
+        }
+
+
+class LiveStats:
+    """Live per-class figures for the dashboard and /metrics, fed by the serial readers.
+
+    Arrivals (recorded check-ins) and the door queue (faces between ENTER and
+    LEAVE, event sketch only) go into one ClassWindow per class and one for
+    the whole site; nothing is read back from the DB. The camera only sees
+    students come in, so one counts as in the room for OCCUPANCY_MINUTES after
+    arriving. Starts empty after a restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.site = ClassWindow(LIVE_WINDOW, int(time.time() // 60))
+        self.classes = {}  # classname -> ClassWindow
+        self._present = OrderedDict()  # {face_id: (epoch_seconds, classname)}, oldest arrival first
+        self._queued = {}  # {face_id: classname or ""}, faces in view now
+
+    def _window(self, cls: str, minute: int) -> ClassWindow:
+        w = self.classes.get(cls)
+        if w is None:
+            w = self.classes[cls] = ClassWindow(LIVE_WINDOW, minute)
+        return w
+
+    def _expire(self, now: float):
+        # Caller holds the lock. Bounded like Cooldowns: past LAST_SEEN_MAX the oldest goes early
+        present = self._present
+        while present:
+            ts, cls = next(iter(present.values()))
+            if now - ts < OCCUPANCY_MINUTES * 60 and len(present) <= LAST_SEEN_MAX:
+                break
+            present.popitem(last=False)
+            self.classes[cls].present -= 1
+            self.site.present -= 1
+
+    def arrive(self, face_id: int, cls: str, now: float):
+        minute = int(now // 60)
+        with self._lock:
+            self._expire(now)
+            old = self._present.pop(face_id, None)
+            if old:
+                self.classes[old[1]].present -= 1
+                self.site.present -= 1
+            self._present[face_id] = (now, cls)
+            for w in (self._window(cls, minute), self.site):
+                w.present += 1
+                w.arrive(minute)
+
+    def enter(self, face_id: int, now: float):
+        minute = int(now // 60)
+        with self._lock:
+            if face_id in self._queued:
+                return
+            entry = self._present.get(face_id)
+            cls = self._queued[face_id] = entry[1] if entry else ""
+            if cls:
+                self._window(cls, minute).move(minute, 1)
+            self.site.move(minute, 1)
+
+    def leave(self, face_id: int, now: float):
+        minute = int(now // 60)
+        with self._lock:
+            if face_id not in self._queued:
+                return
+            cls = self._queued.pop(face_id)
+            if cls:
+                self._window(cls, minute).move(minute, -1)
+            self.site.move(minute, -1)
+
+    def figures(self, now: float | None = None) -> tuple:
+        # (whole site, {classname: figures}) as of now
+        now = time.time() if now is None else now
+        minute = int(now // 60)
+        with self._lock:
+            self._expire(now)
+            return self.site.figures(minute), {c: w.figures(minute) for c, w in sorted(self.classes.items())}
+
+
+def reader(source: SerialSource):
+    # One thread per serial port; ports of the same tenant share its DB and cooldowns
+    tenant = current_tenant()
+    if not source.open():
+        print(f"[WARN] Serial not connected: {source.port} ({source.error})")
         return
+    print(f"[OK] Serial connected: {source.port} @ {BAUDRATE}")
+    ser, serial_link, recent_events = source.ser, source.link, tenant.recent_events
+
+    # Open the DB (and run the schema check) now rather than on the first face
+    with get_db().cursor():
+        pass
+    tenant.ready.set()
 
     while True:
         try:
@@ -1092,7 +2839,46 @@ def reader():
         if not line:
             continue
 
-        # We only care about FACE:<ID> lines (Arduino prints these)
+        # Change-only events: ENTER:<seq>:<ID> / LEAVE:<seq>:<ID>, acknowledged with ACK:<seq>
+        if line.startswith(("ENTER:", "LEAVE:")):
+            try:
+                kind, seq, face_id = line.split(":")
+                seq, face_id = int(seq), int(face_id)
+            except ValueError:
+                continue
+
+            if serial_link.accept(seq) and face_id != 0:
+                now = time.time()
+                if kind == "ENTER":
+                    serial_link.in_view[face_id] = now
+                    outcome = record_attendance(face_id)
+                    tenant.live.enter(face_id, now)
+                else:
+                    serial_link.in_view.pop(face_id, None)
+                    tenant.live.leave(face_id, now)
+                    outcome = "left"
+                recent_events.append(FaceEvent(face_id, now, outcome))
+            try:
+                ser.write(f"ACK:{serial_link.last}\n".encode())
+            except Exception:
+                pass
+            continue
+
+        if line.startswith("FROM:"):
+            try:
+                serial_link.resync(int(line[5:]))
+            except ValueError:
+                pass
+            continue
+
+        if line.startswith("HELLO"):
+            # Sketch (re)started: its sequence numbers begin again, and nobody is in view
+            for face_id in serial_link.in_view:
+                tenant.live.leave(face_id, time.time())
+            serial_link.reset()
+            continue
+
+        # Older sketches: FACE:<ID> for every frame a face is recognised
         if line.startswith("FACE:"):
             try:
                 face_id = int(line.split(":", 1)[1].strip())
@@ -1103,21 +2889,1900 @@ def reader():
             if face_id == 0:
                 continue
 
-            record_attendance(face_id)
+            outcome = record_attendance(face_id)
+            recent_events.append(FaceEvent(face_id, time.time(), outcome))
 
-# Start reader thread if serial is OK
-if SERIAL_OK:
-    threading.Thread(target=reader, daemon=True).start()
+
+# =========================
+# SYNC (store-and-forward)
+# =========================
+# Node side: ship records past the high-water mark (seq) to SYNC_URL in
+# gzip-compressed JSON batches. The mark only advances when the aggregator
+# acknowledges a batch, so anything logged while offline is sent later.
+# Aggregator side: /sync/ingest keeps the last acknowledged seq per node to skip
+# replayed batches cheaply; the records natural key makes any overlap a no-op.
+def sync_once() -> int:
+    import gzip
+    import urllib.request
+
+    hwm = int(get_state("hwm", "0"))
+    epoch = get_state("epoch")
+
+    with get_db().cursor("background") as cur:
+        cur.execute(
+            "SELECT seq, id, name, class, ts, source FROM records WHERE seq > ? ORDER BY seq LIMIT ?",
+            (hwm, SYNC_BATCH),
+        )
+        rows = cur.fetchall()
+
+    if not rows:
+        return 0
+
+    payload = {
+        "node": current_tenant().node,
+        "epoch": epoch,
+        "records": [[r["seq"], r["id"], r["name"], r["class"], r["ts"], r["source"]] for r in rows],
+    }
+    body = gzip.compress(json.dumps(payload, separators=(",", ":")).encode())
+    req = urllib.request.Request(
+        SYNC_URL.rstrip("/") + "/sync/ingest",
+        data=body,
+        method="POST",
+        headers={
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "X-Sync-Token": SYNC_TOKEN,
+        },
+    )
+    with urllib.request.urlopen(req, timeout=15) as resp:
+        ack = json.loads(resp.read().decode())
+
+    acked = int(ack["acked"])
+    with get_db().cursor() as cur:
+        # Skip the update if the epoch changed (attendance reset) while the batch was in flight
+        cur.execute("UPDATE sync_state SET value=? WHERE key='hwm' AND EXISTS (SELECT 1 FROM sync_state WHERE key='epoch' AND value=?)", (str(acked), epoch))
+        cur.connection.commit()
+
+    sync_status = current_tenant().sync_status
+    sync_status["sent"] += len(rows)
+    sync_status["last_ok"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    sync_status["last_error"] = ""
+    return len(rows)
+
+def sync_agent():
+    delay = SYNC_INTERVAL
+    while True:
+        try:
+            sent = sync_once()
+        except Exception as e:
+            # Offline or aggregator down: exponential backoff with jitter
+            current_tenant().sync_status["last_error"] = str(e)
+            delay = min(max(delay, 1.0) * 2, SYNC_MAX_BACKOFF)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            continue
+
+        delay = SYNC_INTERVAL
+        if sent < SYNC_BATCH:
+            time.sleep(SYNC_INTERVAL)
+        # Full batch: more are waiting, keep draining without sleeping
+
+@bp.route("/sync/ingest", methods=["POST"])
+def sync_ingest():
+    # An aggregator without a token would take check-ins from anyone who can reach it
+    if not SYNC_TOKEN or request.headers.get("X-Sync-Token") != SYNC_TOKEN:
+        abort(403)
+    if request.content_length is None or request.content_length > SYNC_MAX_BYTES:
+        abort(413)
+
+    raw = request.get_data()
+    if request.headers.get("Content-Encoding") == "gzip":
+        import zlib
+        unpack = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip framing
+        try:
+            raw = unpack.decompress(raw, SYNC_MAX_BYTES)
+        except zlib.error:
+            abort(400)
+        if unpack.unconsumed_tail:
+            abort(413)
+    try:
+        payload = json.loads(raw)
+        node = str(payload["node"])
+        epoch = str(payload["epoch"])
+        # ts: epoch seconds as stored on the node, so no local-time round trip
+        rows = [(int(r[0]), int(r[1]), str(r[2]), str(r[3]), int(r[4]), str(r[5] or node))
+                for r in payload["records"]]
+    except Exception:
+        abort(400)
+
+    db = get_db()
+    with db.cursor("ingest") as cur:
+        cur.execute("SELECT epoch, last_seq FROM sync_peers WHERE node=?", (node,))
+        peer = cur.fetchone()
+        last_seq = peer["last_seq"] if peer and peer["epoch"] == epoch else 0
+
+        cur.executemany(
+            "INSERT OR IGNORE INTO checkins(hid, uid, cid, sid, ts, bucket) VALUES (?,?,?,?,?,?)",
+            [(db.history_id(cur, uid, name, cls, ts), uid, db.class_id(cur, cls), db.source_id(cur, src), ts, ts // BUCKET_SECONDS)
+             for seq, uid, name, cls, ts, src in rows if seq > last_seq],
+        )
+        stored = max(cur.rowcount, 0)
+        acked = max([last_seq] + [r[0] for r in rows])
+        cur.execute(
+            "INSERT INTO sync_peers(node, epoch, last_seq, total, last_sync) VALUES (?,?,?,?,?) "
+            "ON CONFLICT(node) DO UPDATE SET epoch=excluded.epoch, last_seq=excluded.last_seq, "
+            "total=total+?, last_sync=excluded.last_sync",
+            (node, epoch, acked, stored, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), stored),
+        )
+        cur.connection.commit()
+        if stored:
+            db.changed(cur)
+
+    return jsonify(acked=acked, stored=stored)
+
+@bp.route("/sync/status")
+def sync_status_view():
+    hwm = int(get_state("hwm", "0"))
+    with get_db().cursor() as cur:
+        cur.execute("SELECT COUNT(*) AS c FROM checkins WHERE seq > ?", (hwm,))
+        pending = cur.fetchone()["c"]
+        cur.execute("SELECT node, epoch, last_seq, total, last_sync FROM sync_peers ORDER BY node")
+        peers = [dict(r) for r in cur.fetchall()]
+
+    return jsonify(
+        node=current_tenant().node,
+        sync_url=SYNC_URL,
+        hwm=hwm,
+        pending=pending if SYNC_URL else 0,
+        peers=peers,
+        **current_tenant().sync_status,
+    )
 
 
 # =========================
-# RUN SERVER
+# BACKUPS
 # =========================
-if __name__ == "__main__":
-    print(f"[INFO] DB: {DB_PATH}")
-    if SERIAL_OK:
-        print(f"[OK] Serial connected: {SERIAL_PORT} @ {BAUDRATE}")
+BACKUP_NAME = re.compile(r"^attendance-\d{8}-\d{6}\.db(\.gz)?$")
+
+def list_backups() -> list:
+    # Newest first: (name, bytes, mtime); names sort by the time they were taken
+    folder = current_tenant().backup_dir
+    if not os.path.isdir(folder):
+        return []
+    found = []
+    for name in os.listdir(folder):
+        if BACKUP_NAME.match(name):
+            st = os.stat(os.path.join(folder, name))
+            found.append((name, st.st_size, st.st_mtime))
+    return sorted(found, reverse=True)
+
+def gzip_file(src: str, dst: str) -> None:
+    import gzip
+    import shutil
+    with open(src, "rb") as f_in, gzip.open(dst, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+def gunzip_file(src: str, dst: str) -> None:
+    import gzip
+    import shutil
+    with gzip.open(src, "rb") as f_in, open(dst, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+
+def backup_now() -> str:
+    # Copies the live DB with SQLite's online backup API, BACKUP_PAGES pages per
+    # step. Between steps the connection goes back to any queued check-in or page,
+    # and because the copy runs on the same connection, those writes never force
+    # it to start over. Returns the snapshot file name.
+    tenant = current_tenant()
+    folder, backup_status = tenant.backup_dir, tenant.backup_status
+    if not tenant.backup_lock.acquire(blocking=False):
+        raise RuntimeError("a backup is already running")
+    name = f"attendance-{datetime.now():%Y%m%d-%H%M%S}.db"
+    part = os.path.join(folder, name + ".part")
+    try:
+        os.makedirs(folder, exist_ok=True)
+        backup_status.update(running=True, remaining=0, pagecount=0)
+        db = get_db()
+
+        target = sqlite3.connect(part)
+        # No syncs while copying: the steps run inside the DB slot, and a check-in
+        # queued behind one must not wait on the SD card. The finished file is
+        # flushed once below, with the slot released.
+        target.execute("PRAGMA synchronous = OFF")
+
+        def progress(status, remaining, total):
+            backup_status.update(remaining=remaining, pagecount=total)
+            db.sched.pause("background")
+
+        try:
+            with db.cursor("background") as cur:
+                cur.connection.backup(target, pages=BACKUP_PAGES, progress=progress)
+        finally:
+            target.close()
+
+        if BACKUP_GZIP:
+            gzip_file(part, part + ".gz")
+            os.remove(part)
+            part += ".gz"
+            name += ".gz"
+        flush = os.open(part, os.O_RDONLY)
+        try:
+            os.fsync(flush)
+        finally:
+            os.close(flush)
+        os.replace(part, os.path.join(folder, name))
+
+        for old, _, _ in list_backups()[BACKUP_KEEP:]:
+            os.remove(os.path.join(folder, old))
+            view = os.path.join(folder, ".view", old.removesuffix(".gz"))
+            if os.path.exists(view):
+                os.remove(view)
+
+        backup_status.update(last_ok=f"{name} @ {datetime.now():%Y-%m-%d %H:%M:%S}", last_error="")
+        print(f"[OK] Backup: {os.path.join(folder, name)}")
+        return name
+    except Exception as e:
+        backup_status["last_error"] = str(e)
+        for leftover in (part, part + ".gz"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    finally:
+        backup_status["running"] = False
+        tenant.backup_lock.release()
+
+def open_snapshot(name: str) -> sqlite3.Connection:
+    # Read-only connection to a snapshot; .gz snapshots are unpacked once into .view/
+    folder = current_tenant().backup_dir
+    if not BACKUP_NAME.match(name) or not os.path.exists(os.path.join(folder, name)):
+        abort(404)
+    path = os.path.join(folder, name)
+    if name.endswith(".gz"):
+        view = os.path.join(folder, ".view", name[:-3])
+        if not os.path.exists(view):
+            os.makedirs(os.path.dirname(view), exist_ok=True)
+            gunzip_file(path, view + ".part")
+            os.replace(view + ".part", view)
+        path = view
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def restore_backup(src: str, dst: str) -> None:
+    # Command line only (python app.py --restore FILE), with the service stopped
+    plain = src
+    if src.endswith(".gz"):
+        plain = dst + ".restore"
+        gunzip_file(src, plain)
+    try:
+        snap = sqlite3.connect(f"file:{quote(os.path.abspath(plain))}?mode=ro", uri=True)
+        check = snap.execute("PRAGMA integrity_check").fetchone()[0]
+        if check != "ok":
+            raise SystemExit(f"[WARN] {src} failed integrity_check: {check}")
+        if os.path.exists(dst):
+            keep = f"{dst}.before-restore"
+            os.replace(dst, keep)
+            print(f"[INFO] Previous DB kept as {keep}")
+        target = sqlite3.connect(dst)
+        snap.backup(target)
+        target.close()
+        snap.close()
+        print(f"[OK] Restored {src} -> {dst}")
+    finally:
+        if plain != src and os.path.exists(plain):
+            os.remove(plain)
+
+@bp.route("/backups")
+def backups():
+    snaps = list_backups()
+    backup_status = current_tenant().backup_status
+    site = f"--tenant {current_tenant().name} " if current_tenant().prefix else ""
+    if backup_status["running"]:
+        total = backup_status["pagecount"] or 1
+        note = f'<div class="notice">Backup running: {100 * (total - backup_status["remaining"]) // total}% of {backup_status["pagecount"]} pages.</div>'
+    elif backup_status["last_error"]:
+        note = f'<div class="notice bad">Last backup failed: {html.escape(backup_status["last_error"])}</div>'
+    elif backup_status["last_ok"]:
+        note = f'<div class="notice good">Last backup: {backup_status["last_ok"]}</div>'
     else:
-        print(f"[WARN] Serial not connected: {SERIAL_PORT} ({SERIAL_ERROR})")
+        note = ""
+
+    rows = "".join(
+        f"<tr><td>{name}</td><td>{datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M}</td><td>{size / 1048576:.1f} MB</td>"
+        f"<td><a class='btn small' href='/backups/{name}'>View</a> "
+        f"<a class='btn small success' href='/backups/{name}/download'>Download</a></td></tr>"
+        for name, size, mtime in snaps
+    )
+    schedule = f"cron {BACKUP_CRON}" if BACKUP_CRON else "on demand only"
+
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Backups</h2>
+        <a class="btn small" href="/">⬅ Back</a>
+      </div>
+      <div class="body">
+        {note}
+        <div class="actions" style="margin-bottom:14px;">
+          <form action="/backup" method="post" style="margin:0;">
+            <button class="btn primary" type="submit">💾 Back Up Now</button>
+          </form>
+          <span class="badge">Schedule: {schedule} • keep {BACKUP_KEEP}{' • gzip' if BACKUP_GZIP else ''}</span>
+        </div>
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Snapshot</th><th>Taken</th><th>Size</th><th>Action</th></tr></thead>
+            <tbody>
+              {rows or "<tr><td colspan='4' class='muted'>No backups yet.</td></tr>"}
+            </tbody>
+          </table>
+        </div>
+        <p class="muted" style="margin-top:10px;">Restore (service stopped): python app.py {site}--restore {current_tenant().backup_dir}/&lt;snapshot&gt;</p>
+      </div>
+    </div>
+    """
+    return render_template_string(page_wrap(inner))
+
 
+@bp.route("/backup", methods=["POST"])
+def backup_start():
+    admin_only()
+    jobs.submit("backup")
+    return redirect("/backups")
+
+
+@bp.route("/backups/<name>")
+def backup_view(name):
+    # Historical report straight from the snapshot, read-only
+    conn = open_snapshot(name)
+    try:
+        source = "SELECT cid, 1 AS n, ts AS first, ts AS last FROM checkins"
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name='presence'").fetchone():
+            source += " UNION ALL SELECT cid, hits, first_ts, last_ts FROM presence"
+        per_class = conn.execute(
+            "SELECT k.classname AS class, SUM(c.n) AS cnt, MIN(c.first) AS first, MAX(c.last) AS last "
+            f"FROM ({source}) c JOIN class_ids k ON k.cid = c.cid GROUP BY c.cid ORDER BY k.classname"
+        ).fetchall()
+        users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        recent = conn.execute("SELECT * FROM records ORDER BY bucket DESC, ts DESC LIMIT 20").fetchall()
+    finally:
+        conn.close()
+
+    def day(ts):
+        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+
+    rows = "".join(
+        f"<tr><td>{r['class']}</td><td>{r['cnt']}</td><td>{day(r['first'])}</td><td>{day(r['last'])}</td>"
+        f"<td><a class='btn small success' href='/backups/{name}/export_csv?class={r['class']}'>Export</a></td></tr>"
+        for r in per_class
+    )
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Snapshot {name}</h2>
+        <div style="display:flex; gap:10px; align-items:center; flex-wrap:wrap;">
+          <span class="badge">Read-only • {users} user(s) • {sum(r['cnt'] for r in per_class)} record(s)</span>
+          <a class="btn small success" href="/backups/{name}/export_csv">⬇ Export CSV</a>
+          <a class="btn small" href="/backups">⬅ Back</a>
+        </div>
+      </div>
+      <div class="body">
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Class</th><th>Records</th><th>From</th><th>To</th><th>Export</th></tr></thead>
+            <tbody>
+              {rows or "<tr><td colspan='5' class='muted'>No records in this snapshot.</td></tr>"}
+            </tbody>
+          </table>
+        </div>
+        <hr class="sep">
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>ID</th><th>Name</th><th>Class</th><th>Timestamp</th></tr></thead>
+            <tbody>
+              {''.join([f"<tr><td>{r['id']}</td><td>{r['name']}</td><td>{r['class']}</td><td>{r['time']}</td></tr>" for r in recent])}
+            </tbody>
+          </table>
+        </div>
+      </div>
+    </div>
+    """
+    return render_template_string(page_wrap(inner))
+
+
+@bp.route("/backups/<name>/export_csv")
+def backup_export_csv(name):
+    cls = (request.args.get("class") or "").strip()
+    conn = open_snapshot(name)
+    base = name.split(".")[0]
+    filename = f"{base}.csv" if not (cls and cls != "ALL") else f"{base}_{cls.replace(' ', '_')}.csv"
+
+    def generate():
+        # The snapshot has its own connection, so no scheduler slot is needed
+        try:
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(["ID", "Name", "Class", "Timestamp"])
+            yield output.getvalue().encode()
+            output.seek(0)
+            output.truncate()
+            if cls and cls != "ALL":
+                cur = conn.execute("SELECT * FROM records WHERE cid=(SELECT cid FROM class_ids WHERE classname=?) "
+                                   "ORDER BY bucket DESC, ts DESC", (cls,))
+            else:
+                cur = conn.execute("SELECT * FROM records ORDER BY bucket DESC, ts DESC")
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                for r in rows:
+                    writer.writerow([r["id"], r["name"], r["class"], r["time"]])
+                yield output.getvalue().encode()
+                output.seek(0)
+                output.truncate()
+        finally:
+            conn.close()
+
+    return Response(
+        generate(),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@bp.route("/backups/<name>/download")
+def backup_download(name):
+    admin_only()
+    folder = current_tenant().backup_dir
+    if not BACKUP_NAME.match(name) or not os.path.exists(os.path.join(folder, name)):
+        abort(404)
+    return send_file(os.path.abspath(os.path.join(folder, name)), as_attachment=True, download_name=name)
+
+
+# =========================
+# BACKGROUND JOBS
+# =========================
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+def parse_cron(spec: str) -> list:
+    # "minute hour day month weekday" -> list of sets; supports *, */n, a-b, a-b/n, a,b
+    fields = spec.split()
+    if len(fields) != 5:
+        raise ValueError(f"cron needs 5 fields: {spec!r}")
+    sets = []
+    for field, (lo, hi) in zip(fields, CRON_FIELDS):
+        values = set()
+        for part in field.split(","):
+            rng, _, step = part.partition("/")
+            if rng == "*":
+                a, b = lo, hi
+            elif "-" in rng:
+                a, b = (int(x) for x in rng.split("-"))
+            else:
+                a = b = int(rng)
+            if a < lo or b > hi or a > b:
+                raise ValueError(f"cron field out of range: {part!r}")
+            values.update(range(a, b + 1, int(step or 1)))
+        sets.append(values)
+    if 7 in sets[4]:
+        sets[4].add(0)  # 0 and 7 are both Sunday
+    # Day of month and weekday: if both are restricted, either may match (as in cron)
+    sets.append(fields[2] != "*" and fields[4] != "*")
+    return sets
+
+def cron_next(spec: str, after: datetime) -> datetime:
+    # First matching minute strictly after `after`
+    minutes, hours, days, months, weekdays, either = parse_cron(spec)
+    t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = t + timedelta(days=366 * 5)
+    while t < limit:
+        if t.month not in months:
+            t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            continue
+        dom, dow = t.day in days, (t.weekday() + 1) % 7 in weekdays
+        if not ((dom or dow) if either else (dom and dow)):
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if t.hour not in hours:
+            t = t.replace(minute=0) + timedelta(hours=1)
+            continue
+        if t.minute not in minutes:
+            t += timedelta(minutes=1)
+            continue
+        return t
+    raise ValueError(f"cron never matches: {spec!r}")
+
+
+class JobScheduler:
+    """Cron-style periodic jobs, run in a small worker pool off the request path.
+
+    The "jobs" thread only decides what is due. Each run goes to the pool, and a
+    job that is still running when it comes due again is skipped (single flight).
+    The last run of every job is kept in job_state, so a run missed while the Pi
+    was off happens once after the next start. Jobs use "background" DB slots.
+    Every job runs once per tenant, against that tenant's DB.
+    """
+
+    def __init__(self):
+        self.jobs = {}  # name -> {"cron", "fn", "about"}
+        self.next = {}  # (tenant, job name) -> datetime of the next run
+        self.running = set()  # (tenant, job name)
+        self.sites = 0  # tenants of every started app (pool size)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def add(self, name: str, cron: str, fn, about: str):
+        if cron:
+            parse_cron(cron)  # fail at startup, not at 2am
+        self.jobs[name] = {"cron": cron, "fn": fn, "about": about}
+
+    def start(self, tenants: dict):
+        # One scheduler thread per app, over that app's tenants
+        with self._lock:
+            self.sites += len(tenants)
+        threading.Thread(target=self._loop, args=(list(tenants.values()),), daemon=True, name="jobs").start()
+
+    def _loop(self, sites: list):
+        for tenant in sites:
+            with tenant.db.cursor("background") as cur:
+                cur.execute("SELECT name, last_run FROM job_state")
+                last = {r["name"]: r["last_run"] for r in cur.fetchall()}
+            now = datetime.now()
+            for name, job in self.jobs.items():
+                if job["cron"]:
+                    since = datetime.fromtimestamp(last[name]) if name in last else now
+                    self.next[(tenant, name)] = cron_next(job["cron"], since)
+
+        while True:
+            now = datetime.now()
+            for (tenant, name), due in list(self.next.items()):
+                if due <= now and tenant in sites:
+                    self.next[(tenant, name)] = cron_next(self.jobs[name]["cron"], now)
+                    self.submit(name, tenant)
+            # Re-check at least every minute: the Pi's clock may jump once NTP syncs
+            due = self.next.values()
+            wait = min((d - datetime.now()).total_seconds() for d in due) if due else 60
+            time.sleep(min(max(wait, 1), 60))
+
+    def submit(self, name: str, tenant=None) -> bool:
+        # Queue one run now (for the current tenant by default); False if it is already running
+        tenant = tenant or current_tenant()
+        with self._lock:
+            if (tenant, name) in self.running:
+                return False
+            self.running.add((tenant, name))
+            if self._pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._pool = ThreadPoolExecutor(max_workers=JOB_WORKERS * max(self.sites, 1), thread_name_prefix="job")
+        self._pool.submit(self._run, name, tenant)
+        return True
+
+    def _run(self, name: str, tenant):
+        _local.tenant = tenant
+        started = time.time()
+        result, error = "", ""
+        try:
+            result = str(self.jobs[name]["fn"]() or "")
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            print(f"[WARN] Job {name} failed{f' ({tenant.name})' if tenant.prefix else ''}: {error}")
+        finally:
+            with self._lock:
+                self.running.discard((tenant, name))
+
+        with get_db().cursor("background") as cur:
+            cur.execute(
+                "INSERT INTO job_state(name, last_run, duration, result, error, runs, failures) VALUES (?,?,?,?,?,1,?) "
+                "ON CONFLICT(name) DO UPDATE SET last_run=excluded.last_run, duration=excluded.duration, "
+                "result=excluded.result, error=excluded.error, runs=runs+1, failures=failures+excluded.failures",
+                (name, int(started), time.time() - started, result, error, 1 if error else 0),
+            )
+            cur.connection.commit()
+
+
+def rollup_daily() -> str:
+    # Per-day, per-class check-ins and distinct students for finished days, one
+    # day per DB slot. The last ROLLUP_LOOKBACK days are re-counted every run so
+    # records that arrive late from other nodes are included.
+    db = get_db()
+    with db.cursor("background") as cur:
+        cur.execute("SELECT MIN(bucket) AS b FROM checkins")
+        first = cur.fetchone()["b"]
+        cur.execute("SELECT MIN(day) AS d FROM presence")
+        compacted = cur.fetchone()["d"]
+        cur.execute("SELECT value FROM sync_state WHERE key='rollup_through'")
+        row = cur.fetchone()
+    starts = ([date.fromtimestamp(first * BUCKET_SECONDS)] if first is not None else []) \
+        + ([date.fromisoformat(compacted)] if compacted else [])
+    if not starts:
+        return "no records"
+
+    day = min(starts)
+    if row:
+        day = max(day, date.fromisoformat(row["value"]) - timedelta(days=ROLLUP_LOOKBACK - 1))
+    done = 0
+    while day < date.today():
+        lo, hi = day_start(day.isoformat()), day_start((day + timedelta(days=1)).isoformat())
+        with db.cursor("background") as cur:
+            cur.execute("DELETE FROM daily_summary WHERE day=?", (day.isoformat(),))
+            cur.execute(
+                "INSERT INTO daily_summary(day, cid, checkins, students) "
+                "SELECT ?, cid, SUM(hits), COUNT(DISTINCT uid) FROM ("
+                "SELECT cid, uid, 1 AS hits FROM checkins WHERE bucket >= ? AND bucket <= ? AND ts >= ? AND ts < ? "
+                "UNION ALL SELECT cid, uid, hits FROM presence WHERE day = ?) GROUP BY cid",
+                (day.isoformat(), lo // BUCKET_SECONDS, hi // BUCKET_SECONDS, lo, hi, day.isoformat()),
+            )
+            cur.execute("INSERT OR REPLACE INTO sync_state(key, value) VALUES ('rollup_through', ?)", (day.isoformat(),))
+            cur.connection.commit()
+            db.changed(cur, ("daily_summary",))
+        day += timedelta(days=1)
+        done += 1
+    return f"{done} day(s)"
+
+
+def compact_checkins() -> str:
+    # Check-ins older than RETENTION_DAYS become one presence row per student, day
+    # and source (first/last seen, hits), COMPACT_WINDOW seconds per DB slot so
+    # check-ins are never held up. Windows merge into rows already there, so a late
+    # sync batch for a compacted day is folded in on the next run.
+    if RETENTION_DAYS <= 0:
+        return "off (RETENTION_DAYS=0)"
+    db = get_db()
+    cutoff = day_start((date.today() - timedelta(days=RETENTION_DAYS)).isoformat())
+    with db.cursor("background") as cur:
+        cur.execute("SELECT MIN(bucket) AS b FROM checkins")
+        first = cur.fetchone()["b"]
+        # seq is the rowid: the newest row stays so numbering never restarts under the sync high-water mark
+        cur.execute("SELECT MAX(seq) AS s FROM checkins")
+        keep = cur.fetchone()["s"]
+    if SYNC_URL:
+        # Rows the aggregator has not acknowledged yet stay raw
+        keep = min(keep or 0, int(get_state("hwm", "0")) + 1)
+
+    moved = 0
+    lo = (first or 0) * BUCKET_SECONDS
+    while first is not None and lo < cutoff:
+        hi = min(lo - lo % COMPACT_WINDOW + COMPACT_WINDOW, cutoff)
+        args = (lo // BUCKET_SECONDS, hi // BUCKET_SECONDS, lo, hi, keep)
+        with db.cursor("background") as cur:
+            cur.execute(
+                "INSERT INTO presence(cid, day, uid, hid, sid, first_ts, last_ts, hits) "
+                "SELECT cid, date(ts, 'unixepoch', 'localtime'), uid, hid, sid, MIN(ts), MAX(ts), COUNT(*) FROM checkins "
+                "WHERE bucket >= ? AND bucket <= ? AND ts >= ? AND ts < ? AND seq < ? GROUP BY 1, 2, 3, 4, 5 "
+                "ON CONFLICT(cid, day, uid, hid, sid) DO UPDATE SET first_ts=MIN(first_ts, excluded.first_ts), "
+                "last_ts=MAX(last_ts, excluded.last_ts), hits=hits+excluded.hits",
+                args,
+            )
+            cur.execute("DELETE FROM checkins WHERE bucket >= ? AND bucket <= ? AND ts >= ? AND ts < ? AND seq < ?", args)
+            moved += max(cur.rowcount, 0)
+            cur.connection.commit()
+            db.changed()
+            # Skip empty stretches (holidays) in one step
+            cur.execute("SELECT bucket FROM checkins WHERE bucket >= ? ORDER BY bucket LIMIT 1", (hi // BUCKET_SECONDS,))
+            row = cur.fetchone()
+        lo = max(hi, row["bucket"] * BUCKET_SECONDS) if row else cutoff
+
+    if moved and db.replica is not None:
+        # Totals were the same after every window; the replica's rows catch up once here
+        with db.cursor("background") as cur:
+            db.changed(cur, ("checkins",))
+    return f"{moved} check-in(s) compacted, {reclaim_space()} page(s) freed"
+
+def reclaim_space() -> int:
+    # Hands free pages back to the file system VACUUM_PAGES at a time, one DB slot
+    # per step. Without auto_vacuum=INCREMENTAL (see --vacuum) freed pages are
+    # reused by new check-ins instead and the file just stops growing.
+    db = get_db()
+    freed = 0
+    with db.cursor("background") as cur:
+        cur.execute("PRAGMA auto_vacuum")
+        if cur.fetchone()[0] != 2:
+            return 0
+    while True:
+        with db.cursor("background") as cur:
+            cur.execute("PRAGMA freelist_count")
+            free = cur.fetchone()[0]
+            if not free:
+                return freed
+            cur.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            cur.fetchall()
+            freed += min(free, VACUUM_PAGES)
+
+def vacuum_file(path: str) -> None:
+    # One-off and exclusive (stop the service first): rewrites an existing DB with
+    # auto_vacuum=INCREMENTAL. Databases created by this version already are.
+    before = os.path.getsize(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    print(f"[OK] Vacuumed {path}: {before // 1024} KB -> {os.path.getsize(path) // 1024} KB")
+
+
+jobs = JobScheduler()
+jobs.add("backup", BACKUP_CRON, backup_now, "Online snapshot of the DB into BACKUP_DIR")
+jobs.add("rollup", ROLLUP_CRON, rollup_daily, "Daily per-class totals (daily_summary)")
+jobs.add("compact", COMPACT_CRON, compact_checkins, "Check-ins older than RETENTION_DAYS into daily presence rows")
+
+
+@bp.route("/jobs")
+def jobs_view():
+    with get_db().cursor() as cur:
+        cur.execute("SELECT * FROM job_state")
+        state = {r["name"]: r for r in cur.fetchall()}
+
+    site = current_tenant()
+    rows = ""
+    for name, job in jobs.jobs.items():
+        st = state.get(name)
+        if (site, name) in jobs.running:
+            last = "<span class='badge'>running…</span>"
+        elif st:
+            when = datetime.fromtimestamp(st["last_run"]).strftime("%Y-%m-%d %H:%M")
+            outcome = f"⚠ {html.escape(st['error'])}" if st["error"] else html.escape(st["result"] or "ok")
+            last = f"{when} ({st['duration']:.1f}s) — {outcome}"
+        else:
+            last = "<span class='muted'>never</span>"
+        nxt = jobs.next[(site, name)].strftime("%Y-%m-%d %H:%M") if (site, name) in jobs.next else "—"
+        runs = f"{st['runs']} / {st['failures']} failed" if st else "0"
+        rows += (
+            f"<tr><td><b>{name}</b><br><span class='muted'>{job['about']}</span></td>"
+            f"<td>{job['cron'] or 'manual'}</td><td>{nxt}</td><td>{last}</td><td>{runs}</td>"
+            f"<td><form action='/jobs/{name}/run' method='post' style='margin:0;'>"
+            f"<button class='btn small primary' type='submit'>▶ Run now</button></form></td></tr>"
+        )
+
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Background Jobs</h2>
+        <a class="btn small" href="/">⬅ Back</a>
+      </div>
+      <div class="body">
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Job</th><th>Schedule</th><th>Next run</th><th>Last run</th><th>Runs</th><th>Action</th></tr></thead>
+            <tbody>{rows}</tbody>
+          </table>
+        </div>
+        <p class="muted" style="margin-top:10px;">Jobs run {JOB_WORKERS} at a time at the lowest DB priority; a job still running is not started twice.</p>
+      </div>
+    </div>
+    """
+    return render_template_string(page_wrap(inner))
+
+
+@bp.route("/jobs/<name>/run", methods=["POST"])
+def job_run(name):
+    admin_only()
+    if name not in jobs.jobs:
+        abort(404)
+    jobs.submit(name)
+    return redirect("/jobs")
+
+
+# =========================
+# NOTIFICATIONS
+# =========================
+def notify_webhook(url: str, message: dict):
+    import urllib.request
+
+    req = urllib.request.Request(url, data=json.dumps(message).encode(), method="POST",
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        resp.read()
+
+def notify_email(address: str, message: dict):
+    import smtplib
+    from email.message import EmailMessage
+
+    msg = EmailMessage()
+    msg["From"] = NOTIFY_FROM
+    msg["To"] = address
+    msg["Subject"] = message["subject"]
+    msg.set_content(message["text"])
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as smtp:
+        smtp.send_message(msg)
+
+def notify_file(path: str, message: dict):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(message) + "\n")
+
+# Sink name (the part before ":" in NOTIFY_TO) -> send(address, message); raise on failure
+NOTIFY_SINKS = {"webhook": notify_webhook, "email": notify_email, "file": notify_file}
+
+
+def parse_recipients(spec: str) -> list:
+    recipients = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        sink, _, address = part.partition(":")
+        address, _, cls = address.partition("#")
+        if sink not in NOTIFY_SINKS or not address:
+            raise ValueError(f"NOTIFY_TO: expected sink:address with sink in {sorted(NOTIFY_SINKS)}, got {part!r}")
+        recipients.append({"key": part, "sink": sink, "address": address.strip(), "class": cls.strip()})
+    return recipients
+
+
+def coalesce(rows) -> dict:
+    # One message from a recipient's queued events: repeat arrivals of a student
+    # are dropped, and a class's absence list is replaced by the latest one
+    arrivals, absences = {}, {}
+    for r in rows:
+        p = json.loads(r["payload"])
+        if r["kind"] == "arrival":
+            arrivals.setdefault(p["id"], p)
+        elif r["kind"] == "absent":
+            absences[(p["class"], p["day"])] = p
+
+    lines, subject = [], []
+    if arrivals:
+        subject.append(f"{len(arrivals)} arrived")
+        lines.append(f"Arrived ({len(arrivals)}):")
+        lines += [f"  {p['time'][11:16]}  {p['name']} ({p['class']})" for p in arrivals.values()]
+    if absences:
+        absent = sum(len(p["students"]) for p in absences.values())
+        where = next(iter(absences.values()))["class"] if len(absences) == 1 else f"{len(absences)} classes"
+        subject.append(f"{absent} absent in {where}")
+    for p in absences.values():
+        lines.append(f"Absent in {p['class']} on {p['day']} ({len(p['students'])}):")
+        lines += [f"  {name} (ID {uid})" for uid, name in p["students"]]
+    return {
+        "subject": "Attendance: " + ", ".join(subject),
+        "text": "\n".join(lines),
+        "node": current_tenant().node,
+        "arrivals": list(arrivals.values()),
+        "absences": list(absences.values()),
+    }
+
+
+class Notifier:
+    """Arrival and absence notifications, delivered off the serial path.
+
+    publish() only appends to an in-memory buffer and wakes the "notify"
+    thread, so a check-in never waits on a sink. That thread copies new events
+    into notify_queue, one row per interested recipient, in background DB
+    slots. Once a recipient's oldest event is NOTIFY_COALESCE seconds old, all
+    of its events go out as one coalesced message. A failed send is retried
+    with exponential backoff. After NOTIFY_MAX_ATTEMPTS the rows stay queued
+    as failed until retried from /notifications. Delivery is at least once:
+    rows are deleted only after the sink returns.
+    """
+
+    def __init__(self, recipients: list):
+        self.recipients = recipients
+        self.by_key = {r["key"]: r for r in recipients}
+        self._buffer = deque(maxlen=NOTIFY_BUFFER)
+        self._wake = threading.Event()
+        self.published = 0
+        self.dropped = 0  # buffer full (DB far behind)
+        self.sent = 0
+        self.failed = 0
+        self.last_sent = {}   # recipient key -> epoch seconds
+        self.last_error = {}  # recipient key -> error text
+
+    def publish(self, kind: str, payload: dict):
+        if not self.recipients:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((kind, payload, int(time.time())))
+        self.published += 1
+        self._wake.set()
+
+    def start(self, tenant):
+        spawn(tenant, self._loop, "notify")
+
+    def _loop(self):
+        wait = 0
+        while True:
+            self._wake.wait(wait)
+            self._wake.clear()
+            try:
+                self._persist()
+                wait = self._deliver()
+            except Exception as e:
+                print(f"[WARN] Notifications: {e}")
+                wait = 30
+
+    def _persist(self):
+        rows = []
+        while self._buffer:
+            kind, payload, created = self._buffer.popleft()
+            for r in self.recipients:
+                if not r["class"] or r["class"] == payload.get("class"):
+                    rows.append((r["key"], kind, json.dumps(payload), created, created + NOTIFY_COALESCE))
+        if rows:
+            with get_db().cursor("background") as cur:
+                cur.executemany("INSERT INTO notify_queue(recipient, kind, payload, created, next_try) VALUES (?,?,?,?,?)", rows)
+                cur.connection.commit()
+
+    def _deliver(self):
+        # Send every recipient whose batch is due; returns seconds until the next one (None = nothing queued)
+        with get_db().cursor("background") as cur:
+            cur.execute("SELECT recipient, MIN(next_try) AS due FROM notify_queue WHERE attempts < ? GROUP BY recipient",
+                        (NOTIFY_MAX_ATTEMPTS,))
+            due = {r["recipient"]: r["due"] for r in cur.fetchall() if r["recipient"] in self.by_key}
+
+        now = time.time()
+        later = [t for t in due.values() if t > now]
+        for key in [k for k, t in due.items() if t <= now]:
+            with get_db().cursor("background") as cur:
+                cur.execute("SELECT id, kind, payload, attempts FROM notify_queue WHERE recipient=? AND attempts < ? "
+                            "ORDER BY id LIMIT ?", (key, NOTIFY_MAX_ATTEMPTS, NOTIFY_BATCH))
+                rows = cur.fetchall()
+            if not rows:
+                continue  # emptied since the scan (retried or cleared from /notifications)
+            ids = [(r["id"],) for r in rows]
+            r = self.by_key[key]
+            try:
+                NOTIFY_SINKS[r["sink"]](r["address"], coalesce(rows))
+            except Exception as e:
+                attempts = max(row["attempts"] for row in rows) + 1
+                delay = min(NOTIFY_RETRY_BASE * 2 ** (attempts - 1), NOTIFY_RETRY_MAX) * random.uniform(0.5, 1.0)
+                error = str(e) or type(e).__name__
+                with get_db().cursor("background") as cur:
+                    cur.executemany("UPDATE notify_queue SET attempts=attempts+1, next_try=?, error=? WHERE id=?",
+                                    [(int(now + delay), error, i) for (i,) in ids])
+                    cur.connection.commit()
+                self.failed += 1
+                self.last_error[key] = error
+                print(f"[WARN] Notification to {key} failed (attempt {attempts}): {error}")
+                if attempts < NOTIFY_MAX_ATTEMPTS:
+                    later.append(now + delay)
+                continue
+            with get_db().cursor("background") as cur:
+                cur.executemany("DELETE FROM notify_queue WHERE id=?", ids)
+                cur.connection.commit()
+            self.sent += 1
+            self.last_sent[key] = now
+            if len(rows) == NOTIFY_BATCH:
+                later.append(now)  # more waiting for this recipient
+        return max(min(later) - time.time(), 0) if later else None
+
+
+def notify_absences() -> str:
+    # End of session: students with no check-in today, one message per class
+    notifier = current_tenant().notifier
+    if not notifier.recipients:
+        return "no recipients (NOTIFY_TO)"
+    today = date.today().isoformat()
+    start = day_start(today)
+    with get_db().cursor("background") as cur:
+        cur.execute("SELECT DISTINCT uid FROM checkins WHERE bucket >= ? AND ts >= ?", (start // BUCKET_SECONDS, start))
+        present = {r["uid"] for r in cur.fetchall()}
+        cur.execute("SELECT id, name, class FROM users ORDER BY class, name")
+        users = cur.fetchall()
+    absent = {}
+    for u in users:
+        if u["id"] not in present:
+            absent.setdefault(u["class"], []).append([u["id"], u["name"]])
+    for cls, students in absent.items():
+        notifier.publish("absent", {"class": cls, "day": today, "students": students})
+    return f"{sum(len(s) for s in absent.values())} absent in {len(absent)} class(es)"
+
+
+jobs.add("absences", ABSENCE_CRON, notify_absences, "Absent students per class to NOTIFY_TO")
+
+
+@bp.route("/notifications")
+def notifications_view():
+    notifier = current_tenant().notifier
+    with get_db().cursor() as cur:
+        cur.execute(
+            "SELECT recipient, SUM(attempts < ?) AS pending, SUM(attempts >= ?) AS failed, MIN(created) AS oldest, "
+            "MAX(error) AS error FROM notify_queue GROUP BY recipient",
+            (NOTIFY_MAX_ATTEMPTS, NOTIFY_MAX_ATTEMPTS),
+        )
+        queued = {r["recipient"]: r for r in cur.fetchall()}
+
+    rows = ""
+    for key in list(notifier.by_key) + [k for k in queued if k not in notifier.by_key]:
+        q = queued.get(key)
+        sent = notifier.last_sent.get(key)
+        oldest = datetime.fromtimestamp(q["oldest"]).strftime("%m-%d %H:%M:%S") if q else "—"
+        error = notifier.last_error.get(key) or (q["error"] if q else "") or ""
+        note = "" if key in notifier.by_key else " <span class='muted'>(not in NOTIFY_TO)</span>"
+        rows += (
+            f"<tr><td><b>{html.escape(key)}</b>{note}</td>"
+            f"<td>{q['pending'] if q else 0}</td><td>{q['failed'] if q else 0}</td><td>{oldest}</td>"
+            f"<td>{datetime.fromtimestamp(sent).strftime('%m-%d %H:%M:%S') if sent else '—'}</td>"
+            f"<td class='muted'>{html.escape(error[:200])}</td></tr>"
+        )
+    rows = rows or "<tr><td colspan='6' class='muted'>No recipients. Set NOTIFY_TO, e.g. email:office@school.local,webhook:http://host/hook</td></tr>"
+
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Notifications</h2>
+        <a class="btn small" href="/">⬅ Back</a>
+      </div>
+      <div class="body">
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Recipient</th><th>Queued</th><th>Failed</th><th>Oldest</th><th>Last sent</th><th>Last error</th></tr></thead>
+            <tbody>{rows}</tbody>
+          </table>
+        </div>
+        <p class="muted" style="margin-top:10px;">{notifier.published} events published, {notifier.sent} messages sent, {notifier.failed} failed sends, {notifier.dropped} dropped.
+        Events for one recipient are gathered for {NOTIFY_COALESCE}s into one message; failed sends are retried for {NOTIFY_MAX_ATTEMPTS} attempts.</p>
+        <div class="actions" style="margin-top:10px;">
+          <form action="/notifications/retry" method="post" style="margin:0;">
+            <button class="btn small primary" type="submit">↻ Retry failed now</button>
+          </form>
+          <a class="btn small" href="/jobs">⏱ Absence job</a>
+        </div>
+      </div>
+    </div>
+    """
+    return render_template_string(page_wrap(inner))
+
+
+@bp.route("/notifications/retry", methods=["POST"])
+def notifications_retry():
+    with get_db().cursor() as cur:
+        cur.execute("UPDATE notify_queue SET attempts=0, next_try=? WHERE attempts > 0", (int(time.time()),))
+        cur.connection.commit()
+    current_tenant().notifier._wake.set()
+    return redirect("/notifications")
+
+
+# =========================
+# TERM REPORTS
+# =========================
+REPORT_RUN = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{4}-\d{2}-\d{2}_\d{6}$")
+REPORT_FILE = re.compile(r"^[\w.-]+\.(csv|html|json)$")
+_report_lock = threading.Lock()
+
+def class_slug(cls: str) -> str:
+    return re.sub(r"[^\w-]+", "_", cls).strip("_") or "class"
+
+def report_table(headers: list, rows: list) -> str:
+    head = "".join(f"<th>{html.escape(str(h))}</th>" for h in headers)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(str(v))}</td>" for v in r) + "</tr>" for r in rows)
+    return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+
+REPORT_HTML = """<!doctype html><html><head><meta charset="utf-8"><title>{title}</title>
+<style>body{{font-family:system-ui,sans-serif;margin:24px;color:#222}}table{{border-collapse:collapse;margin:12px 0 28px}}
+th,td{{border:1px solid #ccc;padding:4px 10px;text-align:left}}th{{background:#f3f3f3}}</style></head>
+<body><h1>{title}</h1><p>{subtitle}</p>{body}</body></html>"""
+
+def build_class_report(db_path: str, out_dir: str, cls: str, day_from: str, day_to: str) -> dict:
+    # Runs in a worker process, on its own read-only connection. Short,
+    # index-driven statements only, so the service's writes are never held up.
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_path))}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        lo = day_start(day_from)
+        hi = day_start((date.fromisoformat(day_to) + timedelta(days=1)).isoformat())
+        row = conn.execute("SELECT cid FROM class_ids WHERE classname=?", (cls,)).fetchone()
+        per_day = []
+        if row:
+            # Raw check-ins and compacted presence rows, which hold the same per-day figures
+            per_day = conn.execute(
+                "SELECT uid, day, SUM(hits) AS hits, MIN(first) AS first, MAX(last) AS last FROM ("
+                "SELECT uid, date(ts, 'unixepoch', 'localtime') AS day, 1 AS hits, ts AS first, ts AS last "
+                "FROM checkins WHERE cid=? AND bucket >= ? AND bucket <= ? AND ts >= ? AND ts < ? "
+                "UNION ALL SELECT uid, day, hits, first_ts, last_ts FROM presence WHERE cid=? AND day >= ? AND day <= ?"
+                ") GROUP BY uid, day",
+                (row["cid"], lo // BUCKET_SECONDS, hi // BUCKET_SECONDS, lo, hi, row["cid"], day_from, day_to),
+            ).fetchall()
+        names = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM users WHERE class=?", (cls,))}
+        if row:
+            # Students who have since left the class keep the name they were logged under
+            for r in conn.execute("SELECT uid, name FROM user_history WHERE cid=? ORDER BY hid", (row["cid"],)):
+                names.setdefault(r["uid"], r["name"])
+    finally:
+        conn.close()
+
+    # A session is a day on which anyone in the class checked in
+    sessions = sorted({r["day"] for r in per_day})
+    days, hits, first, last = {}, {}, {}, {}
+    present = {d: 0 for d in sessions}
+    for r in per_day:
+        uid = r["uid"]
+        days[uid] = days.get(uid, 0) + 1
+        hits[uid] = hits.get(uid, 0) + r["hits"]
+        first[uid] = min(first.get(uid, r["first"]), r["first"])
+        last[uid] = max(last.get(uid, r["last"]), r["last"])
+        present[r["day"]] += 1
+
+    def stamp(ts):
+        return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else ""
+
+    n = len(sessions)
+    student_rows = [
+        [uid, names.get(uid, f"ID {uid}"), days.get(uid, 0), n, f"{100 * days.get(uid, 0) / n:.1f}" if n else "0.0",
+         hits.get(uid, 0), stamp(first.get(uid)), stamp(last.get(uid))]
+        for uid in sorted(set(names) | set(days))
+    ]
+    registered = len(student_rows)
+    session_rows = [[d, present[d], registered, f"{100 * present[d] / registered:.1f}" if registered else "0.0"]
+                    for d in sessions]
+    student_head = ["ID", "Name", "Days Present", "Sessions", "Rate %", "Check-ins", "First Seen", "Last Seen"]
+    session_head = ["Day", "Present", "Students", "Rate %"]
+
+    slug = class_slug(cls)
+    for suffix, head, rows in (("", student_head, student_rows), ("_sessions", session_head, session_rows)):
+        with open(os.path.join(out_dir, f"{slug}{suffix}.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(head)
+            writer.writerows(rows)
+    with open(os.path.join(out_dir, f"{slug}.html"), "w", encoding="utf-8") as f:
+        f.write(REPORT_HTML.format(
+            title=html.escape(f"{cls}: attendance {day_from} to {day_to}"),
+            subtitle=f"{registered} student(s), {n} session(s)",
+            body="<h2>Students</h2>" + report_table(student_head, student_rows)
+                 + "<h2>Sessions</h2>" + report_table(session_head, session_rows),
+        ))
+
+    avg = sum(days.values()) / (registered * n) * 100 if registered and n else 0.0
+    return {"class": cls, "slug": slug, "students": registered, "sessions": n,
+            "checkins": sum(hits.values()), "rate": round(avg, 1)}
+
+def run_report(run_id: str, classes: list, day_from: str, day_to: str) -> None:
+    # Coordinator thread: fans the classes out to a process pool and tracks progress
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    out_dir = os.path.join(current_tenant().report_dir, run_id)
+    state = current_tenant().report_runs[run_id]
+    results = []
+    # spawn: forking a process that runs Flask and serial threads is not safe
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, min(REPORT_WORKERS, len(classes))), mp_context=ctx) as pool:
+        futures = {pool.submit(build_class_report, get_db().path, out_dir, c, day_from, day_to): c for c in classes}
+        for fut in as_completed(futures):
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                state["errors"].append(f"{futures[fut]}: {e}")
+            state["done"] += 1
+
+    results.sort(key=lambda r: r["class"])
+    rows = [[r["class"], r["students"], r["sessions"], r["checkins"], r["rate"]] for r in results]
+    with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(REPORT_HTML.format(
+            title=f"Term report {day_from} to {day_to}",
+            subtitle=f"{len(results)} class(es)",
+            body=report_table(["Class", "Students", "Sessions", "Check-ins", "Average Rate %"], rows),
+        ))
+    state.update(finished=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), seconds=round(time.time() - state["t0"], 1),
+                 classes=results)
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({k: v for k, v in state.items() if k != "t0"}, f)
+    print(f"[OK] Report {run_id}: {len(results)} class(es) in {state['seconds']}s")
+
+def start_report(day_from: str, day_to: str) -> str:
+    tenant = current_tenant()
+    report_runs = tenant.report_runs
+    with _report_lock:
+        if any(not r["finished"] for r in report_runs.values()):
+            raise RuntimeError("a report is already running")
+        classes = set(get_classes())
+        with get_db().cursor() as cur:
+            cur.execute("SELECT classname FROM class_ids")
+            classes = sorted(classes | {r["classname"] for r in cur.fetchall()})
+        run_id = f"{day_from}_{day_to}_{datetime.now():%H%M%S}"
+        os.makedirs(os.path.join(tenant.report_dir, run_id), exist_ok=True)
+        report_runs[run_id] = {"from": day_from, "to": day_to, "total": len(classes), "done": 0, "errors": [],
+                               "started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "finished": "",
+                               "t0": time.time(), "classes": []}
+
+    def run():
+        try:
+            run_report(run_id, classes, day_from, day_to)
+        except Exception as e:
+            report_runs[run_id]["errors"].append(str(e))
+            report_runs[run_id]["finished"] = "failed"
+            print(f"[WARN] Report {run_id} failed: {e}")
+    spawn(tenant, run, "report")
+    return run_id
+
+def list_reports() -> list:
+    # Newest first: (run id, state); finished runs are read back from manifest.json
+    folder = current_tenant().report_dir
+    runs = dict(current_tenant().report_runs)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            manifest = os.path.join(folder, name, "manifest.json")
+            if REPORT_RUN.match(name) and name not in runs and os.path.exists(manifest):
+                with open(manifest, encoding="utf-8") as f:
+                    runs[name] = json.load(f)
+    return sorted(runs.items(), key=lambda kv: kv[1]["started"], reverse=True)
+
+@bp.route("/reports", methods=["GET", "POST"])
+def reports():
+    msg, msg_cls = "", "notice"
+    day_from = request.values.get("from") or date.today().replace(month=1, day=1).isoformat()
+    day_to = request.values.get("to") or date.today().isoformat()
+    if request.method == "POST":
+        admin_only()
+        if day_start(day_from) is None or day_start(day_to) is None or day_from > day_to:
+            msg, msg_cls = "Pick a valid date range.", "notice bad"
+        else:
+            try:
+                start_report(day_from, day_to)
+                return redirect("/reports")
+            except RuntimeError as e:
+                msg, msg_cls = str(e), "notice bad"
+
+    rows = ""
+    running = False
+    for run_id, st in list_reports():
+        if not st["finished"]:
+            running = True
+            status = f"<span class='badge'>{st['done']} / {st['total']} classes…</span>"
+            links = ""
+        else:
+            status = f"{st['finished']} ({st.get('seconds', '?')}s)" + (f" • ⚠ {len(st['errors'])} error(s)" if st["errors"] else "")
+            links = f"<a class='btn small success' href='/reports/{run_id}/index.html'>Open</a> " + " ".join(
+                f"<a class='btn small' href='/reports/{run_id}/{c['slug']}.html'>{html.escape(c['class'])}</a>"
+                f"<a class='btn small' href='/reports/{run_id}/{c['slug']}.csv'>CSV</a>"
+                for c in st["classes"]
+            )
+        rows += f"<tr><td>{st['from']} → {st['to']}</td><td>{st['started']}</td><td>{status}</td><td>{links}</td></tr>"
+
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Term Reports</h2>
+        <a class="btn small" href="/analytics">⬅ Back</a>
+      </div>
+      <div class="body">
+        <div class="{msg_cls}" style="{'' if msg else 'display:none;'}">{msg}</div>
+        <form method="post" action="/reports" style="margin:0 0 14px 0; display:flex; gap:10px; align-items:center; flex-wrap:wrap;">
+          <input type="date" name="from" value="{html.escape(day_from)}" required>
+          <input type="date" name="to" value="{html.escape(day_to)}" required>
+          <button class="btn primary" type="submit">📑 Generate (all classes)</button>
+        </form>
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Term</th><th>Started</th><th>Status</th><th>Files</th></tr></thead>
+            <tbody>
+              {rows or "<tr><td colspan='4' class='muted'>No reports yet.</td></tr>"}
+            </tbody>
+          </table>
+        </div>
+        <p class="muted" style="margin-top:10px;">Per class: student rates (HTML + CSV) and a per-session table (&lt;class&gt;_sessions.csv). Classes are built in parallel on {REPORT_WORKERS} process(es).</p>
+      </div>
+    </div>
+    {'<script>setTimeout(function(){location.reload();}, 2000);</script>' if running else ''}
+    """
+    return render_template_string(page_wrap(inner))
+
+
+@bp.route("/reports/<run_id>/<filename>")
+def report_file(run_id, filename):
+    path = os.path.join(current_tenant().report_dir, run_id, filename)
+    if not REPORT_RUN.match(run_id) or not REPORT_FILE.match(filename) or not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), as_attachment=filename.endswith(".csv"), download_name=filename)
+
+
+# =========================
+# DIAGNOSTICS
+# =========================
+def memory_kb() -> dict:
+    # Resident set now and its high-water mark, in KB
+    mem = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    mem[key] = int(value.split()[0])
+    except OSError:
+        import resource
+        mem["VmHWM"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return mem
+
+
+@bp.route("/diagnostics")
+def diagnostics():
+    import tracemalloc
+
+    mem = memory_kb()
+    tenant = current_tenant()
+    cache = get_db().cache
+    figures = [
+        ("Resident Memory", f"{mem['VmRSS'] / 1024:.1f} MB" if "VmRSS" in mem else "—"),
+        ("Peak Resident", f"{mem['VmHWM'] / 1024:.1f} MB"),
+        ("Threads", threading.active_count()),
+        ("Query Cache", f"{len(cache)} / {cache.max_entries} ({cache.bytes / 1024:.0f} KB)"),
+        ("Cooldown IDs", f"{len(tenant.last_seen)} / {tenant.last_seen.limit}"),
+        ("In View", sum(len(s.link.in_view) for s in tenant.sources)),
+        ("History Cache", f"{len(get_db().history_ids)} / {HISTORY_CACHE_MAX}"),
+    ]
+    replica = get_db().replica
+    if replica is not None:
+        size = replica.size()
+        figures.append(("Read Replica", f"{size / 1048576:.1f} MB" if size else ("failed" if replica.error else "building…")))
+    stats = "".join(f'<div class="stat"><p class="k">{k}</p><p class="v">{v}</p></div>' for k, v in figures)
+
+    events = "".join(
+        f"<tr><td>{datetime.fromtimestamp(e.ts).strftime('%H:%M:%S')}</td><td>{e.face_id}</td><td>{e.outcome}</td></tr>"
+        for e in reversed(tenant.recent_events)
+    ) or "<tr><td colspan='3' class='muted'>No faces seen since start-up.</td></tr>"
+
+    if tracemalloc.is_tracing():
+        traced, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        ).statistics("lineno")[:15]
+        sites = "".join(
+            f"<tr><td>{html.escape(str(st.traceback[0]))}</td><td>{st.size / 1024:.1f} KB</td><td>{st.count}</td></tr>"
+            for st in top
+        )
+        tracing = f"""
+        <p class="muted">Traced: {traced / 1024:.0f} KB now, {peak / 1024:.0f} KB peak.</p>
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Allocation site</th><th>Size</th><th>Blocks</th></tr></thead>
+            <tbody>{sites}</tbody>
+          </table>
+        </div>"""
+        toggle = "⏹ Stop tracing"
+    else:
+        tracing = '<p class="muted">Allocation tracing is off. Tracing slows the server down; turn it off again when done.</p>'
+        toggle = "▶ Trace allocations"
+
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Diagnostics</h2>
+        <a class="btn small" href="/">⬅ Back</a>
+      </div>
+      <div class="body">
+        <div class="stats">{stats}</div>
+        <p class="muted" style="margin-top:10px;">Low-memory mode: {"on" if LOW_MEMORY else "off"} • page size {PAGE_SIZE} • SQLite cache {DB_CACHE_KB} KB</p>
+        <div class="actions" style="margin-top:10px;"><a class="btn" href="/profile">🔥 Profiler &amp; slow SQL</a></div>
+      </div>
+    </div>
+    <div class="card">
+      <div class="header">
+        <h2>Largest Allocation Sites</h2>
+        <form action="/diagnostics/trace" method="post" style="margin:0;">
+          <button class="btn small primary" type="submit">{toggle}</button>
+        </form>
+      </div>
+      <div class="body">{tracing}</div>
+    </div>
+    <div class="card">
+      <div class="header"><h2>Recent Serial Events</h2></div>
+      <div class="body">
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Time</th><th>Face ID</th><th>Outcome</th></tr></thead>
+            <tbody>{events}</tbody>
+          </table>
+        </div>
+      </div>
+    </div>
+    """
+    return render_template_string(page_wrap(inner))
+
+
+@bp.route("/diagnostics/trace", methods=["POST"])
+def diagnostics_trace():
+    admin_only()
+    import tracemalloc
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    else:
+        tracemalloc.start(TRACEMALLOC or 10)
+    return redirect("/diagnostics")
+
+
+# =========================
+# PROFILING
+# =========================
+class Profiler:
+    """Sampling profiler for request handlers and the serial reader thread.
+
+    Armed for a window of seconds: a daemon thread wakes PROFILE_HZ times a
+    second and records the stack of the reader and of every thread serving a
+    request, keyed by route ("GET /attendance") or reader thread. Stacks are kept
+    folded ("outer;inner samples"), the input of flamegraph.pl and speedscope.
+    Between windows only the route bookkeeping below runs.
+    """
+
+    MAX_STACKS = 2000  # distinct stacks kept per route; the rest count as one
+
+    def __init__(self):
+        self.routes = {}  # thread ident -> route it is serving
+        self.stacks = {}  # route -> {folded stack: samples}
+        self.samples = 0
+        self.started = None
+        self.until = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return time.monotonic() < self.until
+
+    def start(self, seconds: float):
+        with self._lock:
+            self.stacks = {}
+            self.samples = 0
+            self.started = time.time()
+            self.until = time.monotonic() + seconds
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+                self._thread.start()
+
+    def stop(self):
+        self.until = 0.0
+
+    def _run(self):
+        me = threading.get_ident()
+        interval = 1.0 / max(PROFILE_HZ, 1)
+        while True:
+            with self._lock:
+                if not self.running:
+                    self._thread = None
+                    return
+            readers = {t.ident: t.name for t in threading.enumerate() if t.name.split(":")[0] == "reader"}
+            for ident, frame in sys._current_frames().items():
+                route = readers.get(ident) or self.routes.get(ident)
+                if route and ident != me:
+                    self._add(route, frame)
+            self.samples += 1
+            time.sleep(interval)
+
+    def _add(self, route: str, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            labels.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        folded = ";".join(reversed(labels))
+        stacks = self.stacks.setdefault(route, {})
+        if folded not in stacks and len(stacks) >= self.MAX_STACKS:
+            folded = "[other stacks]"
+        stacks[folded] = stacks.get(folded, 0) + 1
+
+    def folded(self, route: str | None = None) -> str:
+        return "".join(
+            f"{r};{stack} {n}\n"
+            for r, stacks in list(self.stacks.items()) if route in (None, r)
+            for stack, n in list(stacks.items())
+        )
+
+
+profiler = Profiler()
+
+
+def current_route() -> str:
+    return profiler.routes.get(threading.get_ident()) or threading.current_thread().name
+
+
+@bp.before_app_request
+def track_route():
+    rule = request.url_rule.rule if request.url_rule else "(no route)"
+    profiler.routes[threading.get_ident()] = f"{request.method} {rule}"
+
+
+@bp.teardown_app_request
+def untrack_route(exc):
+    profiler.routes.pop(threading.get_ident(), None)
+
+
+def is_admin() -> bool:
+    # ADMIN_TOKEN as header, form/query field or cookie; without a token, only the Pi itself
+    if ADMIN_TOKEN:
+        given = (request.headers.get("X-Admin-Token") or request.values.get("token")
+                 or request.cookies.get("admin_token"))
+        return given == ADMIN_TOKEN
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+def admin_only():
+    if not is_admin():
+        abort(403)
+
+
+@bp.route("/profile")
+def profile_view():
+    admin_only()
+    if profiler.running:
+        left = profiler.until - time.monotonic()
+        status = f"<span class='badge'>running</span> {profiler.samples} samples, {left:.0f}s left"
+        action = ("<form action='/profile/stop' method='post' style='margin:0;'>"
+                  "<button class='btn small danger' type='submit'>⏹ Stop</button></form>")
+    else:
+        when = datetime.fromtimestamp(profiler.started).strftime("%Y-%m-%d %H:%M:%S") if profiler.started else "never"
+        status = f"Idle. Last window: {when}, {profiler.samples} samples."
+        action = (f"<form action='/profile/start' method='post' style='margin:0;display:flex;gap:8px;align-items:center;'>"
+                  f"<input type='number' name='seconds' value='30' min='1' max='{PROFILE_MAX_SECONDS}' style='width:90px;'> s "
+                  f"<button class='btn small primary' type='submit'>▶ Profile</button></form>")
+
+    total = sum(sum(st.values()) for st in list(profiler.stacks.values())) or 1
+    routes = ""
+    for route, stacks in sorted(list(profiler.stacks.items()), key=lambda kv: -sum(kv[1].values())):
+        n = sum(stacks.values())
+        leaves = {}
+        for stack, c in list(stacks.items()):
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + c
+        top = "<br>".join(f"{html.escape(leaf)} — {c * 100 // n}%"
+                          for leaf, c in sorted(leaves.items(), key=lambda kv: -kv[1])[:3])
+        routes += (
+            f"<tr><td><b>{html.escape(route)}</b></td><td>{n} ({n * 100 // total}%)</td><td>{top}</td>"
+            f"<td><a class='btn small' href='/profile/folded?{urlencode({'route': route})}'>⬇ Folded</a></td></tr>"
+        )
+    routes = routes or "<tr><td colspan='4' class='muted'>No samples yet.</td></tr>"
+
+    slow = "".join(
+        f"<tr><td>{datetime.fromtimestamp(e['ts']).strftime('%m-%d %H:%M:%S')}</td><td>{e['ms']:.0f} ms</td>"
+        f"<td>{html.escape(e['where'])}</td>"
+        f"<td><code>{html.escape(e['sql'][:400])}</code><br><span class='muted'>{html.escape(e['params'])}</span>"
+        f"<pre style='margin:6px 0 0;white-space:pre-wrap;'>{html.escape(chr(10).join(e['plan']))}</pre></td></tr>"
+        for e in reversed(slow_sql.entries)
+    ) or f"<tr><td colspan='4' class='muted'>No statements over {SLOW_SQL_MS:.0f} ms.</td></tr>"
+
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Profiler</h2>
+        <a class="btn small" href="/diagnostics">⬅ Back</a>
+      </div>
+      <div class="body">
+        <div class="actions" style="align-items:center;">{status} {action}
+          <a class="btn small" href="/profile/folded">⬇ All stacks (folded)</a></div>
+        <p class="muted" style="margin-top:10px;">Samples the serial reader and every request in progress {PROFILE_HZ}×/s while a window runs.
+        Folded files open in speedscope.app or <code>flamegraph.pl</code>.</p>
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Route / thread</th><th>Samples</th><th>Hottest functions (self)</th><th></th></tr></thead>
+            <tbody>{routes}</tbody>
+          </table>
+        </div>
+      </div>
+    </div>
+    <div class="card">
+      <div class="header"><h2>Slow SQL</h2><span class="muted">{slow_sql.total} over {SLOW_SQL_MS:.0f} ms since start-up</span></div>
+      <div class="body">
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>When</th><th>Time</th><th>Where</th><th>Statement / query plan</th></tr></thead>
+            <tbody>{slow}</tbody>
+          </table>
+        </div>
+      </div>
+    </div>
+    """
+    resp = Response(render_template_string(page_wrap(inner)))
+    if ADMIN_TOKEN and request.args.get("token") == ADMIN_TOKEN:
+        resp.set_cookie("admin_token", ADMIN_TOKEN, httponly=True, samesite="Strict")
+    return resp
+
+
+@bp.route("/profile/start", methods=["POST"])
+def profile_start():
+    admin_only()
+    try:
+        seconds = min(max(float(request.values.get("seconds", "30")), 1), PROFILE_MAX_SECONDS)
+    except ValueError:
+        abort(400)
+    profiler.start(seconds)
+    return redirect("/profile")
+
+
+@bp.route("/profile/stop", methods=["POST"])
+def profile_stop():
+    admin_only()
+    profiler.stop()
+    return redirect("/profile")
+
+
+@bp.route("/profile/folded")
+def profile_folded():
+    admin_only()
+    route = request.args.get("route")
+    name = re.sub(r"[^\w]+", "_", route or "all").strip("_") or "all"
+    return Response(profiler.folded(route), mimetype="text/plain",
+                    headers={"Content-Disposition": f'attachment; filename="profile_{name}.folded"'})
+
+
+# =========================
+# TENANTS (multi-site)
+# =========================
+class Tenant:
+    """One site (school or campus) served by this process.
+
+    Everything that would otherwise be process-wide lives here: the DB file with
+    its own connection, scheduler and page cache, the serial ports and their
+    reader threads, the cooldowns, sync node name, notifier and the backup and
+    report folders. Tenants share no lock, so a busy site never waits on another.
+    """
+
+    def __init__(self, name: str, db_path: str, ports: list, prefix: str = ""):
+        self.name = name
+        self.prefix = prefix  # "/<name>" when several tenants share the server, else ""
+        self.db = AttendanceDB(db_path)
+        self.sources = [SerialSource(p) for p in ports]
+        self.last_seen = Cooldowns(COOLDOWN_SECONDS, LAST_SEEN_MAX)  # anti-spam cooldown, shared by the ports
+        self.recent_events = deque(maxlen=RECENT_EVENTS)  # FaceEvent, newest last
+        self.live = LiveStats()  # occupancy, arrival rate and door queue per class
+        self.ready = threading.Event()  # a serial port is open and the DB is ready for the first check-in
+        self.node = f"{NODE_ID}-{name}" if prefix else NODE_ID
+        self.backup_dir = os.path.join(BACKUP_DIR, name) if prefix else BACKUP_DIR
+        self.report_dir = os.path.join(REPORT_DIR, name) if prefix else REPORT_DIR
+        self.backup_status = {"running": False, "last_ok": "", "last_error": "", "remaining": 0, "pagecount": 0}
+        self.backup_lock = threading.Lock()
+        self.sync_status = {"last_ok": "", "last_error": "", "sent": 0}
+        self.report_runs = {}  # run id -> progress of runs started since the service came up
+        self.notifier = Notifier(parse_recipients(NOTIFY_TO))
+
+
+TENANT_NAME = re.compile(r"^[a-z][a-z0-9-]*$")
+
+def parse_tenants(spec: str) -> dict:
+    # "north=north.db,/dev/ttyACM0;south=south.db" -> {"north": Tenant, ...}, in order
+    if not spec.strip():
+        return {"default": Tenant("default", DB_PATH, [SERIAL_PORT])}
+    out = {}
+    for entry in spec.split(";"):
+        if not entry.strip():
+            continue
+        name, _, rest = entry.partition("=")
+        name = name.strip().lower()
+        parts = [p.strip() for p in rest.split(",") if p.strip()]
+        if not TENANT_NAME.match(name) or name == "tenants" or name in out or not parts:
+            raise ValueError(f"bad TENANTS entry: {entry.strip()!r} (expected name=db_path[,serial_port...])")
+        out[name] = Tenant(name, parts[0], parts[1:], prefix=f"/{name}")
+    return out
+
+
+class TenantRouter:
+    """WSGI middleware in front of the Flask app: picks the tenant of each request.
+
+    /<name>/... is served as /... for tenant <name>. Root-relative links, form
+    actions and redirects in its pages get the prefix put back, so every page
+    works unchanged under it. A host whose first label is a tenant name
+    (north.school.lan) selects that tenant without a prefix. / on its own lists
+    the sites (/tenants) for admins and sends everyone else to the first site.
+    Without TENANTS every request goes to the one tenant, unchanged.
+    """
+
+    LINK = re.compile(rb"""((?:href|action|src)=["'])/(?!/)""")
+
+    def __init__(self, app, tenants: dict):
+        self.app = app
+        self.tenants = tenants
+
+    def __call__(self, environ, start_response):
+        tenants = self.tenants
+        if not any(t.prefix for t in tenants.values()):
+            tenant = next(iter(tenants.values()))
+            _local.tenant = tenant
+            body = self.app(environ, start_response)
+            done = [body.close] if hasattr(body, "close") else []
+            return ClosingIterator(self._body(body, tenant, b"", []), done + [self._forget])
+
+        path = environ.get("PATH_INFO") or "/"
+        first = path.split("/")[1]
+        label = environ.get("HTTP_HOST", "").split(":")[0].lower().split(".")[0]
+        prefix = ""
+        if first in tenants:
+            tenant, prefix = tenants[first], f"/{first}"
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix
+            environ["PATH_INFO"] = path[len(prefix):] or "/"
+        elif label in tenants:
+            tenant = tenants[label]
+        elif path in ("/", "/tenants"):
+            tenant = None
+            environ["PATH_INFO"] = "/tenants"
+        else:
+            start_response("404 NOT FOUND", [("Content-Type", "text/plain; charset=utf-8")])
+            return [("No such site. Sites: " + ", ".join(t.prefix + "/" for t in tenants.values()) + "\n").encode()]
+
+        pages = []  # whether the response is an HTML page (links to rewrite)
+
+        def start(status, headers, exc_info=None):
+            page = bool(prefix) and any(k.lower() == "content-type" and v.startswith("text/html") for k, v in headers)
+            out = []
+            for k, v in headers:
+                if prefix and k.lower() == "location" and v.startswith("/") and not v.startswith("//"):
+                    v = prefix + v
+                elif page and k.lower() == "content-length":
+                    continue  # the rewritten body is longer
+                out.append((k, v))
+            pages.append(page)
+            return start_response(status, out, exc_info)
+
+        _local.tenant = tenant
+        body = self.app(environ, start)
+        # The server closes what we return even if it never iterates it (HEAD): pass that on
+        done = [body.close] if hasattr(body, "close") else []
+        return ClosingIterator(self._body(body, tenant, prefix.encode(), pages), done + [self._forget])
+
+    def _body(self, body, tenant, prefix: bytes, pages: list):
+        # Streamed pages are rendered while the server iterates: keep the tenant current for every chunk
+        it = iter(body)
+        while True:
+            _local.tenant = tenant
+            try:
+                chunk = next(it)
+            except StopIteration:
+                return
+            if pages and pages[-1]:
+                chunk = self.LINK.sub(rb"\1" + prefix + rb"/", chunk)
+            yield chunk
+
+    @staticmethod
+    def _forget():
+        _local.tenant = None
+
+
+def tenant_summary(tenant: Tenant) -> dict:
+    # Runs in a pool thread on the tenant's own connection, so shards are counted side by side
+    _local.tenant = tenant
+
+    def load(since):
+        where, args = since_sql(since)
+        with get_db().cursor() as cur:
+            cur.execute("SELECT COUNT(*) AS c FROM users")
+            users = cur.fetchone()["c"]
+            cur.execute(f"SELECT COUNT(*) AS c FROM checkins WHERE {where}", args)
+            today = cur.fetchone()["c"]
+            cur.execute("SELECT (SELECT COUNT(*) FROM checkins) + (SELECT COALESCE(SUM(hits), 0) FROM presence) AS c")
+            total = cur.fetchone()["c"]
+            cur.execute("SELECT MAX(ts) AS ts FROM checkins WHERE bucket = (SELECT MAX(bucket) FROM checkins)")
+            last = cur.fetchone()["ts"]
+        return users, today, total, last
+
+    try:
+        users, today, total, last = cached(("summary", today_start()), lambda: load(today_start()))
+        error = ""
+    except Exception as e:
+        users = today = total = last = None
+        error = str(e)
+    finally:
+        _local.tenant = None
+    return {
+        "name": tenant.name, "url": tenant.prefix + "/", "node": tenant.node,
+        "users": users, "today": today, "total": total,
+        "last_checkin": datetime.fromtimestamp(last).strftime("%Y-%m-%d %H:%M:%S") if last else "",
+        "serial": {s.port: s.error or "connected" for s in tenant.sources},
+        "db_mb": round(os.path.getsize(tenant.db.path) / 1048576, 1) if os.path.exists(tenant.db.path) else 0,
+        "error": error,
+    }
+
+
+@bp.route("/tenants")
+def tenants_view():
+    # Cross-site summary for admins, every shard queried in parallel. Everyone
+    # else opening the bare server address lands on the first site.
+    tenants = current_app.extensions["tenants"]
+    if not is_admin():
+        return redirect(next(iter(tenants.values())).prefix + "/")
+    from concurrent.futures import ThreadPoolExecutor
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(tenants), thread_name_prefix="summary") as pool:
+        sites = list(pool.map(tenant_summary, tenants.values()))
+    seconds = round(time.perf_counter() - t0, 3)
+    if request.args.get("format") == "json":
+        return jsonify(tenants=sites, seconds=seconds)
+
+    def num(v):
+        return "—" if v is None else v
+
+    rows = "".join(
+        f"<tr><td><a href='{t['url']}'><b>{t['name']}</b></a><br><span class='muted'>{t['node']}</span></td>"
+        f"<td>{num(t['users'])}</td><td>{num(t['today'])}</td><td>{num(t['total'])}</td>"
+        f"<td>{t['last_checkin'] or '—'}</td>"
+        f"<td>{'<br>'.join(html.escape(f'{p}: {st}') for p, st in t['serial'].items()) or '—'}</td>"
+        f"<td>{t['db_mb']} MB{' ⚠ ' + html.escape(t['error']) if t['error'] else ''}</td></tr>"
+        for t in sites
+    )
+    inner = f"""
+    <div class="card">
+      <div class="header">
+        <h2>Sites</h2>
+        <span class="badge">{len(sites)} site(s) • {sum(t['today'] or 0 for t in sites)} check-ins today</span>
+      </div>
+      <div class="body">
+        <div class="table-wrap">
+          <table>
+            <thead><tr><th>Site</th><th>Users</th><th>Today</th><th>Total</th><th>Last Check-in</th><th>Serial</th><th>DB</th></tr></thead>
+            <tbody>{rows}</tbody>
+          </table>
+        </div>
+        <p class="muted" style="margin-top:10px;">Counted on all {len(sites)} databases in parallel in {seconds}s. JSON: <a href="/tenants?format=json">/tenants?format=json</a></p>
+      </div>
+    </div>
+    """
+    return render_template_string(page_wrap(inner))
+
+
+# =========================
+# APP FACTORY
+# =========================
+# Importing this module has no side effects: each create_app() builds its own
+# tenants (app.extensions["tenants"]), the DB is opened on first use and the
+# serial port by the reader thread.
+_services_lock = threading.Lock()
+
+def create_app(db_path: str | None = None, start: bool = False) -> Flask:
+    # db_path: serve that one database (a single tenant) instead of ATTENDANCE_DB/TENANTS.
+    # start: also start the services, for WSGI servers (gunicorn 'app:create_app(start=True)')
+    app = Flask(__name__)
+    if db_path is not None:
+        app.extensions["tenants"] = {"default": Tenant("default", db_path, [SERIAL_PORT])}
+    else:
+        app.extensions["tenants"] = parse_tenants(TENANTS)
+    app.extensions["layout"] = app.jinja_env.from_string(LAYOUT)
+    app.register_blueprint(bp)
+    app.wsgi_app = TenantRouter(app.wsgi_app, app.extensions["tenants"])
+    if start:
+        start_services(app)
+    return app
+
+def start_services(app: Flask):
+    # Serial readers, replica, sync agent, notifier and jobs for the app's tenants.
+    # Once per app: a second call is a no-op, so nothing opens a serial port twice.
+    # Reader first: it is the camera pipeline and must be back quickly after a restart
+    with _services_lock:
+        if app.extensions.get("services_started"):
+            return
+        app.extensions["services_started"] = True
+
+    if TRACEMALLOC:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC)
+    tenants = app.extensions["tenants"]
+    for tenant in tenants.values():
+        for source in tenant.sources:
+            spawn(tenant, reader, "reader", source)
+        if tenant.db.replica is not None:
+            tenant.db.replica.rebuild(tenant)
+        if SYNC_URL:
+            spawn(tenant, sync_agent, "sync")
+        if tenant.notifier.recipients:
+            tenant.notifier.start(tenant)
+    jobs.start(tenants)
+
+
+# =========================
+# RUN SERVER
+# =========================
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="HuskyLens attendance server")
+    ap.add_argument("--backup", action="store_true", help="write a snapshot of ATTENDANCE_DB to BACKUP_DIR and exit")
+    ap.add_argument("--restore", metavar="SNAPSHOT", help="replace ATTENDANCE_DB with SNAPSHOT and exit (stop the service first)")
+    ap.add_argument("--vacuum", action="store_true",
+                    help="switch ATTENDANCE_DB to incremental vacuum, shrink it and exit (stop the service first)")
+    app = create_app()
+    tenants = app.extensions["tenants"]
+    ap.add_argument("--tenant", metavar="NAME", choices=list(tenants),
+                    help="with TENANTS: the site --backup/--restore/--vacuum work on (default: the first)")
+    args = ap.parse_args()
+    _local.tenant = tenants[args.tenant] if args.tenant else next(iter(tenants.values()))
+    if args.vacuum:
+        vacuum_file(get_db().path)
+        sys.exit(0)
+    if args.restore:
+        restore_backup(args.restore, get_db().path)
+        sys.exit(0)
+    if args.backup:
+        backup_now()
+        sys.exit(0)
+
+    for tenant in tenants.values():
+        ports = ", ".join(s.port for s in tenant.sources) or "no serial port"
+        print(f"[INFO] {tenant.prefix or 'DB'}: {tenant.db.path} ({ports})")
+        if SYNC_URL:
+            print(f"[INFO] Sync: node {tenant.node} -> {SYNC_URL}")
+
+    start_services(app)
     app.run(host=SERVER_HOST, port=SERVER_PORT)
@@ -0,0 +1,284 @@
+# File: raspberry_pi/arduino_sim.py
+#
+# Python copy of arduino/huskylens_attendance.ino, for testing the Pi side
+# without an Arduino or HuskyLens. The "camera" is a simulated classroom:
+# students walk in, stay in view for a while (with missed frames, like the
+# real HuskyLens) and walk out. The sketch logic (ENTER/LEAVE with HOLD_MS,
+# sequence numbers, ACKs, go-back-N resend with FROM:<seq>) is a line-by-line port.
+#
+# The serial link is a pseudo-terminal, so app.py opens it like /dev/ttyACM0.
+#
+# Usage:
+#   python arduino_sim.py                         # prints the port; run app.py with SERIAL_PORT=<port>
+#   python arduino_sim.py --legacy                # old sketch: FACE:<ID> every frame
+#   python arduino_sim.py --selftest              # runs app.py's reader on a temp DB and checks the result
+#   python arduino_sim.py --selftest --compare    # ... for both protocols, with line counts and Pi CPU
+#
+# --selftest exits with status 1 if check-ins, presence or ACKs do not add up.
+
+import argparse
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tty
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Sketch:
+    """huskylens_attendance.ino; `write` gets each line the sketch prints."""
+
+    HOLD_MS = 2000
+    ACK_TIMEOUT_MS = 300
+    RETRY_MAX_MS = 5000
+    MAX_TRACKED = 64
+    OUTBOX_SIZE = 16
+
+    def __init__(self, write, event_mode: bool = True):
+        self.write = write
+        self.event_mode = event_mode
+        self.tracked = {}  # id -> lastSeen
+        self.outbox = []  # (seq, kind, id), oldest first
+        self.next_seq = 1
+        self.last_send = 0
+        self.retry_ms = self.ACK_TIMEOUT_MS
+        self.rx = b""
+        self.sent = self.resent = 0
+
+    def setup(self):
+        self.write("HuskyLens ready!")
+        if self.event_mode:
+            self.write(f"HELLO:{self.HOLD_MS}")
+
+    def send_event(self, e):
+        self.write(f"{'ENTER' if e[1] == 'E' else 'LEAVE'}:{e[0]}:{e[2]}")
+        self.sent += 1
+
+    def queue_event(self, kind, face_id, now):
+        if len(self.outbox) == self.OUTBOX_SIZE:
+            self.outbox.pop(0)
+        e = (self.next_seq, kind, face_id)
+        self.next_seq = (self.next_seq + 1) & 0xFFFF
+        self.outbox.append(e)
+        if len(self.outbox) == 1:
+            self.last_send = now
+            self.retry_ms = self.ACK_TIMEOUT_MS
+        self.send_event(e)
+
+    def face_seen(self, face_id, now):
+        if face_id in self.tracked:
+            self.tracked[face_id] = now
+            return
+        if len(self.tracked) == self.MAX_TRACKED:
+            return
+        self.tracked[face_id] = now
+        self.queue_event("E", face_id, now)
+
+    def expire_faces(self, now):
+        for face_id, seen in list(self.tracked.items()):
+            if now - seen >= self.HOLD_MS:
+                self.queue_event("L", face_id, now)
+                del self.tracked[face_id]
+
+    def handle_ack(self, ack):
+        while self.outbox and (ack - self.outbox[0][0]) & 0xFFFF < 0x8000:
+            self.outbox.pop(0)
+        self.retry_ms = self.ACK_TIMEOUT_MS
+
+    def read_acks(self, data: bytes):
+        self.rx += data
+        *lines, self.rx = self.rx.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if line.startswith(b"ACK:") and line[4:].isdigit():
+                self.handle_ack(int(line[4:]))
+
+    def resend_pending(self, now):
+        if not self.outbox or now - self.last_send < self.retry_ms:
+            return
+        self.write(f"FROM:{self.outbox[0][0]}")
+        for e in self.outbox:
+            self.send_event(e)
+            self.resent += 1
+        self.last_send = now
+        self.retry_ms = min(self.retry_ms * 2, self.RETRY_MAX_MS)
+
+    def loop(self, faces, now):
+        # One pass of loop(): `faces` are the IDs HuskyLens returned this frame
+        for face_id in faces:
+            if face_id == 0:
+                continue
+            if not self.event_mode:
+                self.write(f"FACE:{face_id}")
+            else:
+                self.face_seen(face_id, now)
+        if self.event_mode:
+            self.expire_faces(now)
+            self.resend_pending(now)
+
+
+class Classroom:
+    """Each student walks in once, stays 5-60 s and is detected in most frames."""
+
+    def __init__(self, students: int, seconds: float, seed: int, detect: float = 0.85):
+        rng = random.Random(seed)
+        self.rng = rng
+        self.detect = detect
+        self.visits = {}
+        for sid in range(1, students + 1):
+            start = rng.uniform(0, seconds * 0.6) * 1000
+            self.visits[sid] = (start, start + rng.uniform(5, 60) * 1000)
+        self.end_ms = max(end for _, end in self.visits.values())
+
+    def faces(self, now_ms):
+        visible = [sid for sid, (a, b) in self.visits.items() if a <= now_ms < b and self.rng.random() < self.detect]
+        if self.rng.random() < 0.05:
+            visible.append(0)  # unknown face
+        return visible
+
+
+def open_port():
+    # Pseudo-terminal pair: the sketch writes to the master, app.py opens the slave
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    return master, slave, os.ttyname(slave)
+
+
+def run(sketch, room, master, speed: float, loss: float, rng, drain_s: float = 30.0) -> int:
+    # Frames every 100 ms of sketch time until the room is empty and every event is acknowledged
+    now = 0
+    legacy_lines = 0
+    while True:
+        try:
+            data = os.read(master, 4096)
+        except BlockingIOError:
+            data = b""
+        if data and rng.random() >= loss:
+            sketch.read_acks(data)
+        faces = room.faces(now)
+        legacy_lines += sum(1 for f in faces if f)
+        sketch.loop(faces, now)
+        if now > room.end_ms + sketch.HOLD_MS and not sketch.tracked and not sketch.outbox:
+            return legacy_lines
+        if now > room.end_ms + drain_s * 1000:
+            return legacy_lines
+        now += 100
+        time.sleep(0.1 / speed)
+
+
+# Runs inside the child: app.py's own reader on the simulated port
+CHILD = r"""
+import sys, time
+sys.path.insert(0, sys.argv[1])
+import app
+flask_app = app.create_app(start=True)
+site = next(iter(flask_app.extensions["tenants"].values()))
+site.ready.wait(10)
+cpu = time.process_time()
+sys.stdin.read()
+time.sleep(0.5)
+link = site.sources[0].link
+print("STATE", link.last, len(link.in_view), time.process_time() - cpu, flush=True)
+"""
+
+INIT = r"""
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+site = next(iter(app.create_app().extensions["tenants"].values()))
+with site.db.cursor():
+    pass
+"""
+
+
+def selftest(args, event_mode: bool) -> bool:
+    rng = random.Random(args.seed)
+    room = Classroom(args.students, args.seconds, args.seed)
+    loss = args.loss if event_mode else 0.0  # the old protocol has no way to recover a lost line
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "sim.db")
+        env = dict(os.environ, ATTENDANCE_DB=db, SYNC_URL="", BACKUP_CRON="", ROLLUP_CRON="")
+        subprocess.run([sys.executable, "-c", INIT, HERE], env=env, check=True, stdout=subprocess.DEVNULL)
+        conn = sqlite3.connect(db)
+        conn.executemany("INSERT INTO users(id, name, class) VALUES (?,?,?)",
+                         [(i, f"Student {i}", "Class A") for i in range(1, args.students + 1)])
+        conn.commit()
+        conn.close()
+
+        master, slave, port = open_port()
+        env["SERIAL_PORT"] = port
+        child = subprocess.Popen([sys.executable, "-c", CHILD, HERE], env=env, text=True,
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        time.sleep(1.0)  # port opened (a real Mega resets here and prints HELLO)
+
+        lines = [0, 0]  # sent, dropped
+
+        def write(line):
+            lines[0] += 1
+            if rng.random() < loss:
+                lines[1] += 1
+                return
+            os.write(master, (line + "\r\n").encode())
+
+        sketch = Sketch(write, event_mode)
+        sketch.setup()
+        legacy_lines = run(sketch, room, master, args.speed, loss, rng)
+        out, _ = child.communicate("", timeout=30)
+        os.close(master)
+        os.close(slave)
+
+        _, last, in_view, cpu = next(l for l in out.splitlines() if l.startswith("STATE")).split()
+        conn = sqlite3.connect(db)
+        recorded = conn.execute("SELECT COUNT(*), COUNT(DISTINCT uid) FROM checkins").fetchone()
+        conn.close()
+
+    name = "events" if event_mode else "legacy"
+    print(f"[{name}] {args.students} students, {room.end_ms / 1000:.0f}s of camera time")
+    print(f"  serial lines    {lines[0]:7d}   (dropped {lines[1]}, resent {sketch.resent})")
+    print(f"  per-frame lines {legacy_lines:7d}   (what FACE:<ID> for every frame would send)")
+    print(f"  check-ins       {recorded[0]:7d}   ({recorded[1]} students)")
+    print(f"  Pi reader CPU   {float(cpu):7.3f}s")
+
+    ok = recorded[0] == recorded[1] == args.students
+    if event_mode:
+        ok = ok and not sketch.outbox and int(in_view) == 0 and int(last) == sketch.next_seq - 1
+        print(f"  unacked events  {len(sketch.outbox):7d}   in view on the Pi: {in_view}, last ACK: {last}")
+    print("[OK]" if ok else "[FAIL]", name)
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulate the HuskyLens/Arduino serial bridge")
+    ap.add_argument("--legacy", action="store_true", help="old sketch: FACE:<ID> every frame")
+    ap.add_argument("--students", type=int, default=30)
+    ap.add_argument("--seconds", type=float, default=120, help="arrivals are spread over this much camera time")
+    ap.add_argument("--speed", type=float, default=10, help="camera time runs this many times faster than real time")
+    ap.add_argument("--loss", type=float, default=0.05, help="fraction of lines lost in each direction")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--selftest", action="store_true", help="run app.py's reader against the simulator and check the DB")
+    ap.add_argument("--compare", action="store_true", help="with --selftest: run both protocols")
+    args = ap.parse_args()
+
+    if args.selftest:
+        modes = [True, False] if args.compare else [not args.legacy]
+        results = [selftest(args, mode) for mode in modes]
+        sys.exit(0 if all(results) else 1)
+
+    master, slave, port = open_port()
+    print(f"Simulated Arduino on {port}  (start the Pi with SERIAL_PORT={port})")
+    input("Press Enter once app.py is running... ")
+    rng = random.Random(args.seed)
+    sketch = Sketch(lambda line: None if rng.random() < args.loss else os.write(master, (line + "\r\n").encode()),
+                    not args.legacy)
+    sketch.setup()
+    run(sketch, Classroom(args.students, args.seconds, args.seed), master, args.speed, args.loss, rng)
+    print(f"Done: {sketch.sent} events sent, {sketch.resent} resent, {len(sketch.outbox)} unacknowledged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# File: raspberry_pi/bench_memory.py
+#
+# Memory benchmark: peak resident memory (VmHWM) of the attendance server on a
+# multi-million-row database while faces arrive on the serial port and every
+# heavy page is used, including a full CSV export. The serial port is a
+# pyserial loop:// port, so no hardware is needed.
+#
+# --parquet adds a full /export_parquet. Loading pyarrow alone costs tens of MB
+# of resident memory, so compare that run against a higher ceiling.
+#
+# Usage:
+#   python bench_memory.py                               # 2,000,000 generated check-ins, LOW_MEMORY=1
+#   python bench_memory.py --rows 5000000 --ceiling 96
+#   python bench_memory.py --db /path/to/attendance.db --compare
+#   python bench_memory.py --parquet --ceiling 128
+#
+# Exits with status 1 if the low-memory run peaks above --ceiling MB.
+
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside the child process: ingest + every page, then report the peak
+CHILD = r"""
+import sys, time
+sys.path.insert(0, sys.argv[1])
+faces, users, parquet = int(sys.argv[2]), int(sys.argv[3]), sys.argv[4] == "1"
+import app
+flask_app = app.create_app(start=True)
+site = next(iter(flask_app.extensions["tenants"].values()))
+site.ready.wait(10)
+client = flask_app.test_client()
+
+def get(url):
+    with client.get(url, buffered=False) as r:
+        for _ in r.response:
+            pass
+
+t0 = time.perf_counter()
+for i in range(faces):
+    site.sources[0].ser.write(f"FACE:{i * 7919 % (users + 50) + 1}\n".encode())
+    if i % 200 == 0:
+        get("/")
+        get(f"/attendance?before={i * 997 + 1}")
+while len(site.recent_events) < min(faces, site.recent_events.maxlen) or site.sources[0].ser.in_waiting:
+    time.sleep(0.01)
+for url in ["/attendance", "/attendance?q=Student%201", "/users", "/users?page=5", "/analytics",
+            "/classes", "/diagnostics", "/metrics", "/export_csv"]:
+    get(url)
+if parquet:
+    get("/export_parquet")
+print("PEAK", app.memory_kb()["VmHWM"], time.perf_counter() - t0, flush=True)
+"""
+
+# Creates the schema, then the DB is filled directly with SQL
+INIT = r"""
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+site = next(iter(app.create_app().extensions["tenants"].values()))
+with site.db.cursor():
+    pass
+"""
+
+CLASSES = 40
+
+
+def generate_db(dst: str, rows: int, users: int) -> None:
+    # rows check-ins spread over users, one round of every user each 10 minutes
+    env = dict(os.environ, ATTENDANCE_DB=dst)
+    subprocess.run([sys.executable, "-c", INIT, HERE], env=env, check=True, stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(dst)
+    start = int(time.time()) - (rows // users + 1) * 600
+    conn.executescript(f"""
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {CLASSES - 1})
+        INSERT INTO classes(classname) SELECT 'Class ' || i FROM n;
+        INSERT INTO class_ids(classname) SELECT classname FROM classes ORDER BY classname;
+        INSERT OR IGNORE INTO source_ids(source) VALUES ('bench');
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {users})
+        INSERT INTO users(id, name, class) SELECT i, 'Student ' || i, 'Class ' || (i % {CLASSES}) FROM n;
+        INSERT INTO user_history(hid, uid, name, cid, valid_from)
+        SELECT u.id, u.id, u.name, k.cid, {start} FROM users u JOIN class_ids k ON k.classname = u.class;
+    """)
+    conn.execute(f"""
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {rows - 1})
+        INSERT INTO checkins(hid, uid, cid, sid, ts, bucket)
+        SELECT h.hid, h.uid, h.cid, (SELECT sid FROM source_ids WHERE source = 'bench'), t.ts, t.ts / 60
+        FROM (SELECT i % {users} + 1 AS uid, {start} + i / {users} * 600 + i % {users} % 600 AS ts FROM n) t
+        JOIN user_history h ON h.hid = t.uid
+    """)
+    conn.commit()
+    conn.close()
+
+
+def run_child(db: str, faces: int, users: int, low_memory: bool, parquet: bool) -> tuple:
+    env = dict(os.environ, ATTENDANCE_DB=db, SERIAL_PORT="loop://", SYNC_URL="",
+               LOW_MEMORY="1" if low_memory else "0", BACKUP_CRON="", ROLLUP_CRON="")
+    out = subprocess.run([sys.executable, "-c", CHILD, HERE, str(faces), str(users), "1" if parquet else "0"], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    line = next(l for l in out.splitlines() if l.startswith("PEAK"))
+    peak_kb, seconds = line.split()[1:]
+    return int(peak_kb) / 1024, float(seconds)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure peak memory of the attendance server on a large DB")
+    ap.add_argument("--db", help="database to copy instead of generating one")
+    ap.add_argument("--rows", type=int, default=2_000_000, help="check-ins to generate")
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--faces", type=int, default=3000, help="FACE lines sent during the run")
+    ap.add_argument("--ceiling", type=float, default=64, help="max peak resident MB with LOW_MEMORY=1")
+    ap.add_argument("--compare", action="store_true", help="also run with the normal profile")
+    ap.add_argument("--parquet", action="store_true", help="also stream a full /export_parquet (needs pyarrow)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        t = time.perf_counter()
+        if args.db:
+            shutil.copyfile(args.db, db)
+            users = sqlite3.connect(db).execute("SELECT COUNT(*) FROM users").fetchone()[0] or args.users
+        else:
+            generate_db(db, args.rows, args.users)
+            users = args.users
+        rows = sqlite3.connect(db).execute("SELECT COUNT(*) FROM checkins").fetchone()[0]
+        print(f"DB: {args.db or '(generated)'}  check-ins: {rows:,}  users: {users}  ({time.perf_counter() - t:.1f}s)")
+
+        peak, seconds = run_child(db, args.faces, users, True, args.parquet)
+        print(f"  LOW_MEMORY=1   peak {peak:6.1f} MB   ({seconds:.1f}s)")
+        if args.compare:
+            full, seconds = run_child(db, args.faces, users, False, args.parquet)
+            print(f"  LOW_MEMORY=0   peak {full:6.1f} MB   ({seconds:.1f}s)")
+
+    if peak > args.ceiling:
+        print(f"[FAIL] peak {peak:.1f} MB > ceiling {args.ceiling:.0f} MB")
+        sys.exit(1)
+    print(f"[OK] within ceiling ({args.ceiling:.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
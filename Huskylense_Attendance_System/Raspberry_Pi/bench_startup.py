@@ -0,0 +1,120 @@
+# File: raspberry_pi/bench_startup.py
+#
+# Startup benchmark: how long after a (re)start until a FACE:<ID> line from the
+# Arduino is recorded again. Each run starts a fresh Python process, the same
+# as systemd does after Restart=always, with the serial port replaced by a
+# pyserial loop:// port so no hardware is needed.
+#
+# Usage:
+#   python bench_startup.py                  # copy of ./attendance.db if present, else a new DB
+#   python bench_startup.py --db /path/to/attendance.db --runs 10 --budget 0.5
+#
+# Exits with status 1 if the median time to the first recorded check-in is
+# above --budget seconds.
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside the child process. Phases are measured from interpreter start-up.
+CHILD = r"""
+import time, sys
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app
+t_import = time.perf_counter()
+flask_app = app.create_app()
+t_app = time.perf_counter()
+app.start_services(flask_app)
+site = next(iter(flask_app.extensions["tenants"].values()))
+site.ready.wait(10)
+t_ready = time.perf_counter()
+site.sources[0].ser.write(b"FACE:1\n")
+while True:
+    with site.db.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM checkins")
+        if cur.fetchone()[0]:
+            break
+    time.sleep(0.002)
+t_first = time.perf_counter()
+print("PHASES", t_import - t0, t_ready - t0, t_first - t0, t_app - t0, flush=True)
+"""
+
+
+# Runs the schema check/migration once so every timed run is a plain restart
+INIT = r"""
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+site = next(iter(app.create_app().extensions["tenants"].values()))
+with site.db.cursor():
+    pass
+"""
+
+
+def prepare_db(src: str | None, dst: str) -> None:
+    if src:
+        shutil.copyfile(src, dst)
+    env = dict(os.environ, ATTENDANCE_DB=dst)
+    subprocess.run([sys.executable, "-c", INIT, HERE], env=env, check=True, stdout=subprocess.DEVNULL)
+    conn = sqlite3.connect(dst)
+    conn.execute("INSERT OR IGNORE INTO users(id, name, class) VALUES (1, 'Benchmark', 'Class A')")
+    conn.commit()
+    conn.close()
+
+
+def run_once(db: str) -> tuple:
+    # Fresh check-in each run: clear the table so the natural key never ignores it
+    conn = sqlite3.connect(db)
+    conn.execute("DELETE FROM checkins")
+    conn.commit()
+    conn.close()
+
+    env = dict(os.environ, ATTENDANCE_DB=db, SERIAL_PORT="loop://", SYNC_URL="")
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD, HERE], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    wall = time.perf_counter() - start
+    line = next(l for l in out.splitlines() if l.startswith("PHASES"))
+    imp, ready, first, web = (float(x) for x in line.split()[1:])
+    return wall, imp, ready, first, web
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure restart time of the attendance pipeline")
+    ap.add_argument("--db", help="database to copy (default: ./attendance.db if it exists)")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget", type=float, default=0.5, help="max median seconds to first check-in")
+    args = ap.parse_args()
+
+    src = args.db or ("attendance.db" if os.path.exists("attendance.db") else None)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        prepare_db(src, db)
+
+        results = [run_once(db) for _ in range(args.runs)]
+
+    cols = list(zip(*results))
+    med = [statistics.median(c) for c in cols]
+    print(f"DB: {src or '(new)'}  runs: {args.runs}")
+    print(f"  import app          {med[1] * 1000:7.1f} ms")
+    print(f"  pipeline ready      {med[2] * 1000:7.1f} ms")
+    print(f"  first check-in      {med[3] * 1000:7.1f} ms   (process wall incl. interpreter: {med[0] * 1000:.1f} ms)")
+    print(f"  web app created     {med[4] * 1000:7.1f} ms")
+
+    if med[3] > args.budget:
+        print(f"[FAIL] first check-in {med[3]:.3f}s > budget {args.budget:.3f}s")
+        sys.exit(1)
+    print(f"[OK] within budget ({args.budget:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# Tests run against app.py on a throwaway DB per test, without serial ports or
+# background services:  cd raspberry_pi && python -m pytest tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SERIAL_PORT", "")
+os.environ.setdefault("SYNC_URL", "")
+
+import app as attendance  # noqa: E402
+
+
+@pytest.fixture
+def site(tmp_path):
+    # One default tenant on a fresh DB; yields (test client, tenant)
+    flask_app = attendance.create_app(str(tmp_path / "attendance.db"))
+    yield flask_app.test_client(), flask_app.extensions["tenants"]["default"]
+    attendance._local.tenant = None
+
+
+@pytest.fixture
+def client(site):
+    return site[0]
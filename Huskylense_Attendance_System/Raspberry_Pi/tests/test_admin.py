@@ -0,0 +1,30 @@
+import pytest
+
+from conftest import attendance
+
+# Routes that change state or hand out the whole DB
+ADMIN_ROUTES = [
+    ("post", "/backup", {}),
+    ("post", "/jobs/rollup/run", {}),
+    ("post", "/reports", {"from": "2026-03-01", "to": "2026-03-02"}),
+    ("get", "/backups/attendance-20260302-080000.db/download", None),
+]
+
+
+@pytest.mark.parametrize("method, url, data", ADMIN_ROUTES)
+def test_needs_admin_token(site, tmp_path, monkeypatch, method, url, data):
+    client, tenant = site
+    monkeypatch.setattr(attendance, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(tenant, "backup_dir", str(tmp_path / "backups"))
+    monkeypatch.setattr(tenant, "report_dir", str(tmp_path / "reports"))
+    monkeypatch.setattr(attendance, "jobs", attendance.JobScheduler())
+    for name in ("backup", "rollup"):
+        attendance.jobs.add(name, "", lambda: "", "test job")
+    (tmp_path / "backups").mkdir()
+    (tmp_path / "backups" / "attendance-20260302-080000.db").write_bytes(b"snapshot")
+
+    call = getattr(client, method)
+    assert call(url, data=data).status_code == 403
+    r = call(url, data=data, headers={"X-Admin-Token": "s3cret"})
+    assert r.status_code in (200, 302)
+    assert client.get("/reports").status_code == 200
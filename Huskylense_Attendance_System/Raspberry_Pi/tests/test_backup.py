@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import attendance
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def tenant(site, tmp_path, monkeypatch):
+    # The site with one user and its own backup folder; the test thread works for the site
+    client, tenant = site
+    client.post("/register", data={"id": "7", "name": "Ada", "class": "Class A"})
+    monkeypatch.setattr(tenant, "backup_dir", str(tmp_path / "backups"))
+    monkeypatch.setattr(attendance._local, "tenant", tenant, raising=False)
+    return tenant
+
+
+def names(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [r[0] for r in conn.execute("SELECT name FROM users ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_rotation_keeps_newest(tenant, monkeypatch):
+    monkeypatch.setattr(attendance, "BACKUP_KEEP", 2)
+    folder = tenant.backup_dir
+    os.makedirs(os.path.join(folder, ".view"))
+    old = ["attendance-20200101-000000.db.gz", "attendance-20200102-000000.db"]
+    for name in old:
+        open(os.path.join(folder, name), "wb").close()
+    open(os.path.join(folder, ".view", "attendance-20200101-000000.db"), "wb").close()
+
+    name = attendance.backup_now()
+    assert [b[0] for b in attendance.list_backups()] == [name, old[1]]
+    assert os.listdir(os.path.join(folder, ".view")) == []
+    assert names(os.path.join(folder, name)) == ["Ada"]
+    assert not tenant.backup_status["running"] and tenant.backup_status["last_ok"].startswith(name)
+
+
+@pytest.mark.parametrize("gz", [False, True])
+def test_restore_replaces_db_and_keeps_previous(tenant, tmp_path, monkeypatch, gz):
+    monkeypatch.setattr(attendance, "BACKUP_GZIP", gz)
+    snapshot = os.path.join(tenant.backup_dir, attendance.backup_now())
+    assert snapshot.endswith(".gz") == gz
+
+    dst = str(tmp_path / "restored.db")
+    conn = sqlite3.connect(dst)
+    conn.execute("CREATE TABLE users(id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("INSERT INTO users VALUES (1, 'Before')")
+    conn.commit()
+    conn.close()
+
+    attendance.restore_backup(snapshot, dst)
+    assert names(dst) == ["Ada"]
+    assert names(dst + ".before-restore") == ["Before"]
+    assert not os.path.exists(dst + ".restore")
+
+
+def test_restore_refuses_damaged_snapshot(tmp_path):
+    bad = tmp_path / "attendance-20200101-000000.db"
+    bad.write_bytes(b"SQLite format 3\x00" + b"\x00" * 200)
+    dst = tmp_path / "live.db"
+    dst.write_bytes(b"live")
+    with pytest.raises((SystemExit, sqlite3.DatabaseError)):
+        attendance.restore_backup(str(bad), str(dst))
+    assert dst.read_bytes() == b"live"
+
+
+def test_backup_and_restore_from_command_line(tmp_path):
+    env = dict(os.environ, ATTENDANCE_DB=str(tmp_path / "live.db"), BACKUP_DIR=str(tmp_path / "backups"),
+               SERIAL_PORT="", SYNC_URL="", TENANTS="")
+    conn = sqlite3.connect(env["ATTENDANCE_DB"])
+    conn.execute("CREATE TABLE users(id INTEGER PRIMARY KEY, name TEXT NOT NULL, class TEXT NOT NULL)")
+    conn.execute("INSERT INTO users VALUES (7, 'Ada', 'Class A')")
+    conn.commit()
+    conn.close()
+
+    run = lambda *args: subprocess.run([sys.executable, "app.py", *args], cwd=HERE, env=env,
+                                       capture_output=True, text=True, timeout=60)
+    out = run("--backup")
+    assert out.returncode == 0, out.stderr
+    [snapshot] = os.listdir(env["BACKUP_DIR"])
+
+    env["ATTENDANCE_DB"] = str(tmp_path / "new.db")
+    out = run("--restore", os.path.join(env["BACKUP_DIR"], snapshot))
+    assert out.returncode == 0, out.stderr
+    assert names(env["ATTENDANCE_DB"]) == ["Ada"]
@@ -0,0 +1,48 @@
+from conftest import attendance
+
+
+def test_cooldown_blocks_until_expiry():
+    cd = attendance.Cooldowns(10, 100)
+    assert cd.allow(1, 0)
+    assert not cd.allow(1, 9.9)
+    assert cd.allow(2, 5)
+    assert cd.allow(1, 10)
+    assert not cd.allow(2, 14)
+    assert len(cd) == 2
+
+
+def test_cooldown_drops_expired_ids_as_faces_arrive():
+    cd = attendance.Cooldowns(10, 100)
+    for uid in range(1, 6):
+        assert cd.allow(uid, uid)
+    assert len(cd) == 5
+    assert cd.allow(6, 13)  # 1, 2 and 3 have expired
+    assert len(cd) == 3
+    assert cd.allow(7, 100)
+    assert len(cd) == 1
+
+
+def test_cooldown_forgets_oldest_when_full():
+    cd = attendance.Cooldowns(60, 3)
+    for uid in (1, 2, 3):
+        assert cd.allow(uid, uid)
+    assert cd.allow(4, 4)
+    assert len(cd) == 3
+    assert cd.allow(1, 5)  # forgotten early: the checkins natural key is the backstop
+    assert not cd.allow(4, 6)
+    cd.clear()
+    assert len(cd) == 0
+
+
+def test_history_cache_stays_bounded(site, monkeypatch):
+    monkeypatch.setattr(attendance, "HISTORY_CACHE_MAX", 3)
+    db = site[1].db
+    with db.cursor("ingest") as cur:
+        first = [db.history_id(cur, uid, f"Student {uid}", "Class A", 1000 + uid) for uid in range(1, 9)]
+        assert len(db.history_ids) <= 3
+        # Entries dropped from the cache come back from user_history, not as new snapshots
+        again = [db.history_id(cur, uid, f"Student {uid}", "Class A", 2000) for uid in range(1, 9)]
+        assert again == first
+        assert len(db.history_ids) <= 3
+        cur.execute("SELECT COUNT(*) AS c FROM user_history")
+        assert cur.fetchone()["c"] == 8
@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import attendance
+
+
+@pytest.fixture
+def db(site, monkeypatch):
+    # Ten old check-ins (Ada and Bo, two days, 60 days ago) and two from yesterday;
+    # RETENTION_DAYS=30. The test thread works for the site.
+    tenant = site[1]
+    monkeypatch.setattr(attendance, "RETENTION_DAYS", 30)
+    monkeypatch.setattr(attendance, "SYNC_URL", "")
+    monkeypatch.setattr(attendance._local, "tenant", tenant, raising=False)
+    db = tenant.db
+    old = attendance.day_start((date.today() - timedelta(days=60)).isoformat())
+    recent = attendance.day_start((date.today() - timedelta(days=1)).isoformat())
+    rows = [(uid, name, old + day * 86400 + 8 * 3600 + n * 1800)
+            for day in (0, 1) for uid, name in ((1, "Ada"), (2, "Bo")) for n in range(3 if uid == 1 else 2)]
+    rows += [(1, "Ada", recent + 8 * 3600), (2, "Bo", recent + 9 * 3600)]
+    with db.cursor("ingest") as cur:
+        for uid, name, ts in sorted(rows, key=lambda r: r[2]):
+            cur.execute("INSERT INTO checkins(hid, uid, cid, sid, ts, bucket) VALUES (?,?,?,?,?,?)",
+                        (db.history_id(cur, uid, name, "Class A", ts), uid, db.class_id(cur, "Class A"),
+                         db.source_id(cur, "pi1"), ts, ts // attendance.BUCKET_SECONDS))
+        cur.connection.commit()
+        db.changed(cur)
+    return db
+
+
+def query(db, sql):
+    with db.cursor() as cur:
+        cur.execute(sql)
+        return [tuple(r) for r in cur.fetchall()]
+
+
+TOTAL = "SELECT (SELECT COUNT(*) FROM checkins) + (SELECT COALESCE(SUM(hits), 0) FROM presence)"
+PER_STUDENT = ("SELECT uid, SUM(n) FROM (SELECT uid, COUNT(*) AS n FROM checkins GROUP BY uid "
+               "UNION ALL SELECT uid, SUM(hits) FROM presence GROUP BY uid) GROUP BY uid ORDER BY uid")
+
+
+def test_compaction_keeps_totals(db):
+    before = query(db, PER_STUDENT)
+    assert before == [(1, 7), (2, 5)]
+    assert attendance.compact_checkins().startswith("10 check-in(s) compacted")
+    assert query(db, TOTAL) == [(12,)]
+    assert query(db, PER_STUDENT) == before
+    assert query(db, "SELECT uid, hits, last_ts - first_ts FROM presence ORDER BY day, uid") == [
+        (1, 3, 3600), (2, 2, 1800), (1, 3, 3600), (2, 2, 1800)]
+    assert query(db, "SELECT COUNT(*) FROM checkins") == [(2,)]
+
+    # A second run has nothing left to fold
+    assert attendance.compact_checkins().startswith("0 check-in(s)")
+    assert query(db, PER_STUDENT) == before
+
+
+def test_newest_row_stays_raw(db, monkeypatch):
+    # Everything is past retention: the newest check-in still stays, so seq never restarts
+    monkeypatch.setattr(attendance, "RETENTION_DAYS", 0)
+    assert attendance.compact_checkins().startswith("off")
+    monkeypatch.setattr(attendance, "RETENTION_DAYS", 1)
+    with db.cursor() as cur:
+        cur.execute("UPDATE checkins SET ts = ts - 10 * 86400, bucket = (ts - 10 * 86400) / ?", (attendance.BUCKET_SECONDS,))
+        cur.connection.commit()
+        db.changed(cur)
+    newest = query(db, "SELECT MAX(seq) FROM checkins")
+    attendance.compact_checkins()
+    assert query(db, "SELECT seq FROM checkins") == newest
+    assert query(db, TOTAL) == [(12,)]
+
+
+def test_unsynced_rows_stay_raw(db, monkeypatch):
+    monkeypatch.setattr(attendance, "SYNC_URL", "http://aggregator.invalid")
+    attendance.set_state("hwm", 4)
+    attendance.compact_checkins()
+    # seq 1-4 were acknowledged and are folded; 5 onwards wait for the aggregator
+    assert query(db, "SELECT seq FROM checkins ORDER BY seq") == [(s,) for s in range(5, 13)]
+    assert query(db, TOTAL) == [(12,)]
@@ -0,0 +1,34 @@
+import pytest
+
+from conftest import attendance
+
+
+def test_head_export_csv_releases_slot(site):
+    client, tenant = site
+    # A HEAD body is never iterated; the server only closes it
+    with client.head("/export_csv") as response:
+        assert response.status_code == 200
+    assert tenant.db.sched.admitted["export"] == 0
+    assert client.get("/export_csv").status_code == 200
+
+
+def test_export_csv_busy_when_slot_taken(site):
+    client, tenant = site
+    release = tenant.db.sched.admit("export")
+    try:
+        attendance.DB_ADMIT_WAIT, wait = 0, attendance.DB_ADMIT_WAIT
+        assert client.get("/export_csv").status_code == 503
+    finally:
+        attendance.DB_ADMIT_WAIT = wait
+        release()
+    assert client.get("/export_csv").status_code == 200
+
+
+def test_head_export_parquet_releases_shared_slot(site):
+    client, tenant = site
+    pytest.importorskip("pyarrow")
+    with client.head("/export_parquet") as response:
+        assert response.status_code == 200
+    assert tenant.db.sched.admitted["export"] == 0
+    assert client.get("/export_csv").status_code == 200
+    assert client.get("/export_parquet").status_code == 200
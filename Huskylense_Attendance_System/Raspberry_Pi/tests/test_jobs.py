@@ -0,0 +1,92 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from conftest import attendance
+
+
+def test_parse_cron_fields():
+    minutes, hours, days, months, weekdays, either = attendance.parse_cron("*/15 8-10 * * 1-5")
+    assert minutes == {0, 15, 30, 45} and hours == {8, 9, 10}
+    assert len(days) == 31 and len(months) == 12 and weekdays == {1, 2, 3, 4, 5} and not either
+    assert attendance.parse_cron("0 0 * * 7")[4] == {0, 7}
+    assert attendance.parse_cron("0 0 13 * 5")[5]
+    for bad in ("* * *", "60 * * * *", "5-1 * * * *", "0 0 32 * *", "x * * * *"):
+        with pytest.raises(ValueError):
+            attendance.parse_cron(bad)
+
+
+def test_cron_next():
+    at = datetime(2026, 3, 2, 2, 30, 15)  # a Monday
+    assert attendance.cron_next("30 2 * * *", at) == datetime(2026, 3, 3, 2, 30)
+    assert attendance.cron_next("*/15 * * * *", at) == datetime(2026, 3, 2, 2, 45)
+    assert attendance.cron_next("0 9 * * 6", at) == datetime(2026, 3, 7, 9, 0)
+    # Day of month and weekday both set: either one matches
+    assert attendance.cron_next("0 0 13 * 5", at) == datetime(2026, 3, 6, 0, 0)
+    assert attendance.cron_next("0 0 1 1 *", at) == datetime(2027, 1, 1, 0, 0)
+
+
+@pytest.fixture
+def scheduler(site):
+    # A scheduler of its own with one recording job; jobs run against the site's DB
+    tenant = site[1]
+    sched = attendance.JobScheduler()
+    sched.ran, sched.gate = [], threading.Event()
+    sched.gate.set()
+
+    def job():
+        sched.ran.append(time.time())
+        assert sched.gate.wait(5)
+        return "done"
+
+    sched.add("probe", "0 * * * *", job, "test job")
+    return sched, tenant
+
+
+def job_state(tenant):
+    with tenant.db.cursor() as cur:
+        cur.execute("SELECT runs, result FROM job_state WHERE name='probe'")
+        row = cur.fetchone()
+        return tuple(row) if row else None
+
+
+def wait_for(cond, seconds=5):
+    deadline = time.time() + seconds
+    while not cond() and time.time() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+
+def test_missed_run_happens_once_after_start(scheduler):
+    sched, tenant = scheduler
+    with tenant.db.cursor() as cur:
+        cur.execute("INSERT INTO job_state(name, last_run) VALUES ('probe', ?)", (int(time.time()) - 3 * 3600,))
+        cur.connection.commit()
+    sched.start({"default": tenant})
+    assert wait_for(lambda: job_state(tenant) == (1, "done"))
+    time.sleep(0.2)
+    assert len(sched.ran) == 1
+    assert sched.next[(tenant, "probe")] > datetime.now()
+
+
+def test_first_start_waits_for_schedule(scheduler):
+    sched, tenant = scheduler
+    sched.start({"default": tenant})
+    assert wait_for(lambda: (tenant, "probe") in sched.next)
+    time.sleep(0.2)
+    assert sched.ran == [] and job_state(tenant) is None
+
+
+def test_running_job_is_not_started_twice(scheduler):
+    sched, tenant = scheduler
+    sched.gate.clear()
+    assert sched.submit("probe", tenant)
+    assert wait_for(lambda: sched.ran)
+    assert not sched.submit("probe", tenant)
+    sched.gate.set()
+    assert wait_for(lambda: job_state(tenant) == (1, "done"))
+    assert sched.submit("probe", tenant)
+    assert wait_for(lambda: job_state(tenant) == (2, "done"))
+    assert len(sched.ran) == 2
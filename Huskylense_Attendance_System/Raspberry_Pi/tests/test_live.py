@@ -0,0 +1,75 @@
+import time
+
+from conftest import attendance
+
+
+def test_class_window_ring_rolls_over():
+    w = attendance.ClassWindow(5, 100)
+    w.arrive(100)
+    w.arrive(100)
+    w.arrive(101)
+    f = w.figures(101)
+    assert (f["arrivals_per_min"], f["busiest_minute"], f["arrivals_total"]) == (1.5, 2, 3)
+    assert w.figures(104)["arrivals_per_min"] == 3 / 5
+
+    # Minute 105 reuses minute 100's slot
+    f = w.figures(105)
+    assert (f["arrivals_per_min"], f["busiest_minute"], f["arrivals_total"]) == (1 / 5, 1, 3)
+    assert w.figures(10_000)["arrivals_per_min"] == 0
+    assert len(w.arrivals) == 5
+
+    # A clock stepping back never rewinds the ring
+    w.arrive(9_990)
+    assert w.minute == 10_000 and w.figures(10_000)["busiest_minute"] == 1
+
+
+def test_class_window_queue_peak_expires():
+    w = attendance.ClassWindow(5, 100)
+    w.move(100, 1)
+    w.move(100, 1)
+    w.move(101, -1)
+    f = w.figures(101)
+    assert (f["queue"], f["queue_peak"]) == (1, 2)
+    # Minute 101 started with two in the queue; it leaves the window at 106
+    assert w.figures(105)["queue_peak"] == 2
+    assert w.figures(106)["queue_peak"] == 1
+    w.move(107, -1)
+    w.move(107, -1)
+    assert w.figures(107)["queue"] == 0
+
+
+def test_occupancy_counts_each_student_once():
+    live = attendance.LiveStats()
+    now = time.time()
+    live.arrive(1, "Class A", now)
+    live.arrive(1, "Class A", now + 60)
+    live.arrive(2, "Class A", now + 60)
+    site, classes = live.figures(now + 60)
+    assert site["in_room"] == 2 and classes["Class A"]["in_room"] == 2
+    assert site["arrivals_total"] == 3
+
+    # Seen again at another class: counted there only
+    live.arrive(1, "Class B", now + 120)
+    site, classes = live.figures(now + 120)
+    assert (site["in_room"], classes["Class A"]["in_room"], classes["Class B"]["in_room"]) == (2, 1, 1)
+
+    # Out of the room OCCUPANCY_MINUTES after the last arrival
+    site, classes = live.figures(now + 120 + attendance.OCCUPANCY_MINUTES * 60)
+    assert (site["in_room"], classes["Class A"]["in_room"], classes["Class B"]["in_room"]) == (0, 0, 0)
+
+
+def test_door_queue_ignores_repeats():
+    live = attendance.LiveStats()
+    now = time.time()
+    live.arrive(1, "Class A", now)
+    live.enter(1, now)
+    live.enter(1, now + 1)
+    live.enter(2, now + 1)  # not arrived yet: site queue only
+    site, classes = live.figures(now + 1)
+    assert site["queue"] == 2 and classes["Class A"]["queue"] == 1
+    live.leave(1, now + 2)
+    live.leave(1, now + 2)
+    live.leave(3, now + 2)
+    live.leave(2, now + 2)
+    site, classes = live.figures(now + 2)
+    assert site["queue"] == 0 and classes["Class A"]["queue"] == 0
@@ -0,0 +1,71 @@
+import pytest
+
+from conftest import attendance
+
+
+@pytest.fixture
+def notifier(site, monkeypatch):
+    # A Notifier on the site's DB with one recipient on a recording sink, no coalescing delay.
+    # The test thread works for the site, as the notifier thread would.
+    monkeypatch.setattr(attendance._local, "tenant", site[1], raising=False)
+    sent, failing = [], []
+
+    def sink(address, message):
+        if failing:
+            raise OSError(failing[0])
+        sent.append(message)
+
+    monkeypatch.setitem(attendance.NOTIFY_SINKS, "test", sink)
+    monkeypatch.setattr(attendance, "NOTIFY_COALESCE", 0)
+    n = attendance.Notifier(attendance.parse_recipients("test:office"))
+    n.sent_messages, n.failing = sent, failing
+    return n
+
+
+def arrival(uid, name, time="2026-03-02 08:01:00"):
+    return {"id": uid, "name": name, "class": "Class A", "time": time}
+
+
+def queued():
+    with attendance.get_db().cursor() as cur:
+        cur.execute("SELECT attempts, next_try, error FROM notify_queue")
+        return cur.fetchall()
+
+
+def test_deliver_coalesces_repeat_arrivals(notifier):
+    notifier.publish("arrival", arrival(1, "Ada"))
+    notifier.publish("arrival", arrival(1, "Ada", "2026-03-02 08:05:00"))
+    notifier.publish("arrival", arrival(2, "Bo"))
+    notifier._persist()
+    assert notifier._deliver() is None
+    assert len(notifier.sent_messages) == 1
+    message = notifier.sent_messages[0]
+    assert [p["id"] for p in message["arrivals"]] == [1, 2]
+    assert message["arrivals"][0]["time"].endswith("08:01:00")
+    assert queued() == []
+
+
+def test_deliver_backs_off_then_sends(notifier):
+    notifier.failing.append("smtp down")
+    notifier.publish("arrival", arrival(1, "Ada"))
+    notifier._persist()
+    wait = notifier._deliver()
+    assert 0 < wait <= attendance.NOTIFY_RETRY_BASE
+    rows = queued()
+    assert [(r["attempts"], r["error"]) for r in rows] == [(1, "smtp down")]
+    assert notifier.failed == 1 and not notifier.sent_messages
+
+    # Not due yet: nothing is sent until the backoff has passed
+    notifier.failing.clear()
+    notifier._deliver()
+    assert not notifier.sent_messages
+    with attendance.get_db().cursor() as cur:
+        cur.execute("UPDATE notify_queue SET next_try = 0")
+        cur.connection.commit()
+    assert notifier._deliver() is None
+    assert len(notifier.sent_messages) == 1 and queued() == []
+
+
+def test_deliver_with_nothing_queued(notifier):
+    assert notifier._deliver() is None
+    assert notifier.sent_messages == [] and notifier.failed == 0
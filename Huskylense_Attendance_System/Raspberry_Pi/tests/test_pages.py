@@ -0,0 +1,12 @@
+def test_page_html_is_never_compiled_as_a_template(client):
+    # Page parts go into the precompiled layout as values
+    r = client.post("/classes", data={"action": "add", "classname": "{{ 7*7 }}"})
+    assert r.status_code == 200
+    assert b"{{ 7*7 }}" in r.data
+    assert b"AI Attendance" in r.data
+
+
+def test_cached_results_follow_writes(client):
+    assert b"Class Z" not in client.get("/classes").data
+    client.post("/classes", data={"action": "add", "classname": "Class Z"})
+    assert b"Class Z" in client.get("/classes").data
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from conftest import attendance
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # One tenant with a live read replica
+    monkeypatch.setattr(attendance, "REPLICA", True)
+    tenant = attendance.create_app(str(tmp_path / "attendance.db")).extensions["tenants"]["default"]
+    tenant.db.replica.rebuild(tenant)
+    for _ in range(200):
+        if tenant.db.replica.live:
+            break
+        time.sleep(0.01)
+    assert tenant.db.replica.live
+    return tenant.db
+
+
+def add_user(db, uid, name):
+    with db.cursor("ingest") as cur:
+        cur.execute("INSERT INTO users(id, name, class) VALUES (?,?,?)", (uid, name, "Class A"))
+        cur.connection.commit()
+        db.changed(cur, ("users",))
+
+
+def names(db):
+    with db.reader() as cur:
+        cur.execute("SELECT name FROM users ORDER BY id")
+        return [r["name"] for r in cur.fetchall()]
+
+
+def test_write_does_not_hold_file_while_replica_is_read(db):
+    counted = []
+
+    def count():
+        with db.cursor("ingest") as cur:
+            cur.execute("SELECT COUNT(*) AS c FROM users")
+            counted.append(cur.fetchone()["c"])
+
+    writer = threading.Thread(target=add_user, args=(db, 1, "Ada"))
+    with db.reader() as cur:
+        assert cur.connection is db.replica.conn
+        writer.start()
+        for _ in range(200):
+            if db.replica._pending:
+                break
+            time.sleep(0.01)
+        # The writer waits for the replica now; the file is free for the next check-in
+        reader = threading.Thread(target=count)
+        reader.start()
+        reader.join(2)
+        assert counted == [1]
+        assert writer.is_alive()
+    writer.join(5)
+    assert not writer.is_alive()
+    assert names(db) == ["Ada"]
+
+
+def test_bulk_change_takes_replica_offline(db):
+    add_user(db, 1, "Ada")
+    with db.cursor("background") as cur:
+        db.changed(cur, ("checkins",))
+    assert not db.replica.live
+    for _ in range(200):
+        if db.replica.live:
+            break
+        time.sleep(0.01)
+    assert names(db) == ["Ada"]
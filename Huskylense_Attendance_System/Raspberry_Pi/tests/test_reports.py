@@ -0,0 +1,77 @@
+import csv
+import json
+import os
+import time
+
+import pytest
+
+from conftest import attendance
+
+
+def at(day, hour):
+    return int(time.mktime(time.strptime(f"{day} {hour:02d}:00", "%Y-%m-%d %H:%M")))
+
+
+@pytest.fixture
+def tenant(site, tmp_path, monkeypatch):
+    # Class A: Ada on two days (twice on the first), Bo on one day plus one compacted
+    # day in presence; Class B: Cy once. The test thread works for the site.
+    tenant = site[1]
+    monkeypatch.setattr(tenant, "report_dir", str(tmp_path / "reports"))
+    monkeypatch.setattr(attendance._local, "tenant", tenant, raising=False)
+    db = tenant.db
+    with db.cursor("ingest") as cur:
+        cur.executemany("INSERT INTO users(id, name, class) VALUES (?,?,?)",
+                        [(1, "Ada", "Class A"), (2, "Bo", "Class A"), (3, "Cy", "Class B")])
+        for uid, name, cls, ts in ((1, "Ada", "Class A", at("2026-03-02", 8)), (1, "Ada", "Class A", at("2026-03-02", 13)),
+                                   (1, "Ada", "Class A", at("2026-03-03", 8)), (2, "Bo", "Class A", at("2026-03-02", 9)),
+                                   (3, "Cy", "Class B", at("2026-03-03", 9))):
+            cur.execute("INSERT INTO checkins(hid, uid, cid, sid, ts, bucket) VALUES (?,?,?,?,?,?)",
+                        (db.history_id(cur, uid, name, cls, ts), uid, db.class_id(cur, cls), db.source_id(cur, "pi1"),
+                         ts, ts // attendance.BUCKET_SECONDS))
+        cur.execute("INSERT INTO presence(cid, day, uid, hid, sid, first_ts, last_ts, hits) VALUES (?,?,?,?,?,?,?,?)",
+                    (db.class_id(cur, "Class A"), "2026-03-01", 2, db.history_id(cur, 2, "Bo", "Class A", 0),
+                     db.source_id(cur, "pi1"), at("2026-03-01", 8), at("2026-03-01", 10), 3))
+        cur.connection.commit()
+        db.changed(cur)
+    return tenant
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_class_report_counts_checkins_and_presence(tenant, tmp_path):
+    out = tmp_path / "one"
+    out.mkdir()
+    summary = attendance.build_class_report(tenant.db.path, str(out), "Class A", "2026-03-01", "2026-03-03")
+    assert summary == {"class": "Class A", "slug": "Class_A", "students": 2, "sessions": 3, "checkins": 7, "rate": 66.7}
+
+    students = read_csv(out / "Class_A.csv")
+    assert students[0][:6] == ["ID", "Name", "Days Present", "Sessions", "Rate %", "Check-ins"]
+    assert [r[:6] for r in students[1:]] == [["1", "Ada", "2", "3", "66.7", "3"], ["2", "Bo", "2", "3", "66.7", "4"]]
+    assert read_csv(out / "Class_A_sessions.csv")[1:] == [
+        ["2026-03-01", "1", "2", "50.0"], ["2026-03-02", "2", "2", "100.0"], ["2026-03-03", "1", "2", "50.0"]]
+    assert "Class A: attendance 2026-03-01 to 2026-03-03" in (out / "Class_A.html").read_text(encoding="utf-8")
+
+
+def test_report_run_writes_every_class_and_manifest(tenant):
+    run_id = attendance.start_report("2026-03-01", "2026-03-03")
+    state = tenant.report_runs[run_id]
+    deadline = time.time() + 60
+    while not state["finished"] and time.time() < deadline:
+        time.sleep(0.05)
+    assert state["finished"] and state["finished"] != "failed" and not state["errors"]
+
+    folder = os.path.join(tenant.report_dir, run_id)
+    assert sorted(os.listdir(folder)) == sorted(
+        ["index.html", "manifest.json"] + [f"{s}{x}" for s in ("Class_A", "Class_B") for x in (".csv", "_sessions.csv", ".html")])
+    with open(os.path.join(folder, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert (manifest["total"], manifest["done"]) == (2, 2)
+    assert [(c["class"], c["students"], c["checkins"]) for c in manifest["classes"]] == [("Class A", 2, 7), ("Class B", 1, 1)]
+
+    # A restarted service finds the run through its manifest
+    tenant.report_runs.clear()
+    assert [r for r, _ in attendance.list_reports()] == [run_id]
@@ -0,0 +1,71 @@
+import pytest
+
+from conftest import attendance
+
+PEOPLE = [(1, "Ann Smith"), (2, "Annabel Jones"), (3, "Bob Annson"), (4, "Émile Dupont")]
+
+
+@pytest.fixture
+def db(site, monkeypatch):
+    # The site's DB with PEOPLE and three check-ins each, an hour apart; the test thread works for the site
+    tenant = site[1]
+    monkeypatch.setattr(attendance._local, "tenant", tenant, raising=False)
+    db = tenant.db
+    with db.cursor("ingest") as cur:
+        cur.executemany("INSERT INTO users(id, name, class) VALUES (?, ?, 'Class A')", PEOPLE)
+        for n in range(3):
+            for uid, name in PEOPLE:
+                ts = 1772438400 + n * 3600 + uid
+                cur.execute(
+                    "INSERT INTO checkins(hid, uid, cid, sid, ts, bucket) VALUES (?,?,?,?,?,?)",
+                    (db.history_id(cur, uid, name, "Class A", ts), uid, db.class_id(cur, "Class A"),
+                     db.source_id(cur, "pi1"), ts, ts // attendance.BUCKET_SECONDS),
+                )
+        cur.connection.commit()
+        db.changed(cur)
+    return db
+
+
+def user_names(q):
+    return sorted(r["name"] for r in attendance.search_users(q)[0])
+
+
+def record_names(q):
+    return sorted({r["name"] for r in attendance.search_records(q, limit=100)[0]})
+
+
+def test_fts_matches_word_prefixes(db):
+    if not db.fts:
+        pytest.skip("SQLite without FTS5")
+    assert user_names("ann") == ["Ann Smith", "Annabel Jones", "Bob Annson"]
+    assert user_names("ann sm") == ["Ann Smith"]
+    assert user_names("emi") == ["Émile Dupont"]
+    assert record_names("jon") == ["Annabel Jones"]
+    assert attendance.search_users("ann")[1] == 3
+
+
+def test_like_fallback_matches_name_start(db, monkeypatch):
+    monkeypatch.setattr(db, "fts", False)
+    assert user_names("ann") == ["Ann Smith", "Annabel Jones"]
+    assert record_names("ann") == ["Ann Smith", "Annabel Jones"]
+    assert user_names("smith") == []
+
+
+def test_keyset_pages_cover_every_row_once(db):
+    everything, _ = attendance.search_records(limit=100)
+    assert len(everything) == 12
+
+    seen, before = [], ""
+    while True:
+        rows, before = attendance.search_records(before=before, limit=5)
+        seen += [r["seq"] for r in rows]
+        if not before:
+            break
+    assert seen == [r["seq"] for r in everything]
+    assert [r["ts"] for r in everything] == sorted((r["ts"] for r in everything), reverse=True)
+
+    # Paging through one name's rows stops after its last row
+    rows, before = attendance.search_records("bob", limit=2)
+    assert [r["name"] for r in rows] == ["Bob Annson"] * 2 and before
+    rows, before = attendance.search_records("bob", before=before, limit=2)
+    assert len(rows) == 1 and before == ""
@@ -0,0 +1,137 @@
+import os
+import time
+
+import pytest
+
+from conftest import attendance
+
+arduino_sim = pytest.importorskip("arduino_sim")
+pytest.importorskip("serial")
+
+
+class Bench:
+    """app.py's reader on one end of a pseudo-terminal, the simulated sketch on the other."""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.master, self.slave, port = arduino_sim.open_port()
+        self.source = attendance.SerialSource(port)
+        self.now = 0  # sketch millis()
+        self.lost = []  # lines dropped on the way to the Pi
+        self.drop = lambda line: False
+
+    def write(self, line):
+        if self.drop(line):
+            self.lost.append(line)
+        else:
+            os.write(self.master, (line + "\r\n").encode())
+
+    def sketch(self, event_mode=True):
+        sketch = arduino_sim.Sketch(self.write, event_mode)
+        sketch.setup()
+        return sketch
+
+    def frame(self, sketch, faces=()):
+        # One 100 ms pass of loop(), after reading the Pi's ACKs
+        try:
+            sketch.read_acks(os.read(self.master, 4096))
+        except BlockingIOError:
+            pass
+        sketch.loop(list(faces), self.now)
+        self.now += 100
+
+    def settle(self, sketch, seconds=10):
+        # Empty frames until every event is acknowledged; faces in view stay tracked
+        deadline = time.time() + seconds
+        while sketch.outbox and time.time() < deadline:
+            time.sleep(0.01)
+            for face_id in sketch.tracked:
+                sketch.tracked[face_id] = self.now
+            self.frame(sketch)
+        return not sketch.outbox
+
+    def checked_in(self):
+        with self.tenant.db.cursor() as cur:
+            cur.execute("SELECT uid FROM checkins ORDER BY uid")
+            return [r["uid"] for r in cur.fetchall()]
+
+    def close(self):
+        if self.source.ser is not None:
+            self.source.ser.close()
+        os.close(self.master)
+
+
+@pytest.fixture
+def bench(site):
+    client, tenant = site
+    for uid in range(1, 21):
+        client.post("/register", data={"id": str(uid), "name": f"Student {uid}", "class": "Class A"})
+    bench = Bench(tenant)
+    attendance.spawn(tenant, attendance.reader, "reader", bench.source)
+    assert tenant.ready.wait(10)
+    yield bench
+    bench.close()
+
+
+def test_lost_event_is_resent_and_acked(bench):
+    sketch = bench.sketch()
+    bench.frame(sketch, [1])
+    assert bench.settle(sketch)
+    bench.drop = lambda line: line == "ENTER:2:2"
+    bench.frame(sketch, [1, 2])
+    bench.drop = lambda line: False
+    bench.frame(sketch, [1, 2, 3])
+    assert bench.settle(sketch)
+    assert bench.lost == ["ENTER:2:2"] and sketch.resent >= 2
+    assert bench.checked_in() == [1, 2, 3]
+    assert bench.source.link.last == 3
+    assert sorted(bench.source.link.in_view) == [1, 2, 3]
+
+
+def test_hello_restarts_sequence(bench):
+    sketch = bench.sketch()
+    for faces in ([1], [1, 2], [1, 2, 3]):
+        bench.frame(sketch, faces)
+    assert bench.settle(sketch)
+    assert bench.source.link.last == 3
+
+    # The Mega resets: numbering starts again at 1 and the faces it tracked are gone
+    sketch = bench.sketch()
+    bench.frame(sketch, [4])
+    assert bench.settle(sketch)
+    assert bench.source.link.last == 1
+    assert list(bench.source.link.in_view) == [4]
+    assert bench.checked_in() == [1, 2, 3, 4]
+    assert bench.tenant.live.site.queue == 1
+
+
+def test_from_skips_events_the_sketch_dropped(bench):
+    sketch = bench.sketch()
+    bench.frame(sketch, [1])
+    assert bench.settle(sketch)
+
+    # The Pi hears nothing while 19 more faces arrive: the 16-event outbox drops the oldest three
+    bench.drop = lambda line: True
+    faces = [1]
+    for face_id in range(2, 21):
+        faces.append(face_id)
+        bench.frame(sketch, faces)
+    assert [e[0] for e in sketch.outbox] == list(range(5, 21))
+    bench.drop = lambda line: False
+    assert bench.settle(sketch)
+    assert bench.source.link.last == 20
+    assert bench.checked_in() == [1] + list(range(5, 21))
+
+
+def test_legacy_face_lines(bench):
+    sketch = bench.sketch(event_mode=False)
+    for _ in range(3):
+        bench.frame(sketch, [1, 0, 2])
+    deadline = time.time() + 5
+    while bench.checked_in() != [1, 2] and time.time() < deadline:
+        time.sleep(0.01)
+    assert bench.checked_in() == [1, 2]
+    assert bench.source.link.last is None
+    outcomes = [(e.face_id, e.outcome) for e in bench.tenant.recent_events]
+    assert outcomes[:2] == [(1, "recorded"), (2, "recorded")]
+    assert all(o == "cooldown" for _, o in outcomes[2:])
@@ -0,0 +1,14 @@
+import sqlite3
+
+from conftest import attendance
+
+
+def test_executemany_and_executescript_are_timed(monkeypatch):
+    monkeypatch.setattr(attendance, "SLOW_SQL_MS", 0.000001)
+    before = attendance.slow_sql.total
+    cur = sqlite3.connect(":memory:").cursor(attendance.TimedCursor)
+    cur.executescript("CREATE TABLE t(x INTEGER);")
+    cur.executemany("INSERT INTO t(x) VALUES (?)", [(1,), (2,)])
+    assert attendance.slow_sql.total == before + 2
+    assert attendance.slow_sql.entries[-1]["sql"] == "INSERT INTO t(x) VALUES (?)"
+    assert attendance.slow_sql.entries[-1]["params"] == "(1,)"
@@ -0,0 +1,92 @@
+import gzip
+import json
+import threading
+
+import pytest
+
+from conftest import attendance
+
+
+def post(client, payload, token="s3cret", raw=None):
+    body = raw if raw is not None else gzip.compress(json.dumps(payload).encode())
+    return client.post("/sync/ingest", data=body,
+                       headers={"Content-Encoding": "gzip", "X-Sync-Token": token, "Content-Type": "application/json"})
+
+
+def batch(*records):
+    return {"node": "pi1", "epoch": "e1", "records": [list(r) for r in records]}
+
+
+def test_ingest_stores_epoch_ts_once(site, monkeypatch):
+    client, tenant = site
+    monkeypatch.setattr(attendance, "SYNC_TOKEN", "s3cret")
+    ts = 1772438400  # 2026-03-02 08:00:00 UTC, whatever the local zone
+    record = (1, 7, "Ada", "Class A", ts, "pi1")
+    assert post(client, batch(record)).get_json() == {"acked": 1, "stored": 1}
+    assert post(client, batch(record)).get_json() == {"acked": 1, "stored": 0}
+    with tenant.db.cursor() as cur:
+        cur.execute("SELECT id, ts, source FROM records")
+        assert [tuple(r) for r in cur.fetchall()] == [(7, ts, "pi1")]
+
+
+def test_ingest_needs_token(client, monkeypatch):
+    monkeypatch.setattr(attendance, "SYNC_TOKEN", "")
+    assert post(client, batch(), token="").status_code == 403
+    monkeypatch.setattr(attendance, "SYNC_TOKEN", "s3cret")
+    assert post(client, batch(), token="wrong").status_code == 403
+    assert post(client, batch()).status_code == 200
+
+
+def test_ingest_caps_unpacked_size(client, monkeypatch):
+    monkeypatch.setattr(attendance, "SYNC_TOKEN", "s3cret")
+    monkeypatch.setattr(attendance, "SYNC_MAX_BYTES", 4096)
+    bomb = gzip.compress(b" " * 1_000_000)
+    assert len(bomb) < 4096
+    assert post(client, None, raw=bomb).status_code == 413
+    assert post(client, None, raw=b"x" * 5000).status_code == 413
+    assert post(client, None, raw=b"not gzip").status_code == 400
+
+
+@pytest.fixture
+def aggregator(tmp_path, monkeypatch):
+    # A second app on its own DB behind a real HTTP server; SYNC_URL points at it
+    from werkzeug.serving import make_server
+
+    agg = attendance.create_app(str(tmp_path / "aggregator.db"))
+    server = make_server("127.0.0.1", 0, agg, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("no_proxy", "127.0.0.1")
+    monkeypatch.setattr(attendance, "SYNC_URL", f"http://127.0.0.1:{server.port}")
+    monkeypatch.setattr(attendance, "SYNC_TOKEN", "s3cret")
+    yield agg.extensions["tenants"]["default"]
+    server.shutdown()
+
+
+def rows(tenant, sql):
+    with tenant.db.cursor() as cur:
+        cur.execute(sql)
+        return [tuple(r) for r in cur.fetchall()]
+
+
+def test_node_syncs_to_aggregator(site, aggregator, monkeypatch):
+    client, node = site
+    for uid, name in ((7, "Ada"), (8, "Bo")):
+        client.post("/register", data={"id": str(uid), "name": name, "class": "Class A"})
+    # The test thread works for the node, as its sync thread would
+    monkeypatch.setattr(attendance._local, "tenant", node, raising=False)
+    assert attendance.record_attendance(7) == "recorded"
+    assert attendance.record_attendance(8) == "recorded"
+    sent = rows(node, "SELECT seq, id, name, class, ts FROM records ORDER BY seq")
+
+    assert attendance.sync_once() == 2
+    got = "SELECT id, name, class, ts, source FROM records ORDER BY id"
+    assert rows(aggregator, got) == [(uid, name, cls, ts, node.node) for _, uid, name, cls, ts in sent]
+    assert attendance.get_state("hwm") == str(sent[-1][0])
+    assert attendance.sync_once() == 0
+
+    # The ack got lost: the node sends the batch again and nothing is stored twice
+    attendance.set_state("hwm", 0)
+    assert attendance.sync_once() == 2
+    assert attendance.get_state("hwm") == str(sent[-1][0])
+    assert len(rows(aggregator, got)) == 2
+    assert rows(aggregator, "SELECT node, last_seq, total FROM sync_peers") == [(node.node, sent[-1][0], 2)]
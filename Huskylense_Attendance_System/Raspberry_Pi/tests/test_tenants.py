@@ -0,0 +1,63 @@
+import pytest
+
+from conftest import attendance
+
+
+@pytest.fixture
+def sites(tmp_path, monkeypatch):
+    # Two tenants behind one router
+    monkeypatch.setattr(attendance, "TENANTS", f"north={tmp_path / 'north.db'};south={tmp_path / 'south.db'}")
+    flask_app = attendance.create_app()
+    yield flask_app.test_client(), flask_app.extensions["tenants"]
+    attendance._local.tenant = None
+
+
+def test_registration_stays_on_its_site(sites):
+    client, tenants = sites
+    r = client.post("/north/register", data={"id": "7", "name": "Ada", "class": "Class A"})
+    assert r.status_code == 302
+    assert r.headers["Location"].endswith("/north/users")
+
+    names = lambda prefix: [u["name"] for u in client.get(f"{prefix}/api/users").get_json()["items"]]
+    assert names("/north") == ["Ada"]
+    assert names("/south") == []
+
+
+def test_router_forgets_tenant_after_response(sites):
+    client, tenants = sites
+    with client.head("/north/export_csv") as r:
+        assert r.status_code == 200
+    assert attendance._local.tenant is None
+    assert tenants["north"].db.sched.admitted["export"] == 0
+    assert client.get("/north/export_csv").status_code == 200
+
+
+def test_root_sends_non_admins_to_first_site(sites, monkeypatch):
+    client, tenants = sites
+    monkeypatch.setattr(attendance, "ADMIN_TOKEN", "")
+    r = client.get("/", environ_base={"REMOTE_ADDR": "10.0.0.5"})
+    assert r.status_code == 302
+    assert r.headers["Location"].endswith("/north/")
+    assert client.get("/tenants", environ_base={"REMOTE_ADDR": "10.0.0.5"}).status_code == 302
+
+    r = client.get("/", environ_base={"REMOTE_ADDR": "127.0.0.1"})
+    assert r.status_code == 200
+    assert b"/south/" in r.data
+
+
+def test_each_app_has_its_own_tenants(tmp_path, monkeypatch):
+    a = attendance.create_app(str(tmp_path / "a.db"))
+    b = attendance.create_app(str(tmp_path / "b.db"))
+    assert a.extensions["tenants"]["default"] is not b.extensions["tenants"]["default"]
+    assert a.test_client().post("/register", data={"id": "7", "name": "Ada", "class": "Class A"}).status_code == 302
+    names = lambda app: [u["name"] for u in app.test_client().get("/api/users").get_json()["items"]]
+    assert names(a) == ["Ada"]
+    assert names(b) == []
+
+    started = []
+    monkeypatch.setattr(attendance.jobs, "start", started.append)
+    monkeypatch.setattr(attendance, "SYNC_URL", "")
+    b.extensions["tenants"]["default"].sources.clear()
+    attendance.start_services(b)
+    attendance.start_services(b)
+    assert started == [b.extensions["tenants"]]